@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script keeps the gopoint cache (/home/root/.cache/gopoint) under a size
+budget.
+
+The cache holds downloaded assets, vela outputs and NPU graph binaries. When
+it grows over the budget, the least recently used entries are removed first.
+Entries pinned by a running demo are never removed.
+
+The budget (in bytes, K/M/G suffixes allowed) is read from the
+GOPOINT_CACHE_BUDGET environment variable, and defaults to DEFAULT_BUDGET.
+
+Usage:
+    python3 cache_manager.py list
+    python3 cache_manager.py verify
+    python3 cache_manager.py prune [--budget 512M] [--dry-run]
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+
+CACHE_FOLDER = "/home/root/.cache/gopoint"
+USAGE_FILE = ".usage.json"
+PINS_FOLDER = ".pins"
+
+SUBCACHES = ("vela", "graphs")
+"""Folders whose subfolders are cached entries of their own"""
+
+DEFAULT_BUDGET = 2 << 30
+"""Default size budget of the cache, in bytes"""
+
+_PINS_LOCK = threading.Lock()
+"""Serializes the pin updates of the threads of this process"""
+
+
+class Entry(NamedTuple):
+    """Evictable unit of the cache"""
+
+    path: str
+    size: int
+    last_used: float
+    pinned: bool
+
+
+def parse_size(text):
+    """Returns the number of bytes of a size like 512M or 2G"""
+    text = text.strip().upper()
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def budget():
+    """Returns the configured size budget in bytes"""
+    value = os.environ.get("GOPOINT_CACHE_BUDGET")
+    return parse_size(value) if value else DEFAULT_BUDGET
+
+
+def disk_usage(path):
+    """Returns the bytes used by a file or folder, not following links"""
+    if os.path.islink(path) or not os.path.isdir(path):
+        return os.lstat(path).st_size
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            total += os.lstat(os.path.join(folder, name)).st_size
+    return total
+
+
+def is_internal(name):
+    """Returns True for bookkeeping files that are not entries"""
+    return name.startswith(".") or name.endswith((".part", ".lock", ".tmp"))
+
+
+class CacheManager:
+    """Tracks the use of the cache entries and evicts them
+
+    Arguments:
+    folder -- cache folder
+    """
+
+    def __init__(self, folder=CACHE_FOLDER):
+        self.folder = folder
+
+    def update_usage(self, change):
+        """Applies change(usage) to the usage index, locked between processes"""
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, USAGE_FILE)
+        with open(path + ".lock", "w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    usage = json.load(file)
+            except (OSError, ValueError):
+                usage = {}
+            result = change(usage)
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(usage, file)
+            os.replace(path + ".tmp", path)
+            return result
+
+    def entry_path(self, path):
+        """Returns the cache entry containing path, or None"""
+        relative = os.path.relpath(os.path.abspath(path), self.folder)
+        if relative.startswith(".."):
+            return None
+        parts = relative.split(os.sep)
+        if parts[0] in SUBCACHES and len(parts) > 1:
+            return os.path.join(self.folder, parts[0], parts[1])
+        return os.path.join(self.folder, parts[0])
+
+    def touch(self, paths):
+        """Records that paths were used now"""
+        now = time.time()
+        entries = [self.entry_path(path) for path in paths]
+
+        def change(usage):
+            for entry in entries:
+                if entry is not None:
+                    usage[entry] = now
+
+        self.update_usage(change)
+
+    def pin(self, paths, pid=None):
+        """Protects paths from eviction while process pid (this one) runs"""
+        pid = pid or os.getpid()
+        folder = os.path.join(self.folder, PINS_FOLDER)
+        os.makedirs(folder, exist_ok=True)
+        pin_file = os.path.join(folder, f"{pid}.json")
+        # Threads of a launcher pin concurrently (prefetch, vela, prewarm)
+        with _PINS_LOCK, open(
+            os.path.join(folder, ".lock"), "w", encoding="utf-8"
+        ) as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(pin_file, encoding="utf-8") as file:
+                    pinned = set(json.load(file))
+            except (OSError, ValueError):
+                pinned = set()
+            pinned.update(self.entry_path(path) for path in paths)
+            pinned.discard(None)
+            handle, temporary = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                json.dump(sorted(pinned), file)
+            os.replace(temporary, pin_file)
+        self.touch(paths)
+
+    def unpin(self, pid=None):
+        """Releases the pins of process pid (this one)"""
+        pid = pid or os.getpid()
+        try:
+            os.remove(os.path.join(self.folder, PINS_FOLDER, f"{pid}.json"))
+        except FileNotFoundError:
+            pass
+
+    def pinned(self):
+        """Returns the entries pinned by running processes"""
+        folder = os.path.join(self.folder, PINS_FOLDER)
+        pinned = set()
+        for name in os.listdir(folder) if os.path.isdir(folder) else []:
+            pid = int(name.split(".")[0]) if name.split(".")[0].isdigit() else None
+            if pid is None:
+                continue
+            if not os.path.exists(f"/proc/{pid}"):
+                # Pins of processes that are gone
+                self.unpin(pid)
+                continue
+            try:
+                with open(os.path.join(folder, name), encoding="utf-8") as file:
+                    pinned.update(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return pinned
+
+    def entries(self):
+        """Returns all the cache entries"""
+        if not os.path.isdir(self.folder):
+            return []
+        usage = self.update_usage(dict)
+        pinned = self.pinned()
+        paths = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if is_internal(name):
+                continue
+            if name in SUBCACHES and os.path.isdir(path):
+                paths += [
+                    os.path.join(path, child)
+                    for child in os.listdir(path)
+                    if os.path.isdir(os.path.join(path, child))
+                ]
+            elif not os.path.islink(path):
+                paths.append(path)
+
+        entries = []
+        for path in paths:
+            try:
+                last_used = usage.get(path, os.lstat(path).st_mtime)
+                size = disk_usage(path)
+            except OSError:
+                continue
+            entries.append(Entry(path, size, last_used, path in pinned))
+        return entries
+
+    def remove(self, entry):
+        """Removes a cache entry and the files that refer to it"""
+        if os.path.isdir(entry.path):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+            folder, name = os.path.split(entry.path)
+            sidecar = os.path.join(folder, "." + name + ".verified")
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+        # Links to removed vela models (model_vela.tflite) would dangle
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if os.path.islink(path) and not os.path.exists(path):
+                os.remove(path)
+        self.update_usage(lambda usage: usage.pop(entry.path, None))
+
+    def prune(self, max_bytes=None, dry_run=False):
+        """Evicts least recently used entries until the cache fits max_bytes
+
+        Returns the list of evicted entries.
+        """
+        max_bytes = budget() if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(entry.size for entry in entries)
+        evicted = []
+        for entry in sorted(entries, key=lambda entry: entry.last_used):
+            if total <= max_bytes:
+                break
+            if entry.pinned:
+                continue
+            if not dry_run:
+                self.remove(entry)
+            total -= entry.size
+            evicted.append(entry)
+        return evicted
+
+
+def format_size(size):
+    """Returns a human readable size"""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def main():
+    """Command line interface of the cache manager"""
+    parser = argparse.ArgumentParser(description="gopoint cache manager")
+    parser.add_argument("--folder", default=CACHE_FOLDER, help="Cache folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List cache entries, least recently used first")
+    commands.add_parser("verify", help="Verify the hash of downloaded assets")
+    prune = commands.add_parser("prune", help="Evict entries over the budget")
+    prune.add_argument("--budget", help="Size budget, e.g. 512M (default: env)")
+    prune.add_argument("--dry-run", action="store_true", help="Only list entries")
+    args = parser.parse_args()
+
+    manager = CacheManager(args.folder)
+    if args.command == "list":
+        entries = sorted(manager.entries(), key=lambda entry: entry.last_used)
+        for entry in entries:
+            used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.last_used))
+            pin = " (pinned)" if entry.pinned else ""
+            print(
+                f"{format_size(entry.size):>8}  {used}  "
+                f"{os.path.relpath(entry.path, args.folder)}{pin}"
+            )
+        total = sum(entry.size for entry in entries)
+        print(f"Total: {format_size(total)} of {format_size(budget())} budget")
+    elif args.command == "verify":
+        # pylint: disable=import-outside-toplevel
+        import utils
+
+        utils.DOWNLOAD_FOLDER = args.folder
+        result = {}
+        utils.reverify_cache(lambda paths: result.update(paths=paths)).join()
+        mismatches = result.get("paths", [])
+        for path in mismatches:
+            print(f"Corrupted: {path}")
+        print(f"{len(mismatches)} corrupted file(s)")
+    else:
+        max_bytes = parse_size(args.budget) if args.budget else budget()
+        evicted = manager.prune(max_bytes, args.dry_run)
+        action = "Would evict" if args.dry_run else "Evicted"
+        for entry in evicted:
+            print(f"{action} {os.path.relpath(entry.path, args.folder)}")
+        print(f"{action} {format_size(sum(e.size for e in evicted))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script loads the demo catalog (demos.json).
+
+demos.json nests demos in categories and subcategories. The catalog flattens
+it once into a list of demos indexed by id, category and SoC, with the
+compatible SoCs split into sets. The parsed catalog is saved in a compact
+binary (marshal) cache that is used until demos.json changes, so menus do
+not need to walk the tree again.
+
+Usage:
+    python3 demo_catalog.py list [--soc imx93] [--category "Machine Learning"]
+    python3 demo_catalog.py show ID
+"""
+
+import argparse
+import json
+import marshal
+import os
+import threading
+import time
+from typing import NamedTuple
+
+DEMOS_FILE = "/home/root/.nxp-demo-experience/demos.json"
+CACHE_FILE = "/home/root/.cache/gopoint/.demos.cache"
+
+CACHE_FORMAT = 1
+"""Bumped when the layout of the binary cache changes"""
+
+
+class Demo(NamedTuple):
+    """Entry of the demo catalog
+
+    id -- unique id, the name for entries of demos.json without id
+    category -- top level category, e.g. Machine Learning
+    subcategory -- second level category, e.g. NNStreamer
+    compatible -- set of compatible SoCs, e.g. {"imx8mp", "imx93"}
+    """
+
+    id: str
+    name: str
+    category: str
+    subcategory: str
+    executable: str
+    compatible: frozenset
+    screenshot: str = ""
+    icon: str = ""
+    description: str = ""
+    source: str = ""
+
+
+def split_compatible(text):
+    """Returns the set of SoCs of a compatible string like "imx8mp, imx93" """
+    return frozenset(soc.strip().lower() for soc in text.split(",") if soc.strip())
+
+
+class Catalog:
+    """Demos of demos.json with their indexes
+
+    Arguments:
+    demos -- list of Demo, in the order of demos.json
+    """
+
+    def __init__(self, demos):
+        self.demos = demos
+        self.by_id = {}
+        self.by_category = {}
+        self.by_soc = {}
+        for demo in demos:
+            self.by_id.setdefault(demo.id, demo)
+            self.by_category.setdefault(demo.category, []).append(demo)
+            for soc in demo.compatible:
+                self.by_soc.setdefault(soc, []).append(demo)
+
+    def get(self, demo_id):
+        """Returns the Demo of demo_id, or None"""
+        return self.by_id.get(demo_id)
+
+    def categories(self):
+        """Returns the categories in the order of demos.json"""
+        return list(self.by_category)
+
+    def category(self, name, soc=None):
+        """Returns the demos of category name, only those for soc if given"""
+        demos = self.by_category.get(name, [])
+        if soc is None:
+            return list(demos)
+        return [demo for demo in demos if soc.lower() in demo.compatible]
+
+    def compatible(self, soc):
+        """Returns the demos running on soc"""
+        return list(self.by_soc.get(soc.lower(), []))
+
+
+def parse(tree):
+    """Returns the list of Demo of a demos.json tree"""
+    demos = []
+    for categories in tree["demos"]:
+        for category, groups in categories.items():
+            for subcategories in groups:
+                for subcategory, entries in subcategories.items():
+                    for entry in entries:
+                        demos.append(
+                            Demo(
+                                entry.get("id", entry["name"]),
+                                entry["name"],
+                                category,
+                                subcategory,
+                                entry["executable"],
+                                split_compatible(entry.get("compatible", "")),
+                                entry.get("screenshot", ""),
+                                entry.get("icon", ""),
+                                entry.get("description", ""),
+                                entry.get("source", ""),
+                            )
+                        )
+    return demos
+
+
+def read_cache(stamp, cache_file=CACHE_FILE):
+    """Returns the cached demos if they were parsed from the same demos.json"""
+    try:
+        with open(cache_file, "rb") as file:
+            cache_format, cached_stamp, demos = marshal.load(file)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if cache_format != CACHE_FORMAT or cached_stamp != stamp:
+        return None
+    return [Demo._make(demo) for demo in demos]
+
+
+def write_cache(stamp, demos, cache_file=CACHE_FILE):
+    """Saves demos parsed from the demos.json identified by stamp"""
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temporary = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            marshal.dump((CACHE_FORMAT, stamp, [tuple(demo) for demo in demos]), file)
+        os.replace(temporary, cache_file)
+    except OSError:
+        pass
+
+
+_CATALOG = {"stamp": None, "catalog": None}
+_CATALOG_LOCK = threading.Lock()
+
+
+def load(path=DEMOS_FILE, cache_file=CACHE_FILE):
+    """Returns the Catalog of path, parsed once per change of the file"""
+    stat = os.stat(path)
+    stamp = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+    with _CATALOG_LOCK:
+        if _CATALOG["stamp"] != stamp:
+            demos = read_cache(stamp, cache_file)
+            if demos is None:
+                with open(path, encoding="utf-8") as demos_json:
+                    demos = parse(json.load(demos_json))
+                write_cache(stamp, demos, cache_file)
+            _CATALOG["catalog"] = Catalog(demos)
+            _CATALOG["stamp"] = stamp
+        return _CATALOG["catalog"]
+
+
+def main():
+    """Command line interface of the demo catalog"""
+    parser = argparse.ArgumentParser(description="Demo catalog")
+    parser.add_argument("--file", default=DEMOS_FILE, help="demos.json to load")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="List demos")
+    listing.add_argument("--soc", help="Only demos compatible with this SoC")
+    listing.add_argument("--category", help="Only demos of this category")
+    show = commands.add_parser("show", help="Show a demo")
+    show.add_argument("id", help="Demo id")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    catalog = load(args.file)
+    elapsed = time.monotonic() - start
+    if args.command == "list":
+        if args.category:
+            demos = catalog.category(args.category, args.soc)
+        elif args.soc:
+            demos = catalog.compatible(args.soc)
+        else:
+            demos = catalog.demos
+        for demo in demos:
+            print(f"{demo.id:<20} {demo.category} / {demo.subcategory}: {demo.name}")
+        print(f"{len(demos)} demo(s), loaded in {elapsed * 1000:.1f} ms")
+    else:
+        demo = catalog.get(args.id)
+        if demo is None:
+            parser.error(f"unknown demo {args.id}")
+        for field, value in demo._asdict().items():
+            if isinstance(value, frozenset):
+                value = ", ".join(sorted(value))
+            print(f"{field}: {value}")
+
+
+if __name__ == "__main__":
+    main()
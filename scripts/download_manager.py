@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script downloads demo assets.
+
+Several assets are fetched concurrently. Each file is written to a .part file
+and hashed while it is written, so no second pass over the file is needed.
+Interrupted transfers are resumed with HTTP Range requests, first on the same
+URL and then on the alternative one.
+
+Run this file directly to download a few assets from a local stand-in server
+that drops the first transfer halfway:
+
+    python3 download_manager.py
+"""
+
+import hashlib
+import http.client
+import http.server
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+import verification
+
+NOT_FOUND = -1
+"""Asset not available in the downloads database"""
+
+FAILED = -2
+"""Asset could not be downloaded from any URL"""
+
+CORRUPTED = -3
+"""Downloaded asset does not match its hash"""
+
+CHUNK_SIZE = 1 << 16
+USER_AGENT = "gopoint-downloader"
+
+
+class DownloadError(Exception):
+    """Raised when an asset cannot be downloaded
+
+    code -- FAILED or CORRUPTED, as returned by utils.download_file
+    """
+
+    def __init__(self, path, code, message):
+        super().__init__(f"{os.path.basename(path)}: {message}")
+        self.path = path
+        self.code = code
+
+
+class Download(NamedTuple):
+    """Asset to download
+
+    path -- destination file
+    urls -- URLs tried in order, empty entries are skipped
+    sha1 -- expected SHA1, not checked if empty
+    sha256 -- expected SHA256, not checked if empty
+    """
+
+    path: str
+    urls: list
+    sha1: str = ""
+    sha256: str = ""
+
+
+class DownloadManager:
+    """Downloads assets concurrently with resume
+
+    Arguments:
+    workers -- number of assets downloaded at the same time
+    retries -- resume attempts per URL after an interrupted transfer
+    timeout -- socket timeout in seconds
+    """
+
+    def __init__(self, workers=4, retries=3, timeout=30):
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+
+    def transfer(self, url, part, digest, progress):
+        """Appends url to part from its current size, returns the new digest"""
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"User-Agent": USER_AGENT}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if offset and response.status != 206:
+                # Server ignored the range, start over
+                offset = 0
+                digest = verification.Hasher()
+            length = response.headers.get("Content-Length")
+            end = offset + int(length) if length else None
+            if progress is not None:
+                progress(offset, end)
+            with open(part, "ab" if offset else "wb") as file:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    offset += len(chunk)
+                    if progress is not None:
+                        progress(offset, None)
+        if end is not None and offset < end:
+            # Connection closed early, the caller resumes from here
+            raise http.client.IncompleteRead(b"", end - offset)
+        return digest
+
+    def fetch(self, download, progress=None):
+        """Downloads one asset, returns its path or raises DownloadError
+
+        progress -- called with (bytes done, total bytes or None)
+        """
+        part = download.path + ".part"
+        restarted = False
+        errors = []
+        urls = [url for url in download.urls if url]
+        while True:
+            digest = verification.Hasher()
+            if os.path.exists(part):
+                verification.hash_file(part, digest)
+            resumed = os.path.exists(part)
+            complete = False
+            for url in urls:
+                for _ in range(self.retries + 1):
+                    try:
+                        digest = self.transfer(url, part, digest, progress)
+                        complete = True
+                        break
+                    except urllib.error.HTTPError as error:
+                        if error.code == 416:
+                            # Range past the end: the .part file is complete
+                            complete = True
+                            break
+                        errors.append(f"{url}: HTTP {error.code}")
+                        if error.code < 500:
+                            break
+                    except (OSError, http.client.HTTPException) as error:
+                        errors.append(f"{url}: {error}")
+                        digest = verification.Hasher()
+                        if os.path.exists(part):
+                            verification.hash_file(part, digest)
+                if complete:
+                    break
+            if not complete:
+                raise DownloadError(download.path, FAILED, "; ".join(errors[-2:]))
+
+            hashes = digest.hexdigests()
+            if (download.sha1 and hashes["sha1"] != download.sha1) or (
+                download.sha256 and hashes["sha256"] != download.sha256
+            ):
+                os.remove(part)
+                # A resumed transfer may mix two versions of the file
+                if resumed and not restarted:
+                    restarted = True
+                    continue
+                raise DownloadError(download.path, CORRUPTED, "hash mismatch")
+            os.replace(part, download.path)
+            # Hashed while downloading, no need to hash it again on next use
+            verification.record(download.path, hashes)
+            return download.path
+
+    def fetch_all(self, downloads, progress=None):
+        """Downloads assets concurrently
+
+        Returns, in order, the path of each asset or its DownloadError.
+        progress -- called with (bytes done, total bytes) over all assets
+        """
+        lock = threading.Lock()
+        done = [0] * len(downloads)
+        totals = [0] * len(downloads)
+
+        def report(index):
+            def update(current, total):
+                with lock:
+                    done[index] = current
+                    if total is not None:
+                        totals[index] = total
+                    if progress is not None:
+                        progress(sum(done), max(sum(totals), sum(done)))
+
+            return update
+
+        def run(index):
+            try:
+                return self.fetch(downloads[index], report(index))
+            except DownloadError as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(run, range(len(downloads))))
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serves StandInServer.files with Range support"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers a GET request"""
+        data = self.server.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        start = 0
+        ranged = self.headers.get("Range", "")
+        if ranged.startswith("bytes="):
+            start = int(ranged[6:].split("-")[0])
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+            )
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.drop_next.pop(self.path.lstrip("/"), False):
+            # Drop the connection halfway, as a flaky link would
+            self.wfile.write(body[: len(body) // 2])
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keeps the output quiet"""
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """Local HTTP server standing in for the asset mirrors
+
+    Arguments:
+    files -- dict of file name to content
+    drop -- file names whose first transfer is interrupted
+    """
+
+    def __init__(self, files, drop=()):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.files = files
+        self.drop_next = {name: True for name in drop}
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def url(self, name):
+        """Returns the URL of a served file"""
+        return f"http://127.0.0.1:{self.server_address[1]}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    """Downloads assets from a stand-in server, resuming a dropped transfer"""
+    files = {
+        f"asset_{index}.bin": random.randbytes(2_000_000 + index) for index in range(4)
+    }
+    with StandInServer(
+        files, drop=["asset_0.bin"]
+    ) as server, tempfile.TemporaryDirectory() as folder:
+        downloads = [
+            Download(
+                os.path.join(folder, name),
+                [server.url(name), server.url("missing")],
+                hashlib.sha1(data).hexdigest(),
+            )
+            for name, data in files.items()
+        ]
+        downloads.append(
+            Download(os.path.join(folder, "bad.bin"), [server.url("missing")])
+        )
+        start = time.monotonic()
+        results = DownloadManager().fetch_all(downloads, lambda done, total: None)
+        elapsed = time.monotonic() - start
+        for download, result in zip(downloads, results):
+            if isinstance(result, DownloadError):
+                print(f"{os.path.basename(download.path)}: error {result.code}")
+            else:
+                print(f"{os.path.basename(download.path)}: ok")
+        print(f"Downloaded {len(files)} assets in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
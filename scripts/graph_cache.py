@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script manages the NPU graph binaries (.nb) cached by the VX delegate.
+
+Each model gets its own cache directory, keyed by the SHA256 of the model and
+the version of the VX delegate, so a cached graph of one model never hides a
+missing graph of another one. An index keeps the hashes of the cached graphs,
+hits and misses, and the last use of each entry to evict stale entries.
+
+Usage:
+    python3 graph_cache.py list
+    python3 graph_cache.py warm MODEL [MODEL ...]
+    python3 graph_cache.py evict [--max-age-days N]
+"""
+
+import argparse
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import cache_manager
+import launch_profiler
+
+GRAPH_FOLDER = "/home/root/.cache/gopoint/graphs"
+GRAPH_INDEX = "index.json"
+VX_DELEGATE = "/usr/lib/libvx_delegate.so"
+BENCHMARK_MODEL = "/usr/bin/tensorflow-lite-*/examples/benchmark_model"
+
+MAX_AGE_DAYS = 30
+"""Entries not used for this many days are evicted"""
+
+MAX_ENTRIES = 32
+"""Maximum number of models kept in the cache"""
+
+
+def file_sha256(path):
+    """Returns the SHA256 of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def delegate_version(delegate=VX_DELEGATE):
+    """Returns a fingerprint of the installed VX delegate"""
+    try:
+        stat = os.stat(os.path.realpath(delegate))
+    except OSError:
+        return "none"
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def benchmark_warm_up(model, env):
+    """Compiles the graph of model running benchmark_model once"""
+    binaries = glob.glob(BENCHMARK_MODEL)
+    if not binaries:
+        return False
+    result = subprocess.run(
+        [
+            binaries[0],
+            "--graph=" + model,
+            "--external_delegate_path=" + VX_DELEGATE,
+            "--num_runs=1",
+            "--warmup_runs=0",
+        ],
+        env=env,
+        capture_output=True,
+        check=False,
+    )
+    return result.returncode == 0
+
+
+class GraphCache:
+    """Index of the NPU graph binaries of each model
+
+    Arguments:
+    root -- folder holding the per-model cache folders and the index
+    delegate -- VX delegate whose version is part of the cache keys
+    """
+
+    def __init__(self, root=GRAPH_FOLDER, delegate=VX_DELEGATE):
+        self.root = root
+        self.delegate = delegate
+        self.version = delegate_version(delegate)
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def update(self, change):
+        """Applies change(index) to the index, locked against other processes"""
+        with self.lock, open(
+            os.path.join(self.root, GRAPH_INDEX + ".lock"), "w", encoding="utf-8"
+        ) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            path = os.path.join(self.root, GRAPH_INDEX)
+            try:
+                with open(path, encoding="utf-8") as index_file:
+                    index = json.load(index_file)
+            except (OSError, ValueError):
+                index = {}
+            index.setdefault("models", {})
+            index.setdefault("entries", {})
+            result = change(index)
+            with open(path + ".tmp", "w", encoding="utf-8") as index_file:
+                json.dump(index, index_file, indent=1)
+            os.replace(path + ".tmp", path)
+            return result
+
+    def index(self):
+        """Returns a copy of the index"""
+        return self.update(lambda index: json.loads(json.dumps(index)))
+
+    def model_hash(self, index, model):
+        """Returns the SHA256 of model, reusing the hash if it did not change"""
+        model = os.path.realpath(model)
+        stat = os.stat(model)
+        known = index["models"].get(model)
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return known["sha256"]
+        sha256 = file_sha256(model)
+        index["models"][model] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256,
+        }
+        return sha256
+
+    def key(self, index, model):
+        """Returns the cache key of model"""
+        digest = hashlib.sha256(
+            (self.model_hash(index, model) + self.version).encode("utf-8")
+        )
+        return digest.hexdigest()[:16]
+
+    def graph_dir(self, key):
+        """Returns the cache folder of key"""
+        return os.path.join(self.root, key)
+
+    def scan(self, key, entry=None):
+        """Returns the hash and the (size, mtime) of the graphs of key
+
+        Graphs with the size and mtime recorded in entry keep their recorded
+        hash, so lookups do not hash every graph again.
+        """
+        entry = entry or {}
+        artifacts = {}
+        stats = {}
+        for path in glob.glob(os.path.join(self.graph_dir(key), "*.nb")):
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            stats[name] = [stat.st_size, stat.st_mtime]
+            known = entry.get("artifacts", {}).get(name)
+            if known is not None and entry.get("stats", {}).get(name) == stats[name]:
+                artifacts[name] = known
+            else:
+                artifacts[name] = file_sha256(path)
+        return artifacts, stats
+
+    def lookup(self, model):
+        """Returns True if the graph of model is cached, counting hits/misses
+
+        Graphs written by the delegate since the last lookup are registered,
+        graphs that do not match their recorded hash are dropped.
+        """
+
+        def change(index):
+            key = self.key(index, model)
+            entry = index["entries"].setdefault(
+                key,
+                {
+                    "model": os.path.realpath(model),
+                    "sha256": index["models"][os.path.realpath(model)]["sha256"],
+                    "delegate": self.version,
+                    "artifacts": {},
+                    "hits": 0,
+                    "misses": 0,
+                },
+            )
+            found, stats = self.scan(key, entry)
+            valid = all(
+                found.get(name) == sha256 for name, sha256 in entry["artifacts"].items()
+            )
+            if not valid:
+                shutil.rmtree(self.graph_dir(key), ignore_errors=True)
+                found, stats = {}, {}
+            entry["artifacts"] = found
+            entry["stats"] = stats
+            entry["last_used"] = time.time()
+            hit = bool(found)
+            entry["hits" if hit else "misses"] += 1
+            return hit
+
+        return self.update(change)
+
+    def register(self, model):
+        """Records the graph binaries currently cached for model"""
+
+        def change(index):
+            key = self.key(index, model)
+            entry = index["entries"].get(key)
+            if entry is not None:
+                entry["artifacts"], entry["stats"] = self.scan(key, entry)
+            return key
+
+        return self.update(change)
+
+    def env(self, models):
+        """Returns the environment enabling the graph cache for models
+
+        Processes running several models use a folder linking the graphs of
+        all of them, since the delegate reads a single cache folder.
+        """
+
+        def change(index):
+            return [self.key(index, model) for model in models]
+
+        keys = self.update(change)
+        for key in keys:
+            os.makedirs(self.graph_dir(key), exist_ok=True)
+        if len(keys) == 1:
+            folder = self.graph_dir(keys[0])
+        else:
+            set_key = hashlib.sha256("".join(sorted(keys)).encode("utf-8"))
+            folder = os.path.join(self.root, "set-" + set_key.hexdigest()[:16])
+            os.makedirs(folder, exist_ok=True)
+            # The age of a set is the time of its last use
+            os.utime(folder)
+            for key in keys:
+                for path in glob.glob(os.path.join(self.graph_dir(key), "*.nb")):
+                    link = os.path.join(folder, os.path.basename(path))
+                    if not os.path.lexists(link):
+                        os.symlink(path, link)
+        # Keep the graphs while this demo runs
+        cache_manager.CacheManager(os.path.dirname(self.root)).pin(
+            [folder] + [self.graph_dir(key) for key in keys]
+        )
+        return {
+            "VIV_VX_ENABLE_CACHE_GRAPH_BINARY": "1",
+            "VIV_VX_CACHE_BINARY_GRAPH_DIR": folder,
+        }
+
+    def apply(self, models):
+        """Enables the graph cache for models in this process"""
+        os.environ.update(self.env(models))
+
+    def env_prefix(self, models):
+        """Returns the graph cache environment as a shell command prefix"""
+        return "".join(f"{name}={value} " for name, value in self.env(models).items())
+
+    def warm(self, model, warm_fn=None, on_miss=None):
+        """Compiles and caches the graph of model if it is not cached yet
+
+        Arguments:
+        model -- path of the .tflite model
+        warm_fn -- function running the model once in this process, by
+                   default benchmark_model runs it in a separate process
+        on_miss -- called before compiling a model that is not cached
+        """
+        if self.lookup(model):
+            return True
+        if on_miss is not None:
+            on_miss()
+        env = self.env([model])
+        if warm_fn is None:
+            with launch_profiler.phase("warmup"):
+                benchmark_warm_up(model, dict(os.environ, **env))
+        else:
+            saved = {name: os.environ.get(name) for name in env}
+            os.environ.update(env)
+            try:
+                warm_fn(model)
+            finally:
+                for name, value in saved.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+        self.register(model)
+        return bool(self.scan(self.key(self.index(), model))[0])
+
+    def prewarm(self, models, callback=None):
+        """Warms models in a background thread
+
+        Arguments:
+        models -- paths of the .tflite models
+        callback -- called with the list of models that could not be cached
+        """
+
+        def run():
+            failed = [model for model in models if not self.warm(model)]
+            if callback is not None:
+                callback(failed)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def evict(self, max_age_days=MAX_AGE_DAYS, max_entries=MAX_ENTRIES):
+        """Removes stale entries, returns the number of entries removed
+
+        Entries are stale when their model was removed or changed, when they
+        were compiled by another delegate version, when they were not used
+        for max_age_days, or when they are the least recently used beyond
+        max_entries. Folders without entry (the sets of multi-model demos,
+        leftovers) are removed once unused for max_age_days. Folders pinned
+        by a running demo are never removed.
+        """
+        in_use = cache_manager.CacheManager(os.path.dirname(self.root)).pinned()
+
+        def change(index):
+            limit = time.time() - max_age_days * 24 * 3600
+            stale = []
+            for key, entry in index["entries"].items():
+                if self.graph_dir(key) in in_use:
+                    continue
+                model = index["models"].get(entry["model"])
+                try:
+                    stat = os.stat(entry["model"])
+                    changed = model is None or (
+                        model["size"] != stat.st_size
+                        or model["mtime"] != stat.st_mtime
+                        or model["sha256"] != entry["sha256"]
+                    )
+                except OSError:
+                    changed = True
+                if (
+                    changed
+                    or entry["delegate"] != self.version
+                    or entry.get("last_used", 0) < limit
+                ):
+                    stale.append(key)
+            recent = sorted(
+                (key for key in index["entries"] if key not in stale),
+                key=lambda key: index["entries"][key].get("last_used", 0),
+                reverse=True,
+            )
+            stale += [
+                key for key in recent[max_entries:] if self.graph_dir(key) not in in_use
+            ]
+
+            for key in stale:
+                model = index["entries"].pop(key)["model"]
+                if not any(e["model"] == model for e in index["entries"].values()):
+                    index["models"].pop(model, None)
+                shutil.rmtree(self.graph_dir(key), ignore_errors=True)
+            keys = set(index["entries"])
+            for path in glob.glob(os.path.join(self.root, "*")):
+                name = os.path.basename(path)
+                if not os.path.isdir(path) or name in keys or path in in_use:
+                    continue
+                if os.path.getmtime(path) < limit:
+                    shutil.rmtree(path, ignore_errors=True)
+            return len(stale)
+
+        return self.update(change)
+
+
+def main():
+    """Command line interface of the graph cache"""
+    parser = argparse.ArgumentParser(description="NPU graph cache")
+    parser.add_argument("--root", default=GRAPH_FOLDER, help="Cache folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List cached graphs")
+    warm = commands.add_parser("warm", help="Compile and cache graphs")
+    warm.add_argument("models", nargs="+", help="TFLite models")
+    evict = commands.add_parser("evict", help="Remove stale graphs")
+    evict.add_argument("--max-age-days", type=float, default=MAX_AGE_DAYS)
+    evict.add_argument("--max-entries", type=int, default=MAX_ENTRIES)
+    args = parser.parse_args()
+
+    cache = GraphCache(args.root)
+    if args.command == "list":
+        for key, entry in cache.index()["entries"].items():
+            size = sum(
+                os.path.getsize(path)
+                for path in glob.glob(os.path.join(cache.graph_dir(key), "*.nb"))
+            )
+            print(
+                f"{key} {os.path.basename(entry['model'])}: "
+                f"{len(entry['artifacts'])} graph(s), {size / 1024:.0f} KB, "
+                f"{entry['hits']} hit(s), {entry['misses']} miss(es)"
+            )
+    elif args.command == "warm":
+        for model in args.models:
+            status = "cached" if cache.warm(model) else "not cached"
+            print(f"{model}: {status}")
+    else:
+        print(f"Evicted {cache.evict(args.max_age_days, args.max_entries)} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script loads the models of the demos on an inference backend.
+
+Demos get their interpreters from a backend instead of creating
+tflite_runtime interpreters and loading delegates themselves:
+
+    cpu     tflite_runtime on the CPU
+    vx      tflite_runtime with the VX delegate (i.MX 8M Plus NPU)
+    ethosu  tflite_runtime with the Ethos-U delegate (i.MX 93 NPU)
+    fake    canned output tensors returned after a fixed latency
+
+Every backend returns objects with the API of the tflite_runtime
+Interpreter, so the demos do not depend on the runtime and another one
+(e.g. onnxruntime) only needs a backend wrapping it. The fake backend needs
+neither tflite_runtime nor an NPU, so throughput, scheduling and pipelining
+can be measured on any Linux machine.
+
+GOPOINT_BACKEND forces the backend of all the demos. The fake backend then
+reads its tensors from the .npz file named by GOPOINT_FAKE_TENSORS, where
+MODEL/input is an array of the input shape and MODEL/N holds the frames
+returned by output N (frames on the first axis), MODEL being the file name
+of the model. GOPOINT_FAKE_LATENCY is the latency of an invoke in ms.
+
+Usage:
+    python3 inference_backend.py MODEL [--backend cpu] [--threads 4] [--runs 50]
+"""
+
+import argparse
+import os
+import statistics
+import time
+from typing import NamedTuple
+import numpy as np
+
+BACKEND_ENV = "GOPOINT_BACKEND"
+FAKE_TENSORS_ENV = "GOPOINT_FAKE_TENSORS"
+FAKE_LATENCY_ENV = "GOPOINT_FAKE_LATENCY"
+
+VX_DELEGATE = "/usr/lib/libvx_delegate.so"
+ETHOSU_DELEGATE = "/usr/lib/libethosu_delegate.so"
+
+BACKENDS = ("cpu", "vx", "ethosu", "fake")
+
+ANY_MODEL = "*"
+"""Fake model returned for the models without their own tensors"""
+
+
+class TFLiteBackend:
+    """Runs models with tflite_runtime, on an external delegate if given
+
+    Arguments:
+    name -- name of the backend
+    delegate -- external delegate library, None to run on the CPU
+    """
+
+    def __init__(self, name, delegate=None):
+        self.name = name
+        self.delegate = delegate
+
+    def load(self, model_path, num_threads=None):
+        """Returns an Interpreter of model_path
+
+        Raises ValueError when the model or the delegate cannot be loaded.
+        """
+        # Only the real backends need tflite_runtime
+        # pylint: disable=import-outside-toplevel
+        import tflite_runtime.interpreter as tflite
+
+        delegates = None
+        if self.delegate is not None:
+            delegates = [tflite.load_delegate(self.delegate)]
+        return tflite.Interpreter(
+            model_path=model_path,
+            num_threads=num_threads,
+            experimental_delegates=delegates,
+        )
+
+
+class FakeModel(NamedTuple):
+    """Tensors of a model run by the fake backend
+
+    outputs -- one array per output, the frames on the first axis
+    """
+
+    input_shape: tuple
+    outputs: list
+    input_dtype: type = np.float32
+
+
+class FakeInterpreter:
+    """Interpreter returning the outputs of the next frame at each invoke
+
+    Arguments:
+    model -- FakeModel to run
+    latency -- seconds an invoke takes
+    """
+
+    def __init__(self, model, latency=0.0):
+        self.model = model
+        self.latency = latency
+        # The first invoke moves to frame 0
+        self.frame = -1
+
+    def allocate_tensors(self):
+        """Nothing to allocate"""
+
+    def invoke(self):
+        """Waits for the latency and moves to the outputs of the next frame"""
+        if self.latency:
+            time.sleep(self.latency)
+        self.frame += 1
+
+    def set_tensor(self, index, value):
+        """Ignores the input, outputs do not depend on it"""
+
+    def get_tensor(self, index):
+        """Returns a copy of output index for the current frame"""
+        output = self.model.outputs[index - 1]
+        return output[self.frame % len(output)][np.newaxis].copy()
+
+    def get_input_details(self):
+        """Returns the details of the input tensor"""
+        return [
+            {
+                "index": 0,
+                "shape": np.array(self.model.input_shape, np.int32),
+                "dtype": self.model.input_dtype,
+            }
+        ]
+
+    def get_output_details(self):
+        """Returns the details of the output tensors"""
+        return [
+            {
+                "index": i + 1,
+                "shape": np.array((1,) + output.shape[1:], np.int32),
+                "dtype": output.dtype,
+            }
+            for i, output in enumerate(self.model.outputs)
+        ]
+
+
+class FakeBackend:
+    """Runs FakeModels instead of the models
+
+    Arguments:
+    models -- FakeModel of each model file name, ANY_MODEL for the others
+    latency -- seconds an invoke takes
+    """
+
+    name = "fake"
+
+    def __init__(self, models, latency=0.0):
+        self.models = models
+        self.latency = latency
+
+    def load(self, model_path, num_threads=None):
+        """Returns a FakeInterpreter of model_path
+
+        Raises ValueError when there are no tensors for the model.
+        """
+        name = os.path.basename(model_path)
+        model = self.models.get(name, self.models.get(ANY_MODEL))
+        if model is None:
+            raise ValueError(f"No fake tensors for {name}")
+        return FakeInterpreter(model, self.latency)
+
+    @classmethod
+    def from_env(cls):
+        """Returns the fake backend set up by the environment"""
+        path = os.environ.get(FAKE_TENSORS_ENV)
+        latency = float(os.environ.get(FAKE_LATENCY_ENV) or 0) / 1000
+        return cls(read_fake_models(path) if path else {}, latency)
+
+
+def read_fake_models(path):
+    """Returns the FakeModel of each model of a .npz file"""
+    inputs = {}
+    outputs = {}
+    with np.load(path) as data:
+        for key in data.files:
+            model, _, name = key.rpartition("/")
+            if name == "input":
+                inputs[model] = data[key]
+            elif name.isdigit():
+                outputs.setdefault(model, {})[int(name)] = data[key]
+    return {
+        model: FakeModel(
+            tuple(tensor.shape),
+            [outputs.get(model, {})[i] for i in sorted(outputs.get(model, {}))],
+            tensor.dtype.type,
+        )
+        for model, tensor in inputs.items()
+    }
+
+
+def create(name):
+    """Returns the backend called name, or the one forced by GOPOINT_BACKEND"""
+    name = os.environ.get(BACKEND_ENV) or name
+    if name == "cpu":
+        return TFLiteBackend("cpu")
+    if name == "vx":
+        return TFLiteBackend("vx", VX_DELEGATE)
+    if name == "ethosu":
+        return TFLiteBackend("ethosu", ETHOSU_DELEGATE)
+    if name == "fake":
+        return FakeBackend.from_env()
+    raise ValueError(f"Unknown inference backend: {name}")
+
+
+def for_device(inf_device, platform):
+    """Returns the backend running inf_device (CPU or NPU) on platform
+
+    Returns None when platform has no NPU delegate.
+    """
+    if os.environ.get(BACKEND_ENV):
+        return create(os.environ[BACKEND_ENV])
+    if inf_device != "NPU":
+        return create("cpu")
+    if platform == "i.MX8MP":
+        return create("vx")
+    if platform == "i.MX93":
+        return create("ethosu")
+    return None
+
+
+def main():
+    """Runs a model on a backend and prints its invoke latency"""
+    parser = argparse.ArgumentParser(description="Demo inference backends")
+    parser.add_argument("model", help="TFLite model")
+    parser.add_argument("--backend", choices=BACKENDS, default="cpu")
+    parser.add_argument("--threads", type=int, help="CPU threads")
+    parser.add_argument("--runs", type=int, default=50, help="Timed invokes")
+    args = parser.parse_args()
+
+    try:
+        interpreter = create(args.backend).load(args.model, args.threads)
+        interpreter.allocate_tensors()
+    except (ValueError, RuntimeError, OSError) as error:
+        parser.exit(1, f"Cannot load {args.model}: {error}\n")
+    details = interpreter.get_input_details()[0]
+    interpreter.set_tensor(
+        details["index"], np.zeros(details["shape"], dtype=details["dtype"])
+    )
+    # The first invoke compiles the graph of delegates
+    start = time.perf_counter()
+    interpreter.invoke()
+    print(f"First invoke: {(time.perf_counter() - start) * 1000:.2f} ms")
+    latencies = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        interpreter.invoke()
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(
+        f"{args.runs} invokes: mean {statistics.mean(latencies):.2f} ms, "
+        f"median {statistics.median(latencies):.2f} ms, min {min(latencies):.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script profiles the startup of the demos.
+
+Launchers report the phases of their startup (download, hash check, vela
+compile, delegate load, warm-up invoke, pipeline PLAYING) and the moment the
+demo is ready. Reports are only written when GOPOINT_LAUNCH_PROFILE names a
+file, so the calls cost nothing in normal use. The variable is inherited by
+child processes, and CLOCK_MONOTONIC is shared by all of them, so the events
+of a launcher and of the demo it spawns form a single timeline.
+
+The headless runner starts the demos of the catalog one after the other with
+GOPOINT_AUTOSTART set, so launchers start the demo with their default
+settings, and stops each demo once it is ready. It writes a startup latency
+report and compares it with a previous report.
+
+Usage:
+    python3 launch_profiler.py run [--ids ID ...] [--soc imx93] [--repeat 3]
+                                   [--output report.json] [--baseline old.json]
+    python3 launch_profiler.py show PROFILE
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import signal
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import demo_catalog
+
+PROFILE_ENV = "GOPOINT_LAUNCH_PROFILE"
+DEMO_ENV = "GOPOINT_DEMO_ID"
+AUTOSTART_ENV = "GOPOINT_AUTOSTART"
+
+PHASES = ("download", "verify", "vela", "delegate", "warmup", "playing")
+"""Startup phases, in the order they usually happen"""
+
+READY = "ready"
+"""Event reported once the demo shows results"""
+
+THRESHOLD = 0.2
+"""Relative slowdown reported as a regression"""
+
+MIN_DELTA = 0.1
+"""Slowdowns under this many seconds are not regressions"""
+
+
+class LaunchProfiler:
+    """Reports startup phases to the profile file
+
+    Arguments:
+    demo -- demo id, read from GOPOINT_DEMO_ID by default
+    path -- profile file, read from GOPOINT_LAUNCH_PROFILE by default
+    """
+
+    def __init__(self, demo=None, path=None):
+        self.path = path or os.environ.get(PROFILE_ENV)
+        self.demo = demo or os.environ.get(DEMO_ENV, "unknown")
+        self.lock = threading.Lock()
+        self.open_phases = {}
+        self.is_ready = False
+
+    @property
+    def enabled(self):
+        """True when a profile file is set"""
+        return bool(self.path)
+
+    def event(self, name, start, end=None):
+        """Appends an event to the profile file"""
+        if not self.enabled:
+            return
+        line = json.dumps(
+            {
+                "demo": self.demo,
+                "pid": os.getpid(),
+                "event": name,
+                "start": start,
+                "end": start if end is None else end,
+            }
+        )
+        with self.lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+    def begin(self, name):
+        """Starts phase name, for phases ending in another callback"""
+        if self.enabled:
+            with self.lock:
+                self.open_phases.setdefault(name, time.monotonic())
+
+    def end(self, name):
+        """Ends phase name started with begin"""
+        with self.lock:
+            start = self.open_phases.pop(name, None)
+        if start is not None:
+            self.event(name, start, time.monotonic())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Reports the time spent in the with block as phase name"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.event(name, start, time.monotonic())
+
+    def ready(self):
+        """Reports that the demo is ready, only the first call counts"""
+        with self.lock:
+            if self.is_ready:
+                return
+            self.is_ready = True
+        self.event(READY, time.monotonic())
+
+
+_PROFILER = None
+_PROFILER_LOCK = threading.Lock()
+
+
+def profiler():
+    """Returns the profiler shared by the callers of this process"""
+    global _PROFILER  # pylint: disable=global-statement
+    with _PROFILER_LOCK:
+        if _PROFILER is None:
+            _PROFILER = LaunchProfiler()
+        return _PROFILER
+
+
+def phase(name):
+    """Reports a with block as phase name to the shared profiler"""
+    return profiler().phase(name)
+
+
+def begin(name):
+    """Starts phase name on the shared profiler"""
+    profiler().begin(name)
+
+
+def end(name):
+    """Ends phase name on the shared profiler"""
+    profiler().end(name)
+
+
+def ready():
+    """Reports that the demo is ready to the shared profiler"""
+    profiler().ready()
+
+
+def autostart():
+    """Returns True if the launcher should start the demo without user input"""
+    return os.environ.get(AUTOSTART_ENV) == "1"
+
+
+def read_events(path):
+    """Returns the events of a profile file"""
+    events = []
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return events
+
+
+def timeline(events, launched):
+    """Returns the startup timeline of a launch
+
+    Arguments:
+    events -- events of one launch
+    launched -- monotonic time the launcher was spawned
+
+    The timeline has the time to ready (None if the demo never got ready)
+    and, for each phase, the seconds spent in it.
+    """
+    phases = {}
+    ready_time = None
+    for event in events:
+        if event["event"] == READY:
+            if ready_time is None or event["start"] < ready_time:
+                ready_time = event["start"]
+            continue
+        phases[event["event"]] = phases.get(event["event"], 0.0) + (
+            event["end"] - event["start"]
+        )
+    return {
+        "ready": None if ready_time is None else ready_time - launched,
+        "phases": phases,
+    }
+
+
+def launch(demo, timeout):
+    """Starts demo headless, returns its timeline once it is ready"""
+    with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as file:
+        path = file.name
+    env = dict(os.environ, **{PROFILE_ENV: path, DEMO_ENV: demo.id, AUTOSTART_ENV: "1"})
+    launched = time.monotonic()
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        demo.executable,
+        shell=True,
+        env=env,
+        # Demos waiting for keyboard input keep running until stopped
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        while time.monotonic() - launched < timeout and process.poll() is None:
+            if any(event["event"] == READY for event in read_events(path)):
+                break
+            time.sleep(0.1)
+    finally:
+        # The launcher and the demo it spawned share the session
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+    result = timeline(read_events(path), launched)
+    os.remove(path)
+    return result
+
+
+def summarize(timelines):
+    """Returns the median timeline of several launches of a demo"""
+    ready_times = [item["ready"] for item in timelines if item["ready"] is not None]
+    names = {name for item in timelines for name in item["phases"]}
+    return {
+        "ready": statistics.median(ready_times) if ready_times else None,
+        "failed": len(timelines) - len(ready_times),
+        "phases": {
+            name: statistics.median(item["phases"].get(name, 0.0) for item in timelines)
+            for name in names
+        },
+    }
+
+
+def regressions(report, baseline, threshold=THRESHOLD, min_delta=MIN_DELTA):
+    """Returns (demo, measure, before, after) for each slowdown since baseline"""
+    found = []
+    for demo, current in report["demos"].items():
+        previous = baseline["demos"].get(demo)
+        if previous is None:
+            continue
+        measures = [("ready", previous["ready"], current["ready"])]
+        measures += [
+            (name, seconds, current["phases"].get(name, 0.0))
+            for name, seconds in previous["phases"].items()
+        ]
+        for name, before, after in measures:
+            if before is None or after is None:
+                if after is None and before is not None:
+                    found.append((demo, name, before, after))
+                continue
+            if after - before > max(before * threshold, min_delta):
+                found.append((demo, name, before, after))
+    return found
+
+
+def format_seconds(seconds):
+    """Returns seconds as a fixed width column"""
+    return "   -   " if seconds is None else f"{seconds:6.2f}s"
+
+
+def print_report(report):
+    """Prints the startup latency of each demo"""
+    print(f"{'demo':<20} {'ready':>7} " + " ".join(f"{p:>8}" for p in PHASES))
+    for demo, summary in report["demos"].items():
+        print(
+            f"{demo:<20} {format_seconds(summary['ready'])} "
+            + " ".join(
+                f"{format_seconds(summary['phases'].get(name)):>8}" for name in PHASES
+            )
+        )
+
+
+def run(args):
+    """Launches the demos of the catalog and reports their startup latency"""
+    catalog = demo_catalog.load(args.catalog)
+    if args.ids:
+        demos = [catalog.get(demo_id) for demo_id in args.ids]
+        missing = [i for i, demo in zip(args.ids, demos) if demo is None]
+        if missing:
+            raise SystemExit(f"Unknown demo(s): {', '.join(missing)}")
+    elif args.soc:
+        demos = catalog.compatible(args.soc)
+    else:
+        demos = catalog.demos
+
+    report = {"time": time.time(), "repeat": args.repeat, "demos": {}}
+    for demo in demos:
+        print(f"Launching {demo.id}...", flush=True)
+        timelines = [launch(demo, args.timeout) for _ in range(args.repeat)]
+        report["demos"][demo.id] = summarize(timelines)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        found = regressions(report, baseline, args.threshold)
+        for demo, name, before, after in found:
+            print(
+                f"Regression: {demo} {name} "
+                f"{format_seconds(before).strip()} -> {format_seconds(after).strip()}"
+            )
+        if found:
+            raise SystemExit(1)
+
+
+def show(args):
+    """Prints the timeline of each demo of a profile file"""
+    events = read_events(args.profile)
+    demos = {}
+    for event in events:
+        demos.setdefault(event["demo"], []).append(event)
+    for demo, demo_events in demos.items():
+        origin = min(event["start"] for event in demo_events)
+        print(demo)
+        for event in sorted(demo_events, key=lambda event: event["start"]):
+            start = event["start"] - origin
+            print(
+                f"  {start:7.2f}s  {event['end'] - event['start']:6.2f}s  "
+                f"{event['event']} (pid {event['pid']})"
+            )
+
+
+def main():
+    """Command line interface of the launch profiler"""
+    parser = argparse.ArgumentParser(description="Demo startup profiler")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runner = commands.add_parser("run", help="Launch demos headless")
+    runner.add_argument("--catalog", default=demo_catalog.DEMOS_FILE)
+    runner.add_argument("--ids", nargs="+", help="Demos to launch (default: all)")
+    runner.add_argument("--soc", help="Launch the demos compatible with this SoC")
+    runner.add_argument("--repeat", type=int, default=3, help="Launches per demo")
+    runner.add_argument(
+        "--timeout", type=float, default=180, help="Seconds to wait for a demo"
+    )
+    runner.add_argument("--output", help="Write the report to this file")
+    runner.add_argument("--baseline", help="Compare with this previous report")
+    runner.add_argument("--threshold", type=float, default=THRESHOLD)
+    viewer = commands.add_parser("show", help="Print the timeline of a profile")
+    viewer.add_argument("profile", help="File written through " + PROFILE_ENV)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        show(args)
+
+
+if __name__ == "__main__":
+    main()
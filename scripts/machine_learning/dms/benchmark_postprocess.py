@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-3-Clause
+
+This script benchmarks the post-processing of the DMS demo on any machine.
+
+Most of the time the DMS demo spends per frame outside of invoke() is Python:
+anchor decoding, NMS, landmark projection, box squaring and clipping, the
+mouth and eye ratios and the cairo overlay. Functions whose post-processing
+cannot be called on its own are timed whole with the stub invoke, as
+"pre+post", next to their pre-processing alone when it is a method. The
+models run on the fake inference backend, returning synthetic raw tensors or
+tensors recorded on a board, so each function can be timed without NPU,
+camera, model files or tflite_runtime.
+
+Recorded tensors are read from a .npz file holding one array per output, with
+the frames on the first axis: face_scores (N, 896, 1), face_boxes (N, 896, 16),
+landmarks (N, 1404), eye (N, 213), iris (N, 15), smk_scores (N, B, 2) and
+smk_boxes (N, B, 4). --save writes the synthetic tensors in that format.
+
+Usage:
+    python3 benchmark_postprocess.py [--rounds 500] [--tensors FILE.npz]
+                                     [--save FILE.npz] [--json FILE]
+                                     [--baseline FILE] [--filter NAME]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from typing import NamedTuple
+import numpy as np
+
+cur_path = os.path.dirname(os.path.abspath(__file__))
+# The shared scripts, from a checkout or from the board
+sys.path.append(os.path.join(cur_path, "..", ".."))
+
+import inference_backend
+import face_detection
+import face_landmark
+import eye
+import mouth
+import smoking_calling_yolov4
+
+FRAME_SIZE = 300
+"""Size of the frames the DMS demo runs its models on"""
+
+SMK_CALL_BOXES = 2535
+"""Detections of yolov4-tiny at 416x416, 13x13 and 26x26 grids x 3 anchors"""
+
+THRESHOLD = 0.2
+"""Relative slowdown reported as a regression"""
+
+WARMUP = 10
+
+
+def create(model_class, input_shape, outputs, *args, **kwargs):
+    """Returns a model_class running on the fake backend
+
+    Arguments:
+    input_shape -- shape of the input tensor
+    outputs -- one array per output, frames on the first axis
+    """
+    backend = inference_backend.FakeBackend(
+        {inference_backend.ANY_MODEL: inference_backend.FakeModel(input_shape, outputs)}
+    )
+    # The constructors print their warm-up time
+    with contextlib.redirect_stdout(io.StringIO()):
+        return model_class(
+            "fake.tflite", "CPU", "i.MX8MP", *args, backend=backend, **kwargs
+        )
+
+
+def synthetic_tensors(frames=16, seed=0):
+    """Returns raw outputs of the DMS models for frames with one face"""
+    rng = np.random.default_rng(seed)
+    face_scores = rng.uniform(-20, -5, (frames, 896, 1)).astype(np.float32)
+    face_boxes = rng.normal(0, 2, (frames, 896, 16)).astype(np.float32)
+    for frame in range(frames):
+        # A face found by a few neighbouring anchors, as NMS usually sees it
+        hits = rng.choice(896, 6, replace=False)
+        face_scores[frame, hits, 0] = rng.uniform(2, 6, 6)
+        face_boxes[frame, hits, 2:4] = rng.uniform(40, 60, (6, 2))
+    smk_scores = rng.uniform(0, 0.3, (frames, SMK_CALL_BOXES, 2)).astype(np.float32)
+    smk_boxes = rng.uniform(0, 416, (frames, SMK_CALL_BOXES, 4)).astype(np.float32)
+    for frame in range(frames):
+        hits = rng.choice(SMK_CALL_BOXES, 8, replace=False)
+        smk_scores[frame, hits, rng.integers(0, 2, 8)] = rng.uniform(0.6, 1.0, 8)
+        smk_boxes[frame, hits, :2] = rng.uniform(150, 250, (8, 2))
+        smk_boxes[frame, hits, 2:] = rng.uniform(30, 60, (8, 2))
+    return {
+        "face_scores": face_scores,
+        "face_boxes": face_boxes,
+        "landmarks": rng.uniform(40, 150, (frames, 468 * 3)).astype(np.float32),
+        "eye": rng.uniform(10, 54, (frames, 71 * 3)).astype(np.float32),
+        "iris": rng.uniform(24, 40, (frames, 5 * 3)).astype(np.float32),
+        "smk_scores": smk_scores,
+        "smk_boxes": smk_boxes,
+    }
+
+
+class Benchmark(NamedTuple):
+    """Function timed once per frame, called with the frame index"""
+
+    name: str
+    function: object
+
+
+class Result(NamedTuple):
+    """Time per call of a benchmark, in microseconds"""
+
+    name: str
+    rounds: int
+    mean_us: float
+    median_us: float
+    min_us: float
+
+
+def demo_benchmarks(face_boxes):
+    """Returns the benchmarks of DMSDemo, empty if it cannot be imported
+
+    dms_demo needs GStreamer and cairo, unlike the model classes.
+
+    Arguments:
+    face_boxes -- face box of each frame, (1, 4) in frame coordinates
+    """
+    try:
+        import cairo  # pylint: disable=import-outside-toplevel
+        import dms_demo  # pylint: disable=import-outside-toplevel
+    except (ImportError, ValueError) as error:
+        print(f"Skipping the DMSDemo functions: {error}", file=sys.stderr)
+        return []
+    frames = len(face_boxes)
+    demo = dms_demo.DMSDemo.__new__(dms_demo.DMSDemo)
+    demo.distracted = demo.drowsy = demo.yawn = False
+    demo.smoking = demo.phone = False
+    demo.safe_value = 42.0
+    demo.smk_call_cords = []
+    demo.marks = []
+    context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1920, 1080))
+
+    def draw(frame):
+        # One frame out of four without face
+        demo.face_cords = list(face_boxes[frame % frames]) if frame % 4 else []
+        demo.draw(None, context, 0, 0)
+
+    squares = [demo.transform_to_square(box, scale=1.26) for box in face_boxes]
+    margins = (0, 0, FRAME_SIZE, FRAME_SIZE)
+    return [
+        Benchmark(
+            "transform_to_square",
+            lambda frame: demo.transform_to_square(
+                face_boxes[frame % frames], scale=1.26
+            ),
+        ),
+        Benchmark(
+            "clip_boxes",
+            lambda frame: demo.clip_boxes(squares[frame % frames].copy(), margins),
+        ),
+        Benchmark("draw", draw),
+    ]
+
+
+def benchmarks(tensors):
+    """Returns the benchmarks of the DMS post-processing on tensors"""
+    frames = len(tensors["face_scores"])
+    frame_image = np.random.default_rng(1).integers(
+        0, 255, (FRAME_SIZE, FRAME_SIZE, 3), np.uint8
+    )
+    face_image = frame_image[60:240, 60:240]
+    eye_image = frame_image[80:120, 80:120]
+
+    detector = create(
+        face_detection.FaceDetector,
+        (1, 128, 128, 3),
+        [tensors["face_scores"], tensors["face_boxes"]],
+        0.7,
+    )
+    landmark = create(
+        face_landmark.FaceLandmark,
+        (1, 192, 192, 3),
+        [np.ones((frames, 1), np.float32), tensors["landmarks"]],
+    )
+    iris = create(eye.Eye, (1, 64, 64, 3), [tensors["eye"], tensors["iris"]])
+    smk_call = create(
+        smoking_calling_yolov4.SmokingCallingDetector,
+        (1, 416, 416, 3),
+        [tensors["smk_scores"], tensors["smk_boxes"]],
+        conf=0.7,
+    )
+    mouth_ratios = mouth.Mouth()
+
+    # Inputs of the functions called on the results of the previous ones
+    candidates = []
+    for frame in range(frames):
+        boxes = detector._decode_boxes(tensors["face_boxes"][frame][np.newaxis].copy())
+        scores = detector._get_sigmoid_scores(
+            tensors["face_scores"][frame][np.newaxis].copy()
+        )
+        keep = scores > detector.threshold
+        candidates.append((boxes[np.argwhere(keep)[:, 1], :], scores[keep]))
+    face_marks = [
+        landmark.get_landmark(face_image, (60, 60, 240, 240)) for _ in range(frames)
+    ]
+    eye_marks = [
+        iris.get_landmark(eye_image, (80, 80, 120, 120), 0)[0] for _ in range(frames)
+    ]
+    face_boxes = []
+    for _ in range(frames):
+        boxes = detector.detect(frame_image)
+        if len(boxes) == 0:
+            boxes = np.array([[0.2, 0.2, 0.7, 0.75]])
+        face_boxes.append(boxes[:1] * FRAME_SIZE)
+
+    # pylint: disable=protected-access
+    found = [
+        Benchmark(
+            "face anchor decode",
+            lambda frame: detector._decode_boxes(
+                tensors["face_boxes"][frame % frames][np.newaxis].copy()
+            ),
+        ),
+        Benchmark(
+            "face sigmoid scores",
+            lambda frame: detector._get_sigmoid_scores(
+                tensors["face_scores"][frame % frames][np.newaxis].copy()
+            ),
+        ),
+        Benchmark(
+            "face NMS",
+            lambda frame: detector._non_maximum_suppression(
+                *candidates[frame % frames], face_detection.MIN_SUPPRESSION_THRESHOLD
+            ),
+        ),
+        Benchmark("face detect", lambda frame: detector.detect(frame_image)),
+        Benchmark(
+            "face landmark pre",
+            lambda frame: landmark._pre_processing(face_image),
+        ),
+        Benchmark(
+            "face landmark pre+post",
+            lambda frame: landmark.get_landmark(face_image, (60, 60, 240, 240)),
+        ),
+        Benchmark("iris landmark pre", lambda frame: iris._pre_processing(eye_image)),
+        Benchmark(
+            "iris landmark pre+post",
+            lambda frame: iris.get_landmark(eye_image, (80, 80, 120, 120), frame % 2),
+        ),
+        Benchmark(
+            "smk/call filter_boxes",
+            lambda frame: smk_call.filter_boxes(
+                tensors["smk_boxes"][frame % frames][np.newaxis],
+                tensors["smk_scores"][frame % frames][np.newaxis],
+            ),
+        ),
+        Benchmark(
+            "smk/call pre+post", lambda frame: smk_call.inference(frame_image, False)
+        ),
+        Benchmark(
+            "yawning_ratio",
+            lambda frame: mouth_ratios.yawning_ratio(face_marks[frame % frames]),
+        ),
+        Benchmark(
+            "mouth_face_ratio",
+            lambda frame: mouth_ratios.mouth_face_ratio(face_marks[frame % frames]),
+        ),
+        Benchmark(
+            "blinking_ratio",
+            lambda frame: iris.blinking_ratio(eye_marks[frame % frames], frame % 2),
+        ),
+    ]
+    return found + demo_benchmarks(face_boxes)
+
+
+def run(benchmark, rounds):
+    """Returns the Result of rounds calls of benchmark"""
+    for frame in range(WARMUP):
+        benchmark.function(frame)
+    times = []
+    for frame in range(rounds):
+        start = time.perf_counter_ns()
+        benchmark.function(frame)
+        times.append((time.perf_counter_ns() - start) / 1000)
+    return Result(
+        benchmark.name,
+        rounds,
+        statistics.mean(times),
+        statistics.median(times),
+        min(times),
+    )
+
+
+def regressions(results, baseline, threshold=THRESHOLD):
+    """Returns (name, before, after) of the medians slower than in baseline"""
+    before = {item["name"]: item["median_us"] for item in baseline["results"]}
+    return [
+        (result.name, before[result.name], result.median_us)
+        for result in results
+        if result.name in before
+        and result.median_us > before[result.name] * (1 + threshold)
+    ]
+
+
+def main():
+    """Command line interface of the DMS post-processing benchmark"""
+    parser = argparse.ArgumentParser(description="DMS post-processing benchmark")
+    parser.add_argument("--rounds", type=int, default=500, help="Calls per function")
+    parser.add_argument("--tensors", help="Recorded raw tensors (.npz)")
+    parser.add_argument("--save", help="Write the synthetic tensors to a .npz file")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare with these previous results")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--filter", help="Only run the functions containing this")
+    args = parser.parse_args()
+
+    if args.tensors:
+        with np.load(args.tensors) as data:
+            tensors = {name: data[name] for name in data.files}
+    else:
+        tensors = synthetic_tensors()
+    if args.save:
+        np.savez(args.save, **tensors)
+
+    results = []
+    found = benchmarks(tensors)
+    print(f"{'function':<28} {'mean us':>10} {'median us':>10} {'min us':>10}")
+    for benchmark in found:
+        if args.filter and args.filter not in benchmark.name:
+            continue
+        result = run(benchmark, args.rounds)
+        results.append(result)
+        print(
+            f"{result.name:<28} {result.mean_us:10.1f} {result.median_us:10.1f} "
+            f"{result.min_us:10.1f}",
+            flush=True,
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "time": time.time(),
+                    "tensors": args.tensors or "synthetic",
+                    "results": [result._asdict() for result in results],
+                },
+                file,
+                indent=1,
+            )
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            found = regressions(results, json.load(file), args.threshold)
+        for name, before, after in found:
+            print(f"Regression: {name} {before:.1f} us -> {after:.1f} us")
+        if found:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -46,6 +46,11 @@ from smoking_calling_yolov4 import SmokingCallingDetector
 gi.require_version("Gst", "1.0")
 from gi.repository import Gst
 
+sys.path.append("/home/root/.nxp-demo-experience/scripts")
+import launch_profiler
+import media_source
+import span_profiler
+
 cur_path = os.path.dirname(os.path.abspath(__file__))
 
 DRAW_SMK_CALL_CORDS = False
@@ -170,14 +175,17 @@ class DMSDemo:
             compositor = "imxcompositor_pxp "
 
         cam_pipeline = (
-            "v4l2src device="
-            + video_device
-            + " ! video/x-raw,framerate=30/1,"
-            + "height=480,width=640,format=YUY2 ! "
+            media_source.gst_source(
+                video_device,
+                "video/x-raw,framerate=30/1,height=480,width=640,format=YUY2",
+            )
+            + " ! "
             + videocrop
             + videoconvert
             + "video/x-raw,height=1072,width=1072,format=RGB16 ! "
-            + "tee name=cam !  queue max-size-buffers=2 leaky=2 ! comp.sink_0  filesrc "
+            + "tee name=cam ! "
+            + media_source.queue(2)
+            + " ! comp.sink_0  filesrc "
             + "location="
             + model_path
             + info_image
@@ -186,18 +194,26 @@ class DMSDemo:
             + compositor
             + "name=comp sink_1::xpos=0 sink_1::ypos=0 "
             + "sink_0::xpos=840 sink_0::ypos=4 ! cairooverlay name=drawer ! "
-            + "queue max-size-buffers=2 leaky=2 ! waylandsink "
-            + "window_width=1920 window-height=1080 "
-            + "cam. ! queue max-size-buffers=2 leaky=2 ! "
+            + media_source.queue(2)
+            + " ! "
+            + media_source.video_sink(
+                "waylandsink window_width=1920 window-height=1080"
+            )
+            + " "
+            + "cam. ! "
+            + media_source.queue(2)
+            + " ! "
             + videoconvert
             + "video/x-raw,height="
             + str(FRAME_HEIGHT)
             + ",width="
             + str(FRAME_WIDTH)
             + ",format=RGB16 ! videoconvert ! video/x-raw,format=RGB ! "
-            + "appsink emit-signals=true drop=true max-buffers=2 name=ml_sink"
+            + "appsink emit-signals=true name=ml_sink "
+            + media_source.appsink_limit(2)
         )
         pipeline = Gst.parse_launch(cam_pipeline)
+        launch_profiler.begin("playing")
         pipeline.set_state(Gst.State.PLAYING)
 
         drawer = pipeline.get_by_name("drawer")
@@ -229,6 +245,7 @@ class DMSDemo:
 
         self.inited = True
 
+    @span_profiler.traced("frame")
     def inference(self, data):
         """Run all DMS models' inference on data from gst pipeline"""
         frame = data.emit("pull-sample")
@@ -247,6 +264,7 @@ class DMSDemo:
         if self.inited is False:
             return 0
 
+        started = time.monotonic()
         buffer = frame.get_buffer()
         caps = frame.get_caps()
         ret, mem_buf = buffer.map(Gst.MapFlags.READ)
@@ -257,6 +275,8 @@ class DMSDemo:
         )[..., ::-1]
 
         boxes = self.face_detector.detect(frame)
+        launch_profiler.end("playing")
+        launch_profiler.ready()
 
         face_cords = []
         smk_call_cords = []
@@ -394,6 +414,7 @@ class DMSDemo:
             self.safe_value = max(self.safe_value + RESTORE_CREDIT, 0.00)
 
         buffer.unmap(mem_buf)
+        media_source.frame((time.monotonic() - started) * 1000)
         return 0
 
     def transform_to_square(self, boxes, scale=1.0, offset=(0, 0)):
@@ -465,6 +486,7 @@ class DMSDemo:
         image = image.astype(np.uint8)
         return image
 
+    @span_profiler.traced("render")
     def draw(self, overlay, context, timestamp, duration):
         """Draw the DMS inference result on the display"""
         context.select_font_face(
@@ -517,6 +539,7 @@ class DMSDemo:
             self.write_text(context, None, 410, 935)
             self.write_text(context, None, 410, 1020)
         self.write_status(context)
+        span_profiler.draw(context)
 
     def write_text(self, context, yes, y, x):
         """Write text on the display"""
@@ -568,6 +591,7 @@ if __name__ == "__main__":
         "--model_path", type=str, default=cur_path, help="Path for models and image"
     )
     args = parser.parse_args()
+    span_profiler.install()
     Gst.init(None)
     window = DMSDemo(args.device, args.backend, args.model_path)
     while True:
@@ -9,10 +9,15 @@ Original Source: https://github.com/patlevin/face-detection-tflite
 
 This script define class of face detection used in DMS demo
 """
+import sys
 import time
 import numpy as np
 import cv2
-import tflite_runtime.interpreter as tflite
+
+sys.path.append("/home/root/.nxp-demo-experience/scripts")
+import inference_backend
+import launch_profiler
+import span_profiler
 
 # score limit is 100 in mediapipe and leads to overflows with IEEE 754 floats
 # this lower limit is safe for use with the sigmoid functions and float32
@@ -30,7 +35,7 @@ def sigmoid(x):
 class FaceDetector:
     """The class to do face dectcion"""
 
-    def __init__(self, model_path, inf_device, platform, threshold=0.75):
+    def __init__(self, model_path, inf_device, platform, threshold=0.75, backend=None):
         """
         Creates an instance of the face detector
 
@@ -39,28 +44,24 @@ class FaceDetector:
         inf_device -- the inference device, CPU or NPU
         platform -- the plaform that running this demo
         threshold -- the threshold for confidence scores
+        backend -- inference_backend backend, chosen from inf_device and
+            platform by default
         """
 
-        if inf_device == "NPU":
-            if platform == "i.MX8MP":
-                delegate = tflite.load_delegate("/usr/lib/libvx_delegate.so")
-            elif platform == "i.MX93":
-                delegate = tflite.load_delegate("/usr/lib/libethosu_delegate.so")
-            else:
-                print("Platform not supported!")
-                return
-            self.interpreter = tflite.Interpreter(
-                model_path=model_path, experimental_delegates=[delegate]
-            )
-        else:
-            # inf_device is CPU
-            self.interpreter = tflite.Interpreter(model_path=model_path)
+        if backend is None:
+            backend = inference_backend.for_device(inf_device, platform)
+        if backend is None:
+            print("Platform not supported!")
+            return
+        with launch_profiler.phase("delegate"):
+            self.interpreter = backend.load(model_path)
 
         self.interpreter.allocate_tensors()
 
         # model warm up
         time_start = time.time()
-        self.interpreter.invoke()
+        with launch_profiler.phase("warmup"):
+            self.interpreter.invoke()
         time_end = time.time()
         print("face detection model warm up time:")
         print((time_end - time_start) * 1000, " ms")
@@ -91,11 +92,13 @@ class FaceDetector:
         input_data = (input_data[np.newaxis, :, :, :] - 128) / 128.0
         return input_data
 
+    @span_profiler.traced("face detection")
     def detect(self, img):
         """Detect the face from img and return the bounding box"""
         input_data = self._pre_processing(img)
         self.interpreter.set_tensor(self.input_index, input_data)
-        self.interpreter.invoke()
+        with span_profiler.span("face detection invoke"):
+            self.interpreter.invoke()
         raw_boxes = self.interpreter.get_tensor(self.bbox_index)
         raw_scores = self.interpreter.get_tensor(self.score_index)
 
@@ -6,16 +6,21 @@ SPDX-License-Identifier: BSD-3-Clause
 
 This script define class of face landmark used in DMS demo
 """
+import sys
 import time
 import numpy as np
 import cv2
-import tflite_runtime.interpreter as tflite
+
+sys.path.append("/home/root/.nxp-demo-experience/scripts")
+import inference_backend
+import launch_profiler
+import span_profiler
 
 
 class FaceLandmark:
     """The class to get face landmark"""
 
-    def __init__(self, model_path, inf_device, platform):
+    def __init__(self, model_path, inf_device, platform, backend=None):
         """
         Creates an instance of the face landmark class
 
@@ -23,26 +28,23 @@ class FaceLandmark:
         model_path -- the path to the model
         inf_device -- the inference device, CPU or NPU
         platform -- the plaform that running this demo
+        backend -- inference_backend backend, chosen from inf_device and
+            platform by default
         """
-        if inf_device == "NPU":
-            if platform == "i.MX8MP":
-                delegate = tflite.load_delegate("/usr/lib/libvx_delegate.so")
-            elif platform == "i.MX93":
-                delegate = tflite.load_delegate("/usr/lib/libethosu_delegate.so")
-            else:
-                print("Platform not supported!")
-                return
-            self.interpreter = tflite.Interpreter(
-                model_path=model_path, experimental_delegates=[delegate]
-            )
-        else:
-            self.interpreter = tflite.Interpreter(model_path=model_path)
+        if backend is None:
+            backend = inference_backend.for_device(inf_device, platform)
+        if backend is None:
+            print("Platform not supported!")
+            return
+        with launch_profiler.phase("delegate"):
+            self.interpreter = backend.load(model_path)
 
         self.interpreter.allocate_tensors()
 
         # model warm up
         time_start = time.time()
-        self.interpreter.invoke()
+        with launch_profiler.phase("warmup"):
+            self.interpreter.invoke()
         time_end = time.time()
         print("face landmark model warm up time:")
         print((time_end - time_start) * 1000, " ms")
@@ -59,11 +61,13 @@ class FaceLandmark:
         input_data = (input_data[np.newaxis, :, :, :] - 128) / 128.0
         return input_data
 
+    @span_profiler.traced("face landmark")
     def get_landmark(self, img, roi):
         """Get the face landmarks from img, return a list of all landmarks' position"""
         input_data = self._pre_processing(img)
         self.interpreter.set_tensor(self.input_index, input_data)
-        self.interpreter.invoke()
+        with span_profiler.span("face landmark invoke"):
+            self.interpreter.invoke()
         raw_landmarks = self.interpreter.get_tensor(self.landmark_index)[0]
 
         raw_landmarks = raw_landmarks.astype(np.float32)
@@ -23,6 +23,9 @@ from gi.repository import GLib
 # Import utils
 sys.path.append("/home/root/.nxp-demo-experience/scripts")
 import utils
+import graph_cache
+import vela_cache
+import launch_profiler
 
 cur_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -74,10 +77,6 @@ class ImxDMSLauncher:
         # Check target (i.MX8M Plus vs i.MX93)
         if os.path.exists("/usr/lib/libvx_delegate.so"):
             self.platform = "i.MX8MP"
-            self.cache_enable = (
-                "VIV_VX_ENABLE_CACHE_GRAPH_BINARY='1' "
-                + "VIV_VX_CACHE_BINARY_GRAPH_DIR=/home/root/.cache/gopoint "
-            )
         elif os.path.exists("/usr/lib/libethosu_delegate.so"):
             self.platform = "i.MX93"
         else:
@@ -119,6 +118,9 @@ class ImxDMSLauncher:
         window.connect("delete-event", gtk.main_quit)
         window.show()
 
+        if launch_profiler.autostart():
+            self.start(self.run_button)
+
     def about_button_activate(self, widget):
         """
         Function to handle about dialog window
@@ -140,6 +142,14 @@ class ImxDMSLauncher:
         self.progress_bar.set_fraction(0.0)
         return False
 
+    def download_progress(self, done, total):
+        """Shows the progress of the downloads"""
+        if total:
+            GLib.idle_add(
+                self.status_bar.set_text,
+                f"Downloading models... {100 * done // total}%",
+            )
+
     @threaded
     def start(self, widget):
         """
@@ -148,7 +158,8 @@ class ImxDMSLauncher:
         self.run_button.set_sensitive(False)
         self.sources_list.set_sensitive(False)
         self.backend_list.set_sensitive(False)
-        device = self.sources_list.get_active_text()
+        # No camera is needed when the demo replays a clip (media_source)
+        device = self.sources_list.get_active_text() or ""
         backend = self.backend_list.get_active_text()
 
         self.pulsing = True
@@ -156,201 +167,77 @@ class ImxDMSLauncher:
 
         GLib.idle_add(self.status_bar.set_text, "Downloading models...")
 
-        # Download assets
-        model_face_detection = utils.download_file(self.face_detection_model)
-        model_face_landmark = utils.download_file(self.face_landmark_model)
-        model_iris_landmark = utils.download_file(self.iris_landmark_model)
-        model_smk_call_detection = utils.download_file(self.smk_call_detection_model)
-        info_image_s = utils.download_file(self.info_image)
+        # Resolve, verify and download all assets at once
+        paths, errors = utils.prefetch(
+            [
+                self.face_detection_model,
+                self.face_landmark_model,
+                self.iris_landmark_model,
+                self.smk_call_detection_model,
+                self.info_image,
+            ],
+            self.download_progress,
+        )
 
         # Handle errors during download if present
-        if (
-            model_face_detection == -1
-            or model_face_landmark == -1
-            or model_iris_landmark == -1
-            or model_smk_call_detection == -1
-            or info_image_s == -1
-        ):
-            self.pulsing = False
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Cannot find files!\n"
-                "Make sure required files are available in downloads database!",
-            )
-            self.run_button.set_sensitive(True)
-            self.sources_list.set_sensitive(True)
-            self.backend_list.set_sensitive(True)
-            return False
-        if (
-            model_face_detection == -2
-            or model_face_landmark == -2
-            or model_iris_landmark == -2
-            or model_smk_call_detection == -2
-            or info_image_s == -2
-        ):
+        if errors:
             self.pulsing = False
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Download failed!\n"
-                "Please make sure you have internet connection on the target and try again.",
-            )
+            GLib.idle_add(self.status_bar.set_text, utils.prefetch_error(errors))
             self.run_button.set_sensitive(True)
             self.sources_list.set_sensitive(True)
             self.backend_list.set_sensitive(True)
             return False
 
-        if (
-            model_face_detection == -3
-            or model_face_landmark == -3
-            or model_iris_landmark == -3
-            or model_smk_call_detection == -3
-            or info_image_s == -3
-        ):
-            self.pulsing = False
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Downloaded corrupted file!\n"
-                "Please clean /home/root/.cache/gopoint and try to download again.",
-            )
-            self.run_button.set_sensitive(True)
-            self.sources_list.set_sensitive(True)
-            self.backend_list.set_sensitive(True)
-            return False
+        model_face_detection = paths[self.face_detection_model]
+        model_face_landmark = paths[self.face_landmark_model]
+        model_iris_landmark = paths[self.iris_landmark_model]
+        model_smk_call_detection = paths[self.smk_call_detection_model]
 
         GLib.idle_add(self.status_bar.set_text, "Loading models to cache...")
 
-        # Load models and save graphs on cache
+        # Load models and save graphs on cache, skipping cached graphs
         if self.platform == "i.MX8MP" and backend == "NPU":
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Warming up face detection model and save to cache...",
-            )
-
-            subprocess.run(
-                self.cache_enable
-                + " /usr/bin/tensorflow-lite-*/examples/benchmark_model "
-                "--graph=/home/root/.cache/gopoint/"
-                + self.face_detection_model
-                + " --external_delegate_path=/usr/lib/libvx_delegate.so",
-                shell=True,
-                check=True,
-            )
-
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Warming up face landmark model and save to cache...",
-            )
-
-            subprocess.run(
-                self.cache_enable
-                + " /usr/bin/tensorflow-lite-*/examples/benchmark_model "
-                "--graph=/home/root/.cache/gopoint/"
-                + self.face_landmark_model
-                + " --external_delegate_path=/usr/lib/libvx_delegate.so",
-                shell=True,
-                check=True,
-            )
-
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Warming up iris landmark model and save to cache...",
-            )
-
-            subprocess.run(
-                self.cache_enable
-                + " /usr/bin/tensorflow-lite-*/examples/benchmark_model "
-                "--graph=/home/root/.cache/gopoint/"
-                + self.iris_landmark_model
-                + " --external_delegate_path=/usr/lib/libvx_delegate.so",
-                shell=True,
-                check=True,
-            )
+            models = {
+                "face detection": model_face_detection,
+                "face landmark": model_face_landmark,
+                "iris landmark": model_iris_landmark,
+                "smk/call detection": model_smk_call_detection,
+            }
+            cache = graph_cache.GraphCache()
+            cache.evict()
+            for name, model in models.items():
+                cache.warm(
+                    model,
+                    on_miss=lambda name=name: GLib.idle_add(
+                        self.status_bar.set_text,
+                        f"Warming up {name} model and save to cache...",
+                    ),
+                )
+            self.cache_enable = cache.env_prefix(models.values())
 
+        if self.platform == "i.MX93" and backend == "NPU":
+            # Compile the four models in parallel, dms_demo.py loads them
+            # by their usual *_vela.tflite names
             GLib.idle_add(
                 self.status_bar.set_text,
-                "Warming up smk/call detection model and save to cache...",
+                "Compiling and saving models to cache...",
             )
-
-            subprocess.run(
-                self.cache_enable
-                + " /usr/bin/tensorflow-lite-*/examples/benchmark_model "
-                "--graph=/home/root/.cache/gopoint/"
-                + self.smk_call_detection_model
-                + " --external_delegate_path=/usr/lib/libvx_delegate.so",
-                shell=True,
-                check=True,
+            results = vela_cache.compile_models(
+                [
+                    model_face_detection,
+                    model_face_landmark,
+                    model_iris_landmark,
+                    model_smk_call_detection,
+                ]
             )
-
-        if self.platform == "i.MX93" and backend == "NPU":
-            # overwrite models name if backend is NPU for imx93
-            face_detection_vela_model = "face_detection_ptq_vela.tflite"
-            face_landmark_vela_model = "face_landmark_ptq_vela.tflite"
-            iris_landmark_vela_model = "iris_landmark_ptq_vela.tflite"
-            smk_call_detection_vela_model = "yolov4_tiny_smk_call_vela.tflite"
-
-            if not os.path.exists(
-                "/home/root/.cache/gopoint/" + face_detection_vela_model
-            ):
-                GLib.idle_add(
-                    self.status_bar.set_text,
-                    "Compiling and saving face detection model to cache...",
-                )
-
-                subprocess.run(
-                    "vela /home/root/.cache/gopoint/"
-                    + self.face_detection_model
-                    + " --output-dir=/home/root/.cache/gopoint/",
-                    shell=True,
-                    check=True,
-                )
-
-            if not os.path.exists(
-                "/home/root/.cache/gopoint/" + face_landmark_vela_model
-            ):
-                GLib.idle_add(
-                    self.status_bar.set_text,
-                    "Compiling and saving face landmark model to cache...",
-                )
-
-                subprocess.run(
-                    "vela /home/root/.cache/gopoint/"
-                    + self.face_landmark_model
-                    + " --output-dir=/home/root/.cache/gopoint/",
-                    shell=True,
-                    check=True,
-                )
-
-            if not os.path.exists(
-                "/home/root/.cache/gopoint/" + iris_landmark_vela_model
-            ):
-                GLib.idle_add(
-                    self.status_bar.set_text,
-                    "Compiling and saving iris landmark model to cache...",
-                )
-
-                subprocess.run(
-                    "vela /home/root/.cache/gopoint/"
-                    + self.iris_landmark_model
-                    + " --output-dir=/home/root/.cache/gopoint/",
-                    shell=True,
-                    check=True,
-                )
-
-            if not os.path.exists(
-                "/home/root/.cache/gopoint/" + smk_call_detection_vela_model
-            ):
-                GLib.idle_add(
-                    self.status_bar.set_text,
-                    "Compiling and saving smk/call detection model to cache...",
-                )
-
-                subprocess.run(
-                    "vela /home/root/.cache/gopoint/"
-                    + self.smk_call_detection_model
-                    + " --output-dir=/home/root/.cache/gopoint/",
-                    shell=True,
-                    check=True,
-                )
+            GLib.idle_add(self.status_bar.set_text, vela_cache.summary(results))
+            if any(result.path is None for result in results):
+                # dms_demo.py cannot load the missing *_vela.tflite models
+                self.pulsing = False
+                self.run_button.set_sensitive(True)
+                self.sources_list.set_sensitive(True)
+                self.backend_list.set_sensitive(True)
+                return False
 
         GLib.idle_add(self.status_bar.set_text, "Models are ready!")
         self.pulsing = False
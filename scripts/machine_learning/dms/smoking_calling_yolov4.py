@@ -6,11 +6,16 @@ SPDX-License-Identifier: BSD-3-Clause
 
 This script define class of smoking/calling detection used in DMS demo
 """
+import sys
 import time
 import numpy as np
-import tflite_runtime.interpreter as tflite
 import cv2
 
+sys.path.append("/home/root/.nxp-demo-experience/scripts")
+import inference_backend
+import launch_profiler
+import span_profiler
+
 ANCHORS_TINY = [23, 27, 37, 58, 81, 82, 81, 82, 135, 169, 344, 319]
 STRIDES = [16, 32]
 ANCHORS = np.array(ANCHORS_TINY)
@@ -22,7 +27,7 @@ XYSCALE = [1.05, 1.05]
 class SmokingCallingDetector:
     """The class to detect smoking and calling behavior"""
 
-    def __init__(self, model_path, inf_device, platform, iou=0.25, conf=0.55):
+    def __init__(self, model_path, inf_device, platform, iou=0.25, conf=0.55, backend=None):
         """
         Creates an instance of the smoking/calling detector
 
@@ -32,20 +37,16 @@ class SmokingCallingDetector:
         platform -- the plaform that running this demo
         iou -- the overlay threshold for nms
         conf -- the threshold for confidence scores
+        backend -- inference_backend backend, chosen from inf_device and
+            platform by default
         """
-        if inf_device == "NPU":
-            if platform == "i.MX8MP":
-                delegate = tflite.load_delegate("/usr/lib/libvx_delegate.so")
-            elif platform == "i.MX93":
-                delegate = tflite.load_delegate("/usr/lib/libethosu_delegate.so")
-            else:
-                print("Platform not supported!")
-                return
-            self.interpreter = tflite.Interpreter(
-                model_path=model_path, experimental_delegates=[delegate]
-            )
-        else:
-            self.interpreter = tflite.Interpreter(model_path=model_path)
+        if backend is None:
+            backend = inference_backend.for_device(inf_device, platform)
+        if backend is None:
+            print("Platform not supported!")
+            return
+        with launch_profiler.phase("delegate"):
+            self.interpreter = backend.load(model_path)
 
         self.nms_threshold = iou
         self.conf_threshold = conf
@@ -58,7 +59,8 @@ class SmokingCallingDetector:
         self.interpreter.allocate_tensors()
         # model warm up
         time_start = time.time()
-        self.interpreter.invoke()
+        with launch_profiler.phase("warmup"):
+            self.interpreter.invoke()
         time_end = time.time()
         print("smk/calling model warm up time:")
         print((time_end - time_start) * 1000, " ms")
@@ -70,6 +72,7 @@ class SmokingCallingDetector:
 
         self.output_details = self.interpreter.get_output_details()
 
+    @span_profiler.traced("smoking/calling")
     def inference(self, input_image, mono):
         """Detect smoking and calling behavior from input_image and return the bounding box"""
         raw_frame_shape = input_image.shape
@@ -91,7 +94,8 @@ class SmokingCallingDetector:
             self.input_details[0]["index"], np.expand_dims(input_data, axis=0)
         )
         # inference
-        self.interpreter.invoke()
+        with span_profiler.span("smoking/calling invoke"):
+            self.interpreter.invoke()
         pred = [
             self.interpreter.get_tensor(self.output_details[i]["index"])
             for i in range(len(self.output_details))
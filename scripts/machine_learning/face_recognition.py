@@ -18,7 +18,6 @@ import sys
 import argparse
 import json
 import cv2
-import tflite_runtime.interpreter as tflite
 import numpy as np
 
 import gi
@@ -29,6 +28,11 @@ from gi.repository import Gtk, Gst, GLib, Gio
 
 sys.path.append("/home/root/.nxp-demo-experience/scripts/")
 import utils
+import graph_cache
+import inference_backend
+import launch_profiler
+import media_source
+import span_profiler
 
 DEFAULT_DETECTION_ACCURACY = 0.3
 """The default setting for the detection accuracy cutoff"""
@@ -75,6 +79,7 @@ class FaceDemo:
             self.height = 1080
         if GUI:
             GLib.idle_add(MAIN_WINDOW.status_bar.set_text, "Starting cameras...")
+        launch_profiler.begin("playing")
         if cam == "fake":
             cam_pipeline = cv2.VideoCapture(
                 "videotestsrc ! imxvideoconvert_g2d ! "
@@ -87,13 +92,16 @@ class FaceDemo:
             )
         else:
             cam_pipeline = cv2.VideoCapture(
-                "v4l2src device=" + cam + " ! imxvideoconvert_g2d ! "
+                media_source.gst_source(cam, "video/x-raw")
+                + " ! imxvideoconvert_g2d ! "
                 "video/x-raw,format=RGBA,width="
                 + str(self.width)
                 + ",height="
                 + str(self.height)
                 + " ! "
                 + "videoconvert ! appsink"
+                # Replays run at full speed
+                + (" sync=false" if media_source.headless() else "")
             )
         if GUI:
             GLib.idle_add(MAIN_WINDOW.destroy)
@@ -108,8 +116,11 @@ class FaceDemo:
                 cv2.WINDOW_FULLSCREEN,
             )
         status, org_img = cam_pipeline.read()
+        launch_profiler.end("playing")
         while status:
-            mod_img = self.process_frame(org_img)
+            with media_source.timed_frame():
+                mod_img = self.process_frame(org_img)
+            launch_profiler.ready()
             if self.write_time:
                 overall_time = time.perf_counter() - overall_time
                 times = self.get_timings(overall_time)
@@ -124,12 +135,22 @@ class FaceDemo:
                 (255, 255, 255),
                 2,
             )
-            if GUI:
+            if span_profiler.visible():
+                for row, line in enumerate(span_profiler.lines()):
+                    cv2.putText(
+                        mod_img,
+                        line,
+                        (5, 20 + row * 18),
+                        cv2.FONT_HERSHEY_PLAIN,
+                        1.0,
+                        (255, 255, 255),
+                        1,
+                    )
+            if GUI and not media_source.headless():
                 GLib.idle_add(cv2.imshow, "i.MX Face Recognition Demo", mod_img)
-            else:
-                if OUTPUT:
-                    cv2.imshow("i.MX Face Recognition Demo", mod_img)
-                    cv2.waitKey(1)
+            elif OUTPUT:
+                cv2.imshow("i.MX Face Recognition Demo", mod_img)
+                cv2.waitKey(1)
             status, org_img = cam_pipeline.read()
             self.write_time = True
             overall_time = time.perf_counter()
@@ -159,14 +180,17 @@ class FaceDemo:
                 time.sleep(9999)
         if GUI:
             GLib.idle_add(MAIN_WINDOW.status_bar.set_text, "Creating TFLite Engine...")
-        if backend == "NPU":
-            ext_delegate = tflite.load_delegate("/usr/lib/libvx_delegate.so")
-            interpreter = tflite.Interpreter(
-                model_path=path, num_threads=4, experimental_delegates=[ext_delegate]
-            )
-        else:
-            interpreter = tflite.Interpreter(model_path=path, num_threads=4)
-        interpreter.allocate_tensors()
+        with launch_profiler.phase("delegate"):
+            if backend == "NPU":
+                # Each model compiles its NPU graph into its own cache folder
+                cache = graph_cache.GraphCache()
+                cache.lookup(path)
+                cache.apply([path])
+                engine = inference_backend.create("vx")
+            else:
+                engine = inference_backend.create("cpu")
+            interpreter = engine.load(path, num_threads=4)
+            interpreter.allocate_tensors()
         input_info = interpreter.get_input_details()
         output_info = interpreter.get_output_details()
         input_size_w = input_info[0]["shape"][1]
@@ -180,11 +204,13 @@ class FaceDemo:
             (1, input_size_w, input_size_h, 3), dtype=input_info[0]["dtype"]
         )
         interpreter.set_tensor(input_info[0]["index"], dummy_data)
-        interpreter.invoke()
+        with launch_profiler.phase("warmup"):
+            interpreter.invoke()
         return Model(
             path, interpreter, input_size_w, input_size_h, input_info, output_info
         )
 
+    @span_profiler.traced("frame")
     def process_frame(self, frame):
         """Analyzes the frame and then annotates it"""
         self.recog_time = []
@@ -302,6 +328,7 @@ class FaceDemo:
         )
         return frame
 
+    @span_profiler.traced("face detection")
     def find_faces(self, frame):
         """Find the faces in a frame"""
         self.detect_time = self.run_inference(frame, self.face_models[0])
@@ -322,6 +349,7 @@ class FaceDemo:
                 face_output.append(face_boxes[face])
         return face_output
 
+    @span_profiler.traced("face recognition")
     def id_face(self, face):
         """Try to find matches for face"""
         self.recog_time.append(self.run_inference(face, self.face_models[1]))
@@ -390,7 +418,8 @@ class FaceDemo:
             input_img = np.float32(input_img) / 255
         model.interpreter.set_tensor(model.input_info[0]["index"], input_img)
         start = time.perf_counter()
-        model.interpreter.invoke()
+        with span_profiler.span("invoke"):
+            model.interpreter.invoke()
         return time.perf_counter() - start
 
     def register_face(self, face_mask):
@@ -444,7 +473,7 @@ class Model(NamedTuple):
     """Represents a model and the information to run it"""
 
     path: str
-    interpreter: tflite.Interpreter
+    interpreter: object
     input_size_w: int
     input_size_h: int
     input_info: list
@@ -693,8 +722,7 @@ if __name__ == "__main__":
     parser.add_argument("--camera", type=int, default=0, help="Which camera to use")
     parser.add_argument("--faces", default="", help="Load existing faces")
     args = parser.parse_args()
-    os.environ["VIV_VX_CACHE_BINARY_GRAPH_DIR"] = "/home/root/.cache/gopoint"
-    os.environ["VIV_VX_ENABLE_CACHE_GRAPH_BINARY"] = "1"
+    span_profiler.install()
     if args.gui == 0:
         GUI = False
         print("Command line mode!")
@@ -747,4 +775,6 @@ if __name__ == "__main__":
         Gst.init(None)
         MAIN_WINDOW = MainWindow()
         MAIN_WINDOW.show_all()
+        if launch_profiler.autostart():
+            GLib.idle_add(MAIN_WINDOW.on_change_start, MAIN_WINDOW.launch_button)
         Gtk.main()
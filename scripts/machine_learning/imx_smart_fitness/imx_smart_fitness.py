@@ -9,7 +9,6 @@ This script launches the i.MX Smart Fitness demo using a GUI
 
 import os
 import sys
-import glob
 import subprocess
 import threading
 import time
@@ -23,6 +22,8 @@ from gi.repository import GLib
 # Import utils
 sys.path.append("/home/root/.nxp-demo-experience/scripts")
 import utils
+import graph_cache
+import vela_cache
 
 
 def threaded(fn):
@@ -84,10 +85,6 @@ class ImxSmartFitness:
         # Check target (i.MX8M Plus vs i.MX93)
         if os.path.exists("/usr/lib/libvx_delegate.so"):
             self.platform = "i.MX8MP"
-            self.cache_enable = (
-                "VIV_VX_ENABLE_CACHE_GRAPH_BINARY='1' "
-                + "VIV_VX_CACHE_BINARY_GRAPH_DIR=/home/root/.cache/gopoint "
-            )
         elif os.path.exists("/usr/lib/libethosu_delegate.so"):
             self.platform = "i.MX93"
         else:
@@ -95,9 +92,7 @@ class ImxSmartFitness:
             sys.exit()
 
         # Obtain available devices
-        devices = []
-        for device in glob.glob("/dev/video*"):
-            devices.append(device)
+        devices = utils.run_check()
 
         for device in devices:
             self.sources_list.append_text(device)
@@ -137,6 +132,14 @@ class ImxSmartFitness:
         self.progress_bar.set_fraction(0.0)
         return False
 
+    def download_progress(self, done, total):
+        """Shows the progress of the downloads"""
+        if total:
+            GLib.idle_add(
+                self.status_bar.set_text,
+                f"Downloading models... {100 * done // total}%",
+            )
+
     @threaded
     def start(self, widget):
         """
@@ -151,126 +154,58 @@ class ImxSmartFitness:
 
         GLib.idle_add(self.status_bar.set_text, "Downloading models...")
 
-        # Download assets
-        model_detection = utils.download_file(self.model_detection_tflite)
-        model_landmarks = utils.download_file(self.model_landmark_tflite)
-        anchors = utils.download_file("anchors.txt")
-        embeddings = utils.download_file("pose_embeddings.csv")
+        # Resolve, verify and download all assets at once
+        paths, errors = utils.prefetch(
+            [
+                self.model_detection_tflite,
+                self.model_landmark_tflite,
+                "anchors.txt",
+                "pose_embeddings.csv",
+            ],
+            self.download_progress,
+        )
 
         # Handle errors during download if present
-        if (
-            model_detection == -1
-            or model_landmarks == -1
-            or anchors == -1
-            or embeddings == -1
-        ):
+        if errors:
             self.pulsing = False
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Cannot find files!\n"
-                "Make sure required files are available in downloads database!",
-            )
-            self.run_button.set_sensitive(True)
-            self.sources_list.set_sensitive(True)
-            return False
-        if (
-            model_detection == -2
-            or model_landmarks == -2
-            or anchors == -2
-            or embeddings == -2
-        ):
-            self.pulsing = False
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Download failed!\n"
-                "Please make sure you have internet connection on the target and try again.",
-            )
+            GLib.idle_add(self.status_bar.set_text, utils.prefetch_error(errors))
             self.run_button.set_sensitive(True)
             self.sources_list.set_sensitive(True)
             return False
 
-        if (
-            model_detection == -3
-            or model_landmarks == -3
-            or anchors == -3
-            or embeddings == -3
-        ):
-            self.pulsing = False
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Downloaded corrupted file!\n"
-                "Please clean /home/root/.cache/gopoint and try to download again.",
-            )
-            self.run_button.set_sensitive(True)
-            self.sources_list.set_sensitive(True)
-            return False
+        model_detection = paths[self.model_detection_tflite]
+        model_landmarks = paths[self.model_landmark_tflite]
 
         GLib.idle_add(self.status_bar.set_text, "Loading models to cache...")
 
-        # Load models and save graphs on cache
+        # Load models and save graphs on cache, skipping cached graphs
         if self.platform == "i.MX8MP":
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Warming up detection model and saving to cache...",
-            )
-
-            subprocess.run(
-                self.cache_enable
-                + " /usr/bin/tensorflow-lite-*/examples/benchmark_model "
-                "--graph=/home/root/.cache/gopoint/"
-                + self.model_detection_tflite
-                + " --external_delegate_path=/usr/lib/libvx_delegate.so",
-                shell=True,
-                check=True,
-            )
+            models = {"detection": model_detection, "landmark": model_landmarks}
+            cache = graph_cache.GraphCache()
+            cache.evict()
+            for name, model in models.items():
+                cache.warm(
+                    model,
+                    on_miss=lambda name=name: GLib.idle_add(
+                        self.status_bar.set_text,
+                        f"Warming up {name} model and saving to cache...",
+                    ),
+                )
+            self.cache_enable = cache.env_prefix(models.values())
 
+        if self.platform == "i.MX93":
             GLib.idle_add(
                 self.status_bar.set_text,
-                "Warming up landmark model and saving to cache...",
-            )
-
-            subprocess.run(
-                self.cache_enable
-                + " /usr/bin/tensorflow-lite-*/examples/benchmark_model "
-                "--graph=/home/root/.cache/gopoint/"
-                + self.model_landmark_tflite
-                + " --external_delegate_path=/usr/lib/libvx_delegate.so",
-                shell=True,
-                check=True,
+                "Compiling and saving models to cache...",
             )
-
-        if self.platform == "i.MX93":
-            if not os.path.exists(
-                "/home/root/.cache/gopoint/" + self.model_detection_vela
-            ):
-                GLib.idle_add(
-                    self.status_bar.set_text,
-                    "Compiling and saving detection model to cache...",
-                )
-
-                subprocess.run(
-                    "vela /home/root/.cache/gopoint/"
-                    + self.model_detection_tflite
-                    + " --output-dir=/home/root/.cache/gopoint/",
-                    shell=True,
-                    check=True,
-                )
-
-            if not os.path.exists(
-                "/home/root/.cache/gopoint/" + self.model_landmark_vela
-            ):
-                GLib.idle_add(
-                    self.status_bar.set_text,
-                    "Compiling and saving landmark model to cache...",
-                )
-
-                subprocess.run(
-                    "vela /home/root/.cache/gopoint/"
-                    + self.model_landmark_tflite
-                    + " --output-dir=/home/root/.cache/gopoint/",
-                    shell=True,
-                    check=True,
-                )
+            results = vela_cache.compile_models([model_detection, model_landmarks])
+            GLib.idle_add(self.status_bar.set_text, vela_cache.summary(results))
+            if any(result.path is None for result in results):
+                # The demo cannot load the missing *_vela.tflite models
+                self.pulsing = False
+                self.run_button.set_sensitive(True)
+                self.sources_list.set_sensitive(True)
+                return False
 
         GLib.idle_add(self.status_bar.set_text, "Models are ready!")
         self.pulsing = False
@@ -0,0 +1,647 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: Apache-2.0
+
+Benchmark engine of ML Benchmark.
+
+Runs a sweep of models, backends (CPU, GPU, NPU) and thread counts, several
+times each. Every run gives its init time, warm-up statistics and inference
+statistics (min/avg/max/std), and the runs of a configuration are summarized
+with percentiles.
+
+Runs use the benchmark_model tool when it is installed. Otherwise, or when
+asked to, the model is run in this process with tflite_runtime, which also
+measures the latency of every invoke, the cost of copying the inputs and
+the memory high-water mark. Both report invoke times the same way, so their
+results can be compared.
+
+Results are appended to a history with the SoC, BSP and kernel they were
+measured on, so the performance of two BSP releases can be compared.
+
+Usage:
+    python3 benchmark_engine.py run MODEL [MODEL ...] [--backends CPU NPU]
+                                [--threads 1 2 4] [--repetitions 5]
+                                [--runner interpreter]
+    python3 benchmark_engine.py history [--csv FILE]
+    python3 benchmark_engine.py compare OLD_BSP NEW_BSP [--threshold 0.1]
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import NamedTuple
+import numpy as np
+import tflite_runtime.interpreter as tflite
+
+sys.path.append("/home/root/.nxp-demo-experience/scripts")
+import graph_cache
+import vela_cache
+import span_profiler
+
+BENCHMARK_MODEL = "/usr/bin/**/benchmark_model"
+VX_DELEGATE = "/usr/lib/libvx_delegate.so"
+ETHOSU_DELEGATE = "/usr/lib/libethosu_delegate.so"
+HISTORY_FILE = "/home/root/.local/share/gopoint/ml_benchmark/history.jsonl"
+
+BACKENDS = ("CPU", "GPU", "NPU")
+
+REGRESSION_THRESHOLD = 0.1
+"""Relative slowdown between two BSP releases reported as a regression"""
+
+
+class RunStats(NamedTuple):
+    """Statistics printed by benchmark_model for a series of runs, in ms"""
+
+    count: int
+    min: float
+    max: float
+    avg: float
+    std: float
+
+
+class RunResult(NamedTuple):
+    """Timings of one benchmark_model run, in ms
+
+    init -- time to create the interpreter and apply the delegate
+    first -- first inference, including the graph compilation of delegates
+    warmup -- warm-up runs
+    inference -- measured runs
+    samples -- latency of each measured invoke, if known
+    copy -- average time to copy the inputs before an invoke, if known
+    peak_memory -- memory high-water mark increase in MB, if known
+    """
+
+    init: float
+    first: float
+    warmup: RunStats
+    inference: RunStats
+    samples: tuple = ()
+    copy: float = 0.0
+    peak_memory: float = 0.0
+
+
+class Config(NamedTuple):
+    """Benchmarked configuration"""
+
+    model: str
+    backend: str
+    threads: int
+
+
+class Result(NamedTuple):
+    """Summary of the repetitions of a configuration, times in ms
+
+    Percentiles are computed over the latency of each invoke when the runner
+    measures it, and over the average of each repetition otherwise.
+    """
+
+    timestamp: float
+    soc: str
+    bsp: str
+    kernel: str
+    model: str
+    model_sha256: str
+    backend: str
+    threads: int
+    repetitions: int
+    init_ms: float
+    first_ms: float
+    warmup_ms: float
+    avg_ms: float
+    min_ms: float
+    max_ms: float
+    std_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    runner: str = "benchmark_model"
+    copy_ms: float = 0.0
+    peak_memory_mb: float = 0.0
+
+
+STATS = re.compile(r"count=(\d+)(.*)")
+FIELD = re.compile(r"(\w+)=([\d.]+)")
+TIMINGS = re.compile(r"Inference timings in us: (.*)")
+MEMORY = re.compile(r"Memory footprint delta.*overall=([\d.]+)")
+
+
+def parse_stats(text):
+    """Returns the RunStats of a 'count=N first=... avg=...' line"""
+    match = STATS.search(text)
+    fields = dict(FIELD.findall(match.group(2)))
+    count = int(match.group(1))
+    curr = float(fields.get("curr", 0)) / 1000
+    return RunStats(
+        count,
+        float(fields.get("min", fields.get("curr", 0))) / 1000,
+        float(fields.get("max", fields.get("curr", 0))) / 1000,
+        float(fields["avg"]) / 1000 if "avg" in fields else curr,
+        float(fields.get("std", 0)) / 1000,
+    )
+
+
+def parse_output(output):
+    """Returns the RunResult of the output of benchmark_model, or None
+
+    The first 'count=' line reports the warm-up runs and the second one the
+    measured runs.
+    """
+    series = [parse_stats(line) for line in output.splitlines() if "count=" in line]
+    timings = TIMINGS.search(output)
+    if len(series) < 2 or timings is None:
+        return None
+    values = {}
+    for item in timings.group(1).split(","):
+        name, _, value = item.partition(":")
+        values[name.strip()] = float(value) / 1000
+    memory = MEMORY.search(output)
+    return RunResult(
+        values.get("Init", 0.0),
+        values.get("First inference", 0.0),
+        *series[:2],
+        peak_memory=float(memory.group(1)) if memory else 0.0,
+    )
+
+
+def sample_stats(samples):
+    """Returns the RunStats of a list of latencies"""
+    return RunStats(
+        len(samples),
+        min(samples),
+        max(samples),
+        statistics.fmean(samples),
+        statistics.pstdev(samples),
+    )
+
+
+def percentile(values, fraction):
+    """Returns the percentile of values, interpolating between samples"""
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def median(values):
+    """Returns the median of values"""
+    return percentile(values, 0.5)
+
+
+def environment():
+    """Returns the SoC, BSP release and kernel the benchmark runs on"""
+    try:
+        with open("/sys/devices/soc0/soc_id", encoding="utf-8") as file:
+            soc = file.read().strip()
+    except OSError:
+        soc = "unknown"
+    bsp = "unknown"
+    try:
+        with open("/etc/os-release", encoding="utf-8") as file:
+            release = dict(
+                line.rstrip("\n").split("=", 1) for line in file if "=" in line
+            )
+        bsp = release.get("VERSION", release.get("VERSION_ID", bsp)).strip('"')
+    except OSError:
+        pass
+    return {"soc": soc, "bsp": bsp, "kernel": os.uname().release}
+
+
+def find_benchmark_model():
+    """Returns the path of benchmark_model, or None"""
+    binaries = glob.glob(BENCHMARK_MODEL, recursive=True)
+    return binaries[0] if binaries else None
+
+
+def summarize(config, runs, env, model_sha256, runner="benchmark_model"):
+    """Returns the Result of the runs of config"""
+    averages = [run.inference.avg for run in runs]
+    if all(run.samples for run in runs):
+        averages = [sample for run in runs for sample in run.samples]
+    count = sum(run.inference.count for run in runs)
+    avg = sum(run.inference.avg * run.inference.count for run in runs) / count
+    # Pooled deviation of all the measured runs
+    variance = (
+        sum(
+            run.inference.count
+            * (run.inference.std**2 + (run.inference.avg - avg) ** 2)
+            for run in runs
+        )
+        / count
+    )
+    return Result(
+        time.time(),
+        env["soc"],
+        env["bsp"],
+        env["kernel"],
+        os.path.basename(config.model),
+        model_sha256,
+        config.backend,
+        config.threads,
+        len(runs),
+        median([run.init for run in runs]),
+        median([run.first for run in runs]),
+        median([run.warmup.avg for run in runs]),
+        avg,
+        min(run.inference.min for run in runs),
+        max(run.inference.max for run in runs),
+        math.sqrt(variance),
+        percentile(averages, 0.5),
+        percentile(averages, 0.9),
+        percentile(averages, 0.99),
+        runner,
+        median([run.copy for run in runs]),
+        max(run.peak_memory for run in runs),
+    )
+
+
+class BenchmarkModelRunner:
+    """Runs a configuration with the benchmark_model tool
+
+    Arguments:
+    binary -- path of benchmark_model, found in /usr/bin by default
+    num_runs -- measured runs per repetition, tool default if None
+    warmup_runs -- warm-up runs per repetition, tool default if None
+    """
+
+    name = "benchmark_model"
+
+    def __init__(self, binary=None, num_runs=None, warmup_runs=None):
+        self.binary = binary or find_benchmark_model()
+        self.num_runs = num_runs
+        self.warmup_runs = warmup_runs
+
+    def command(self, config, model):
+        """Returns the command line and environment running config"""
+        command = [self.binary, "--graph=" + model]
+        command.append(f"--num_threads={config.threads}")
+        env = dict(os.environ)
+        if config.backend == "GPU":
+            command.append("--external_delegate_path=" + VX_DELEGATE)
+            env["USE_GPU_INFERENCE"] = "1"
+        elif config.backend == "NPU":
+            if os.path.exists(VX_DELEGATE):
+                command.append("--external_delegate_path=" + VX_DELEGATE)
+                env["USE_GPU_INFERENCE"] = "0"
+                env.update(graph_cache.GraphCache().env([model]))
+            else:
+                command.append("--external_delegate_path=" + ETHOSU_DELEGATE)
+        if self.num_runs is not None:
+            command.append(f"--num_runs={self.num_runs}")
+        if self.warmup_runs is not None:
+            command.append(f"--warmup_runs={self.warmup_runs}")
+        return command, env
+
+    def run(self, config, model):
+        """Returns the RunResult of one run, or None if it failed"""
+        command, env = self.command(config, model)
+        result = subprocess.run(
+            command, env=env, capture_output=True, text=True, check=False
+        )
+        if result.returncode != 0:
+            return None
+        return parse_output(result.stdout + result.stderr)
+
+
+def memory_status(field):
+    """Returns a memory field of /proc/self/status in MB"""
+    with open("/proc/self/status", encoding="utf-8") as file:
+        for line in file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def reset_peak_memory():
+    """Resets the memory high-water mark (VmHWM) of this process"""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def random_inputs(interpreter):
+    """Returns (tensor index, random data) for each input of interpreter"""
+    inputs = []
+    for detail in interpreter.get_input_details():
+        if np.issubdtype(detail["dtype"], np.integer):
+            info = np.iinfo(detail["dtype"])
+            data = np.random.randint(
+                info.min, info.max, detail["shape"], dtype=detail["dtype"]
+            )
+        else:
+            data = np.random.random_sample(detail["shape"]).astype(detail["dtype"])
+        inputs.append((detail["index"], data))
+    return inputs
+
+
+class InterpreterRunner:
+    """Runs a configuration in this process with tflite_runtime
+
+    Like benchmark_model, the inputs are filled once with random data and
+    the inference statistics only time invoke. The time to copy the inputs
+    into the interpreter before each invoke is measured separately.
+
+    Arguments:
+    num_runs -- measured invokes per repetition
+    warmup_runs -- invokes before the measured ones, after the first one
+    """
+
+    name = "interpreter"
+
+    def __init__(self, num_runs=50, warmup_runs=5):
+        self.num_runs = num_runs or 50
+        self.warmup_runs = 5 if warmup_runs is None else warmup_runs
+
+    def delegates(self, config, model):
+        """Returns the delegates of config, setting up their environment"""
+        if config.backend == "GPU":
+            os.environ["USE_GPU_INFERENCE"] = "1"
+            return [tflite.load_delegate(VX_DELEGATE)]
+        if config.backend == "NPU":
+            if os.path.exists(VX_DELEGATE):
+                os.environ["USE_GPU_INFERENCE"] = "0"
+                graph_cache.GraphCache().apply([model])
+                return [tflite.load_delegate(VX_DELEGATE)]
+            return [tflite.load_delegate(ETHOSU_DELEGATE)]
+        return []
+
+    def run(self, config, model):
+        """Returns the RunResult of one run, or None if it failed"""
+        reset_peak_memory()
+        base_memory = memory_status("VmRSS")
+        try:
+            start = time.perf_counter()
+            with span_profiler.span("interpreter init"):
+                interpreter = tflite.Interpreter(
+                    model_path=model,
+                    num_threads=config.threads,
+                    experimental_delegates=self.delegates(config, model),
+                )
+                interpreter.allocate_tensors()
+            init = time.perf_counter() - start
+        except (ValueError, RuntimeError, OSError):
+            return None
+
+        inputs = random_inputs(interpreter)
+
+        def copy_inputs():
+            for index, data in inputs:
+                interpreter.set_tensor(index, data)
+
+        def timed(function):
+            with span_profiler.span(function.__name__):
+                start = time.perf_counter()
+                function()
+                return (time.perf_counter() - start) * 1000
+
+        copy_inputs()
+        first = timed(interpreter.invoke)
+        warmup = [timed(interpreter.invoke) for _ in range(self.warmup_runs)]
+        copies = []
+        samples = []
+        for _ in range(self.num_runs):
+            copies.append(timed(copy_inputs))
+            samples.append(timed(interpreter.invoke))
+        return RunResult(
+            init * 1000,
+            first,
+            sample_stats(warmup or [first]),
+            sample_stats(samples),
+            tuple(samples),
+            statistics.fmean(copies),
+            memory_status("VmHWM") - base_memory,
+        )
+
+
+def default_runner(num_runs=None, warmup_runs=None):
+    """Returns the benchmark_model runner, or the in-process one without it"""
+    if find_benchmark_model() is not None:
+        return BenchmarkModelRunner(None, num_runs, warmup_runs)
+    return InterpreterRunner(num_runs, warmup_runs)
+
+
+class BenchmarkEngine:
+    """Runs configurations several times and summarizes them
+
+    Arguments:
+    runner -- runs one repetition of a configuration
+    repetitions -- runs per configuration
+    history -- file the results are appended to, None to keep no history
+    """
+
+    def __init__(self, runner=None, repetitions=3, history=HISTORY_FILE):
+        self.runner = runner or default_runner()
+        self.repetitions = repetitions
+        self.history = history
+        self.env = environment()
+
+    def prepare(self, config):
+        """Returns the model file to run for config
+
+        The Ethos-U NPU runs the model compiled by vela.
+        """
+        if config.backend == "NPU" and not os.path.exists(VX_DELEGATE):
+            return vela_cache.compile_models([config.model])[0].path
+        return config.model
+
+    def run(self, config):
+        """Returns the Result of config, or None if no repetition succeeded"""
+        model = self.prepare(config)
+        if model is None:
+            return None
+        with span_profiler.span(f"{config.backend} benchmark"):
+            runs = [self.runner.run(config, model) for _ in range(self.repetitions)]
+        runs = [run for run in runs if run is not None]
+        if not runs:
+            return None
+        result = summarize(
+            config, runs, self.env, file_sha256(config.model), self.runner.name
+        )
+        if self.history is not None:
+            append_history([result], self.history)
+        return result
+
+    def sweep(self, models, backends=("CPU", "NPU"), threads=(1,), progress=None):
+        """Runs every combination of models, backends and thread counts
+
+        Delegates run on a single CPU thread count, the first of threads.
+
+        Arguments:
+        progress -- called with (index, total, config) before each run
+        """
+        configs = []
+        for model in models:
+            for backend in backends:
+                counts = threads if backend == "CPU" else threads[:1]
+                configs += [Config(model, backend, count) for count in counts]
+        results = []
+        for index, config in enumerate(configs):
+            if progress is not None:
+                progress(index, len(configs), config)
+            results.append(self.run(config))
+        return results
+
+
+def append_history(results, path=HISTORY_FILE):
+    """Appends results to the history file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as file:
+        for result in results:
+            file.write(json.dumps(result._asdict()) + "\n")
+
+
+def load_history(path=HISTORY_FILE):
+    """Returns the results of the history file"""
+    results = []
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    results.append(Result(**json.loads(line)))
+                except (TypeError, ValueError):
+                    continue
+    except OSError:
+        pass
+    return results
+
+
+def export_csv(results, path):
+    """Writes results to a CSV file"""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(Result._fields)
+        writer.writerows(results)
+
+
+def compare(results, old_bsp, new_bsp, threshold=REGRESSION_THRESHOLD):
+    """Compares the latest results of two BSP releases
+
+    Returns (old, new, ratio, regression) for each configuration measured on
+    both, ratio being the new average time over the old one.
+    """
+
+    def latest(bsp):
+        found = {}
+        for result in sorted(results, key=lambda result: result.timestamp):
+            if result.bsp == bsp:
+                key = (result.soc, result.model_sha256, result.backend, result.threads)
+                found[key] = result
+        return found
+
+    old_results = latest(old_bsp)
+    rows = []
+    for key, new in latest(new_bsp).items():
+        old = old_results.get(key)
+        if old is None:
+            continue
+        ratio = new.avg_ms / old.avg_ms
+        rows.append((old, new, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def file_sha256(path):
+    """Returns the short SHA256 recorded with the results of a model"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def print_results(results):
+    """Prints a table of results"""
+    print(
+        f"{'model':<40} {'backend':<7} {'thr':>3} {'init':>8} {'warmup':>8} "
+        f"{'avg':>8} {'min':>8} {'max':>8} {'std':>7} {'p90':>8} "
+        f"{'copy':>7} {'mem MB':>7}"
+    )
+    for result in results:
+        print(
+            f"{result.model:<40} {result.backend:<7} {result.threads:>3} "
+            f"{result.init_ms:8.2f} {result.warmup_ms:8.2f} {result.avg_ms:8.2f} "
+            f"{result.min_ms:8.2f} {result.max_ms:8.2f} {result.std_ms:7.2f} "
+            f"{result.p90_ms:8.2f} {result.copy_ms:7.3f} {result.peak_memory_mb:7.1f}"
+        )
+
+
+def main():
+    """Command line interface of the benchmark engine"""
+    parser = argparse.ArgumentParser(description="ML benchmark engine")
+    parser.add_argument("--history", default=HISTORY_FILE, help="History file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runner = commands.add_parser("run", help="Benchmark models")
+    runner.add_argument("models", nargs="+", help="TFLite models")
+    runner.add_argument("--backends", nargs="+", default=["CPU", "NPU"])
+    runner.add_argument("--threads", nargs="+", type=int, default=[1])
+    runner.add_argument("--repetitions", type=int, default=3)
+    runner.add_argument("--num-runs", type=int, help="Measured runs per repetition")
+    runner.add_argument("--warmup-runs", type=int, help="Warm-up runs per repetition")
+    runner.add_argument(
+        "--runner",
+        choices=["auto", "benchmark_model", "interpreter"],
+        default="auto",
+        help="Run with benchmark_model or in this process (default: auto)",
+    )
+    history = commands.add_parser("history", help="Show the stored results")
+    history.add_argument("--csv", help="Export the history to a CSV file")
+    comparison = commands.add_parser("compare", help="Compare two BSP releases")
+    comparison.add_argument("old_bsp")
+    comparison.add_argument("new_bsp")
+    comparison.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.runner == "benchmark_model":
+            runner = BenchmarkModelRunner(None, args.num_runs, args.warmup_runs)
+            if runner.binary is None:
+                parser.error("benchmark_model not found")
+        elif args.runner == "interpreter":
+            runner = InterpreterRunner(args.num_runs, args.warmup_runs)
+        else:
+            runner = default_runner(args.num_runs, args.warmup_runs)
+        engine = BenchmarkEngine(runner, args.repetitions, args.history)
+        results = engine.sweep(
+            args.models,
+            args.backends,
+            args.threads,
+            lambda index, total, config: print(
+                f"[{index + 1}/{total}] {os.path.basename(config.model)} "
+                f"{config.backend} x{config.threads}",
+                flush=True,
+            ),
+        )
+        print_results([result for result in results if result is not None])
+    elif args.command == "history":
+        results = load_history(args.history)
+        if args.csv:
+            export_csv(results, args.csv)
+        print_results(results)
+    else:
+        rows = compare(
+            load_history(args.history), args.old_bsp, args.new_bsp, args.threshold
+        )
+        for old, new, ratio, regression in rows:
+            flag = "REGRESSION" if regression else ""
+            print(
+                f"{new.model:<40} {new.backend} x{new.threads}: "
+                f"{old.avg_ms:.2f} -> {new.avg_ms:.2f} ms ({ratio:.2f}x) {flag}"
+            )
+        if any(row[3] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
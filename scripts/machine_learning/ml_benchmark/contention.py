@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: Apache-2.0
+
+Contention benchmark of ML Benchmark.
+
+Demos like DMS run several models side by side on the same delegate. This
+benchmark runs a set of models concurrently, each one in its own process (or
+thread) and paced at its target frame rate, like a camera pipeline. A frame
+misses its deadline when its inference ends after the next frame is due, and
+frames whose slot already passed are dropped, as a live pipeline would.
+
+Each model is first run alone to get its latency without contention. The set
+of models (a pipeline) is then replicated 1, 2, ... times until the deadline
+miss rate goes over a threshold, giving the latency inflation of each model,
+the total throughput of the delegate and the number of pipelines the SoC can
+sustain.
+
+Usage:
+    python3 contention.py MODEL[@FPS] [MODEL[@FPS] ...] [--backend NPU]
+                          [--duration 10] [--mode thread] [--pipelines 2]
+                          [--max-pipelines 8] [--miss-threshold 0.05]
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import NamedTuple
+import benchmark_engine
+
+DEFAULT_RATE = 30.0
+"""Target frames per second of a model without @FPS"""
+
+MISS_THRESHOLD = 0.05
+"""Deadline miss rate over which a number of pipelines is not sustainable"""
+
+WARMUP_RUNS = 3
+
+SETUP_TIMEOUT = 120
+"""Seconds to wait for all the workers to load their model"""
+
+
+class Workload(NamedTuple):
+    """Model run at a target rate
+
+    rate -- target frames per second, 0 to run as fast as possible
+    """
+
+    model: str
+    backend: str
+    threads: int
+    rate: float
+
+
+class WorkerResult(NamedTuple):
+    """Frames of a workload run by a worker"""
+
+    latencies: list
+    misses: int
+    dropped: int
+    seconds: float
+
+
+class WorkloadStats(NamedTuple):
+    """Latency and deadline misses of a workload, times in ms
+
+    fps -- frames processed per second
+    miss_rate -- frames missing their deadline or dropped, over all frames
+    inflation -- p50 latency over the p50 latency without contention
+    """
+
+    model: str
+    rate: float
+    frames: int
+    fps: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    miss_rate: float
+    inflation: float
+
+
+class Scenario(NamedTuple):
+    """Result of a number of pipelines run concurrently
+
+    stats -- WorkloadStats of each worker, None for the workers that failed
+    throughput -- inferences per second of all the workers
+    sustained -- True if every worker ran and few frames missed their deadline
+    """
+
+    pipelines: int
+    stats: list
+    throughput: float
+    miss_rate: float
+    sustained: bool
+
+
+def parse_workload(text, backend, threads):
+    """Returns the Workload of a MODEL[@FPS] argument"""
+    model, _, rate = text.rpartition("@")
+    if not model or not rate.replace(".", "", 1).isdigit():
+        return Workload(text, backend, threads, DEFAULT_RATE)
+    return Workload(model, backend, threads, float(rate))
+
+
+def run_worker(workload, model, duration, barrier, results, index):
+    """Runs workload at its rate for duration seconds once all workers are ready"""
+    config = benchmark_engine.Config(model, workload.backend, workload.threads)
+    try:
+        interpreter = benchmark_engine.tflite.Interpreter(
+            model_path=model,
+            num_threads=workload.threads,
+            experimental_delegates=benchmark_engine.InterpreterRunner().delegates(
+                config, model
+            ),
+        )
+        interpreter.allocate_tensors()
+        inputs = benchmark_engine.random_inputs(interpreter)
+        for tensor, data in inputs:
+            interpreter.set_tensor(tensor, data)
+        for _ in range(WARMUP_RUNS):
+            interpreter.invoke()
+    except (ValueError, RuntimeError, OSError):
+        results.put((index, None))
+        barrier.abort()
+        return
+    try:
+        barrier.wait(SETUP_TIMEOUT)
+    except threading.BrokenBarrierError:
+        results.put((index, None))
+        return
+
+    period = 1 / workload.rate if workload.rate else 0.0
+    latencies = []
+    misses = dropped = frame = 0
+    start = time.monotonic()
+    while True:
+        scheduled = start + frame * period
+        now = time.monotonic()
+        if now - start >= duration:
+            break
+        if scheduled > now:
+            time.sleep(scheduled - now)
+        begin = time.monotonic()
+        for tensor, data in inputs:
+            interpreter.set_tensor(tensor, data)
+        interpreter.invoke()
+        end = time.monotonic()
+        latencies.append((end - begin) * 1000)
+        frame += 1
+        if period:
+            if end > scheduled + period:
+                misses += 1
+            # Frames due while this one ran are dropped
+            due = math.floor((end - start) / period)
+            if due > frame:
+                dropped += due - frame
+                frame = due
+    results.put(
+        (index, WorkerResult(latencies, misses, dropped, time.monotonic() - start))
+    )
+
+
+def run_concurrent(workloads, models, duration, mode="process"):
+    """Runs workloads concurrently, returns their WorkerResult in order
+
+    Arguments:
+    models -- model file run by each workload, e.g. compiled by vela
+    mode -- run each workload in a "process" or in a "thread"
+    """
+    if mode == "process":
+        barrier = multiprocessing.Barrier(len(workloads))
+        results = multiprocessing.Queue()
+        worker_class = multiprocessing.Process
+    else:
+        barrier = threading.Barrier(len(workloads))
+        results = queue.Queue()
+        worker_class = threading.Thread
+    workers = [
+        worker_class(
+            target=run_worker,
+            args=(workload, model, duration, barrier, results, index),
+            daemon=True,
+        )
+        for index, (workload, model) in enumerate(zip(workloads, models))
+    ]
+    for worker in workers:
+        worker.start()
+    found = [None] * len(workloads)
+    for _ in workers:
+        try:
+            index, result = results.get(timeout=duration + SETUP_TIMEOUT)
+        except queue.Empty:
+            break
+        found[index] = result
+    for worker in workers:
+        worker.join(5)
+    return found
+
+
+def workload_stats(workload, result, baseline_ms):
+    """Returns the WorkloadStats of a WorkerResult, None if the worker failed"""
+    if result is None or not result.latencies:
+        return None
+    frames = len(result.latencies)
+    p50 = benchmark_engine.percentile(result.latencies, 0.5)
+    return WorkloadStats(
+        workload.model,
+        workload.rate,
+        frames,
+        frames / result.seconds,
+        p50,
+        benchmark_engine.percentile(result.latencies, 0.9),
+        benchmark_engine.percentile(result.latencies, 0.99),
+        (result.misses + result.dropped) / (frames + result.dropped),
+        p50 / baseline_ms if baseline_ms else 0.0,
+    )
+
+
+class ContentionBenchmark:
+    """Runs pipelines of workloads concurrently on one delegate
+
+    Arguments:
+    workloads -- Workload of each model of a pipeline
+    duration -- seconds each scenario runs
+    mode -- run each workload in a "process" or in a "thread"
+    miss_threshold -- deadline miss rate over which pipelines are not sustained
+    """
+
+    def __init__(
+        self, workloads, duration=10.0, mode="process", miss_threshold=MISS_THRESHOLD
+    ):
+        self.workloads = workloads
+        self.duration = duration
+        self.mode = mode
+        self.miss_threshold = miss_threshold
+        engine = benchmark_engine.BenchmarkEngine(
+            benchmark_engine.InterpreterRunner(), history=None
+        )
+        self.models = [
+            engine.prepare(benchmark_engine.Config(workload.model, workload.backend, 1))
+            for workload in workloads
+        ]
+        self.baseline = {}
+
+    def isolated(self):
+        """Runs each workload alone, returns their WorkloadStats"""
+        stats = []
+        for workload, model in zip(self.workloads, self.models):
+            result = run_concurrent([workload], [model], self.duration, self.mode)[0]
+            baseline = None
+            if result is not None and result.latencies:
+                baseline = benchmark_engine.percentile(result.latencies, 0.5)
+            self.baseline[workload] = baseline
+            stats.append(workload_stats(workload, result, baseline))
+        return stats
+
+    def scenario(self, pipelines):
+        """Runs the workloads replicated pipelines times, returns the Scenario"""
+        if not self.baseline:
+            self.isolated()
+        workloads = self.workloads * pipelines
+        results = run_concurrent(
+            workloads, self.models * pipelines, self.duration, self.mode
+        )
+        stats = [
+            workload_stats(workload, result, self.baseline.get(workload))
+            for workload, result in zip(workloads, results)
+        ]
+        frames = sum(len(result.latencies) for result in results if result)
+        missed = sum(result.misses + result.dropped for result in results if result)
+        dropped = sum(result.dropped for result in results if result)
+        miss_rate = missed / (frames + dropped) if frames else 1.0
+        return Scenario(
+            pipelines,
+            stats,
+            sum(item.fps for item in stats if item),
+            miss_rate,
+            None not in stats and miss_rate <= self.miss_threshold,
+        )
+
+    def capacity(self, max_pipelines=8, progress=None):
+        """Adds pipelines until they are not sustained
+
+        Returns the number of sustained pipelines and the Scenario of each
+        number of pipelines tried.
+
+        Arguments:
+        progress -- called with each Scenario once it ran
+        """
+        scenarios = []
+        sustained = 0
+        for pipelines in range(1, max_pipelines + 1):
+            scenario = self.scenario(pipelines)
+            scenarios.append(scenario)
+            if progress is not None:
+                progress(scenario)
+            if not scenario.sustained:
+                break
+            sustained = pipelines
+        return sustained, scenarios
+
+
+def print_scenario(scenario):
+    """Prints the latency of each worker of scenario"""
+    state = "sustained" if scenario.sustained else "NOT sustained"
+    print(
+        f"\n{scenario.pipelines} pipeline(s): {scenario.throughput:.1f} inferences/s, "
+        f"{scenario.miss_rate * 100:.1f}% deadline misses, {state}"
+    )
+    print(
+        f"{'model':<40} {'target':>6} {'fps':>6} {'p50':>8} {'p90':>8} {'p99':>8} "
+        f"{'miss%':>6} {'infl':>5}"
+    )
+    for stats in scenario.stats:
+        if stats is None:
+            print(f"{'(worker failed)':<40}")
+            continue
+        print(
+            f"{os.path.basename(stats.model):<40} {stats.rate:6.1f} {stats.fps:6.1f} "
+            f"{stats.p50_ms:8.2f} {stats.p90_ms:8.2f} {stats.p99_ms:8.2f} "
+            f"{stats.miss_rate * 100:6.1f} {stats.inflation:5.2f}"
+        )
+
+
+def main():
+    """Command line interface of the contention benchmark"""
+    parser = argparse.ArgumentParser(description="ML contention benchmark")
+    parser.add_argument("models", nargs="+", help="TFLite models, as MODEL[@FPS]")
+    parser.add_argument("--backend", choices=benchmark_engine.BACKENDS, default="NPU")
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads per model")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run")
+    parser.add_argument("--mode", choices=["process", "thread"], default="process")
+    parser.add_argument("--pipelines", type=int, help="Only run this many pipelines")
+    parser.add_argument("--max-pipelines", type=int, default=8)
+    parser.add_argument("--miss-threshold", type=float, default=MISS_THRESHOLD)
+    parser.add_argument("--json", help="Write the scenarios to a JSON file")
+    args = parser.parse_args()
+
+    workloads = [parse_workload(m, args.backend, args.threads) for m in args.models]
+    benchmark = ContentionBenchmark(
+        workloads, args.duration, args.mode, args.miss_threshold
+    )
+    if None in benchmark.models:
+        parser.exit(1, "Model preparation failed\n")
+
+    print("Running each model alone...", flush=True)
+    alone = benchmark.isolated()
+    for workload, stats in zip(workloads, alone):
+        latency = "failed" if stats is None else f"p50 {stats.p50_ms:.2f} ms"
+        print(f"  {os.path.basename(workload.model)}: {latency}")
+
+    if args.pipelines:
+        scenarios = [benchmark.scenario(args.pipelines)]
+        print_scenario(scenarios[0])
+        sustained = args.pipelines if scenarios[0].sustained else 0
+    else:
+        sustained, scenarios = benchmark.capacity(args.max_pipelines, print_scenario)
+    print(f"\nSustained pipelines on {args.backend}: {sustained}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "environment": benchmark_engine.environment(),
+                    "workloads": [workload._asdict() for workload in workloads],
+                    "sustained": sustained,
+                    "scenarios": [
+                        {
+                            "pipelines": scenario.pipelines,
+                            "throughput": scenario.throughput,
+                            "miss_rate": scenario.miss_rate,
+                            "stats": [
+                                None if stats is None else stats._asdict()
+                                for stats in scenario.stats
+                            ],
+                        }
+                        for scenario in scenarios
+                    ],
+                },
+                file,
+                indent=1,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,6 @@ User can choose a desired TFLite model for benchmark comparison
 
 import os
 import sys
-import subprocess
 import threading
 import time
 import gi
@@ -23,8 +22,16 @@ from gi.repository import GLib
 # Import utils
 sys.path.append("/home/root/.nxp-demo-experience/scripts")
 import utils
+import vela_cache
+import benchmark_engine
+import op_profile
+import span_profiler
 
-MODELS_PATH = "/home/root/.cache/gopoint/"
+REPETITIONS = 3
+"""Runs of the benchmark per backend"""
+
+REPORT_FOLDER = "/home/root/.local/share/gopoint/ml_benchmark"
+"""Folder of the exported operator profiles"""
 
 
 def threaded(fn):
@@ -57,6 +64,7 @@ class MLBenchmark:
         self.number_threads = self.builder.get_object("number-threads")
         self.text_box = self.builder.get_object("text-box")
         self.run_button = self.builder.get_object("run-button")
+        self.profile_check = self.builder.get_object("profile-check")
         self.status_bar = self.builder.get_object("status-bar")
         self.about_button = self.builder.get_object("about-button")
         self.file_chooser = self.builder.get_object("file-chooser")
@@ -70,7 +78,6 @@ class MLBenchmark:
 
         # General variables
         self.platform = None
-        self.cache_enable = ""
         self.threads_available = []
         self.cpu_model = str()
         self.npu_model = str()
@@ -79,10 +86,6 @@ class MLBenchmark:
         # Check target (i.MX8M Plus vs i.MX93)
         if os.path.exists("/usr/lib/libvx_delegate.so"):
             self.platform = "i.MX8MP"
-            self.cache_enable = (
-                "VIV_VX_ENABLE_CACHE_GRAPH_BINARY='1' "
-                + "VIV_VX_CACHE_BINARY_GRAPH_DIR=/home/root/.cache/gopoint "
-            )
             self.threads_available = ["1", "2", "3", "4"]
             self.delegate = "/usr/lib/libvx_delegate.so"
         elif os.path.exists("/usr/lib/libethosu_delegate.so"):
@@ -107,14 +110,6 @@ class MLBenchmark:
         preload_thread = threading.Thread(target=self.preload, daemon=True)
         preload_thread.start()
 
-    def get_time(self, output):
-        """Get the time (in ms) from the output"""
-        for line in output:
-            if line.startswith("INFO: Inference timings in us:"):
-                time_ms = float(line[line.find("Inference (avg):") + 17 :]) / 1000.0
-                return time_ms
-        return float(0.0)
-
     def about_dialog_activate(self, widget):
         """Function to handle the about dialog window"""
         self.about_dialog.run()
@@ -147,56 +142,44 @@ class MLBenchmark:
             self.file_chooser.set_sensitive(True)
             return False
 
-        if self.platform == "i.MX93":
-            self.compile_vela()
-
-        benchmark_path = (
-            subprocess.check_output(["find", "/usr/bin", "-name", "benchmark_model"])
-            .decode("utf-8")
-            .splitlines()
-        )
-        if len(benchmark_path) < 1:
-            GLib.idle_add(self.status_bar.set_text, "Missing benchmarking tool!")
+        if self.platform == "i.MX93" and not self.compile_vela():
             self.run_button.set_sensitive(True)
             self.number_threads.set_sensitive(True)
             self.file_chooser.set_sensitive(True)
-            time.sleep(1)
             return False
 
-        benchmark_path = benchmark_path[0]
-        number_threads = self.number_threads.get_active_text()
-        GLib.idle_add(self.status_bar.set_text, "Running CPU model...")
+        # Without benchmark_model, the engine runs the model in this process
+        engine = benchmark_engine.BenchmarkEngine(repetitions=REPETITIONS)
 
-        cpu_out = (
-            subprocess.check_output(
-                [
-                    benchmark_path,
-                    "--num_threads=" + number_threads,
-                    "--graph=" + self.cpu_model,
-                ]
-            )
-            .decode("utf-8")
-            .splitlines()
-        )
-        self.cpu_time = self.get_time(cpu_out)
+        number_threads = int(self.number_threads.get_active_text())
+        GLib.idle_add(self.status_bar.set_text, "Running CPU model...")
+        cpu = engine.run(benchmark_engine.Config(self.cpu_model, "CPU", number_threads))
 
+        # The engine runs the vela compiled model on i.MX93
         GLib.idle_add(self.status_bar.set_text, "Running NPU model...")
+        npu = engine.run(benchmark_engine.Config(self.cpu_model, "NPU", number_threads))
 
-        npu_out = (
-            subprocess.check_output(
-                [
-                    benchmark_path,
-                    "--graph=" + self.npu_model,
-                    "--external_delegate_path=" + self.delegate,
-                ]
-            )
-            .decode("utf-8")
-            .splitlines()
-        )
-        self.npu_time = self.get_time(npu_out)
+        if cpu is None or npu is None:
+            GLib.idle_add(self.status_bar.set_text, "Benchmark failed!")
+            self.run_button.set_sensitive(True)
+            self.number_threads.set_sensitive(True)
+            self.file_chooser.set_sensitive(True)
+            return False
+
+        # Show which operators the NPU leaves to the CPU, when asked for
+        report = ""
+        if self.profile_check.get_active():
+            GLib.idle_add(self.status_bar.set_text, "Profiling NPU operators...")
+            with span_profiler.span("operator profile"):
+                profile = op_profile.profile(
+                    benchmark_engine.Config(self.cpu_model, "NPU", number_threads)
+                )
+            report = "\n" + op_profile.summary(profile) + self.export_profile(profile)
 
         GLib.idle_add(self.status_bar.set_text, "Benchmarks finished!")
 
+        self.cpu_time = cpu.avg_ms
+        self.npu_time = npu.avg_ms
         if self.npu_time < self.cpu_time:
             ratio = str(round(((self.cpu_time) / self.npu_time), 2))
             comp = "The NPU can run " + ratio + " times during 1 CPU run!"
@@ -206,19 +189,18 @@ class MLBenchmark:
         else:
             comp = "The CPU and NPU are equal!"
         out = (
-            "\nTime to run on CPU: "
-            + str(round(self.cpu_time, 2))
-            + " ms ("
-            + str(round(1000 / self.cpu_time, 2))
-            + " IPS)\n"
-            + "Time to run on NPU: "
-            + str(round(self.npu_time, 2))
-            + " ms ("
-            + str(round(1000 / self.npu_time, 2))
-            + " IPS)\n\n"
+            "\n"
+            + self.describe("CPU", cpu)
+            + self.describe("NPU", npu)
+            + "\n"
             + comp
             + "\n"
+            + report
         )
+        if span_profiler.visible():
+            # No video to draw on, the spans of all the runs follow the results
+            stats = span_profiler.summarize(span_profiler.profiler().recorded())
+            out += "\n" + "\n".join(span_profiler.format_stats(stats)) + "\n"
 
         GLib.idle_add(self.text_box.set_text, out)
         self.run_button.set_sensitive(True)
@@ -227,6 +209,35 @@ class MLBenchmark:
 
         return True
 
+    def describe(self, name, result):
+        """Returns the text showing the result of a backend"""
+        text = (
+            f"Time to run on {name}: {result.avg_ms:.2f} ms "
+            f"({1000 / result.avg_ms:.2f} IPS)\n"
+            f"    min {result.min_ms:.2f} / p90 {result.p90_ms:.2f} / "
+            f"max {result.max_ms:.2f} ms, init {result.init_ms:.2f} ms, "
+            f"warm-up {result.warmup_ms:.2f} ms\n"
+        )
+        if result.runner == "interpreter":
+            text += (
+                f"    input copy {result.copy_ms:.3f} ms, "
+                f"peak memory +{result.peak_memory_mb:.1f} MB\n"
+            )
+        return text
+
+    def export_profile(self, profile):
+        """Exports the operator profile, returns the text showing where"""
+        if not profile.ops:
+            return ""
+        name = os.path.basename(profile.model).rsplit(".tflite", 1)[0]
+        path = os.path.join(REPORT_FOLDER, name + "_ops.csv")
+        try:
+            os.makedirs(REPORT_FOLDER, exist_ok=True)
+            op_profile.export_csv(profile, path)
+        except OSError:
+            return ""
+        return "    Operator report: " + path + "\n"
+
     def preload(self):
         """Download the default model"""
 
@@ -286,27 +297,17 @@ class MLBenchmark:
 
     def compile_vela(self):
         """Compile vela model"""
-        self.npu_model = self.vela_name(self.cpu_model)
-        if not os.path.exists(self.npu_model):
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Compiling model with vela and saving to cache...",
-            )
-
-            subprocess.run(
-                "vela " + self.cpu_model + " --output-dir=/home/root/.cache/gopoint/",
-                shell=True,
-                check=True,
-            )
-
-    def vela_name(self, model_name):
-        """
-        Appends the vela label to model name
-        """
-        tokens = model_name.split(".tflite")
-        return MODELS_PATH + (tokens[-2] + "_vela.tflite").split("/")[-1]
+        GLib.idle_add(
+            self.status_bar.set_text,
+            "Compiling model with vela and saving to cache...",
+        )
+        results = vela_cache.compile_models([self.cpu_model])
+        self.npu_model = results[0].path
+        GLib.idle_add(self.status_bar.set_text, vela_cache.summary(results))
+        return self.npu_model is not None
 
 
 if __name__ == "__main__":
+    span_profiler.install()
     main = MLBenchmark()
     gtk.main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: Apache-2.0
+
+Per-operator profiling of ML Benchmark.
+
+Runs a model with benchmark_model --enable_op_profiling and parses the time
+spent in each node of the execution plan. Delegates replace the operators
+they support by a single node per partition (e.g. "Vx Delegate" or the
+"ethos-u" operator of vela models), so the remaining operators are those
+falling back to the CPU. The report aggregates the time by operator type and
+by partition, and lists the CPU fallback operators, which are the candidates
+for requantization or replacement.
+
+Without benchmark_model, the execution plan is read from tflite_runtime, which
+shows the partitions and the fallback operators but not their time.
+
+Usage:
+    python3 op_profile.py MODEL [--backend NPU] [--threads 1]
+                                [--csv FILE] [--json FILE]
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import subprocess
+from typing import NamedTuple
+import benchmark_engine
+
+DELEGATE_NODE = re.compile(r"delegate|ethos-u", re.IGNORECASE)
+"""Node types of the partitions run by a delegate"""
+
+CPU_DELEGATE_NODE = re.compile(r"xnnpack", re.IGNORECASE)
+"""Delegate nodes running on the CPU, e.g. the XNNPACK fallback partitions"""
+
+COLUMN = re.compile(r"\[([^\]]+)\]")
+NODE_NAME = re.compile(r"^\[(.*)\](:\d+)?$")
+
+
+class Op(NamedTuple):
+    """Node of the execution plan
+
+    index -- position in the execution plan
+    op_type -- operator type, or the delegate name for delegated partitions
+    name -- name of the node, usually its output tensor
+    device -- CPU, or the backend running the delegated partition
+    first_ms -- time of the first run, None if not profiled
+    avg_ms -- average time per run, None if not profiled
+    """
+
+    index: int
+    op_type: str
+    name: str
+    device: str
+    first_ms: float = None
+    avg_ms: float = None
+
+
+class Partition(NamedTuple):
+    """Consecutive nodes running on the same device"""
+
+    index: int
+    device: str
+    ops: list
+    avg_ms: float
+
+
+class OpProfile(NamedTuple):
+    """Per-operator profile of a configuration"""
+
+    model: str
+    backend: str
+    threads: int
+    ops: list
+
+    @property
+    def profiled(self):
+        """True if the operators were timed"""
+        return any(op.avg_ms is not None for op in self.ops)
+
+    @property
+    def total_ms(self):
+        """Time of one run, summed over the operators"""
+        return sum(op.avg_ms or 0.0 for op in self.ops)
+
+
+def device_of(op_type, backend):
+    """Returns the device running a node of op_type"""
+    if (
+        backend != "CPU"
+        and DELEGATE_NODE.search(op_type)
+        and not CPU_DELEGATE_NODE.search(op_type)
+    ):
+        return backend
+    return "CPU"
+
+
+def parse_op_profile(output, backend="CPU"):
+    """Returns the Op of each node profiled by benchmark_model
+
+    The run order table of the regular benchmark runs is used, not the one
+    of the initialization.
+    """
+    lines = output.splitlines()
+    start = next(
+        (i for i, line in enumerate(lines) if "Regular Benchmark Runs" in line), None
+    )
+    if start is None:
+        return []
+    columns = None
+    ops = []
+    for line in lines[start + 1 :]:
+        if columns is None:
+            if "[node type]" in line.lower():
+                columns = [name.lower() for name in COLUMN.findall(line)]
+            continue
+        fields = [field.strip() for field in line.strip().split("\t") if field.strip()]
+        if len(fields) < len(columns):
+            break
+        row = dict(zip(columns, fields))
+        op_type = row["node type"]
+        ops.append(
+            Op(
+                len(ops),
+                op_type,
+                NODE_NAME.sub(r"\1", row.get("name", "")),
+                device_of(op_type, backend),
+                float(row.get("first", 0)),
+                float(row.get("avg ms", 0)),
+            )
+        )
+    return ops
+
+
+def by_type(ops):
+    """Returns (op_type, device, count, avg_ms) sorted by decreasing time"""
+    totals = {}
+    for op in ops:
+        count, avg_ms = totals.get((op.op_type, op.device), (0, 0.0))
+        totals[(op.op_type, op.device)] = (count + 1, avg_ms + (op.avg_ms or 0.0))
+    rows = [(key[0], key[1], *value) for key, value in totals.items()]
+    return sorted(rows, key=lambda row: (-row[3], row[0]))
+
+
+def partitions(ops):
+    """Returns the Partition of each run of consecutive nodes on a device"""
+    found = []
+    for op in ops:
+        if not found or found[-1].device != op.device:
+            found.append(Partition(len(found), op.device, [], 0.0))
+        found[-1].ops.append(op)
+        found[-1] = found[-1]._replace(avg_ms=found[-1].avg_ms + (op.avg_ms or 0.0))
+    return found
+
+
+def fallback(profile):
+    """Returns the operators running on the CPU although a delegate is used"""
+    if profile.backend == "CPU":
+        return []
+    return [op for op in profile.ops if op.device == "CPU"]
+
+
+def profile_benchmark_model(config, model, binary):
+    """Returns the Op of each node, timed by benchmark_model"""
+    command, env = benchmark_engine.BenchmarkModelRunner(binary).command(config, model)
+    command.append("--enable_op_profiling=true")
+    result = subprocess.run(
+        command, env=env, capture_output=True, text=True, check=False
+    )
+    if result.returncode != 0:
+        return []
+    return parse_op_profile(result.stdout + result.stderr, config.backend)
+
+
+def profile_interpreter(config, model):
+    """Returns the Op of each node of the tflite_runtime execution plan"""
+    runner = benchmark_engine.InterpreterRunner()
+    try:
+        interpreter = benchmark_engine.tflite.Interpreter(
+            model_path=model,
+            num_threads=config.threads,
+            experimental_delegates=runner.delegates(config, model),
+        )
+        interpreter.allocate_tensors()
+    except (ValueError, RuntimeError, OSError):
+        return []
+    ops = []
+    # pylint: disable=protected-access
+    for detail in interpreter._get_ops_details():
+        # Delegated partitions appear as a single DELEGATE node
+        op_type = detail["op_name"]
+        ops.append(
+            Op(
+                len(ops),
+                op_type,
+                str(detail["index"]),
+                device_of(op_type, config.backend),
+            )
+        )
+    return ops
+
+
+def profile(config, binary=None):
+    """Returns the OpProfile of config
+
+    Arguments:
+    config -- benchmark_engine.Config to profile
+    binary -- benchmark_model to run, found in /usr/bin by default
+    """
+    engine = benchmark_engine.BenchmarkEngine(
+        benchmark_engine.InterpreterRunner(), history=None
+    )
+    model = engine.prepare(config)
+    if model is None:
+        return OpProfile(config.model, config.backend, config.threads, [])
+    binary = binary or benchmark_engine.find_benchmark_model()
+    if binary is not None:
+        ops = profile_benchmark_model(config, model, binary)
+    else:
+        ops = profile_interpreter(config, model)
+    return OpProfile(config.model, config.backend, config.threads, ops)
+
+
+def export_csv(report, path):
+    """Writes the operators of report to a CSV file"""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(Op._fields + ("partition",))
+        for partition in partitions(report.ops):
+            for op in partition.ops:
+                writer.writerow(op + (partition.index,))
+
+
+def export_json(report, path):
+    """Writes report with its aggregates to a JSON file"""
+    data = {
+        "model": report.model,
+        "backend": report.backend,
+        "threads": report.threads,
+        "total_ms": report.total_ms if report.profiled else None,
+        "ops": [op._asdict() for op in report.ops],
+        "by_type": [
+            dict(zip(("op_type", "device", "count", "avg_ms"), row))
+            for row in by_type(report.ops)
+        ],
+        "partitions": [
+            {
+                "index": partition.index,
+                "device": partition.device,
+                "ops": [op.index for op in partition.ops],
+                "avg_ms": partition.avg_ms,
+            }
+            for partition in partitions(report.ops)
+        ],
+        "fallback": [op.index for op in fallback(report)],
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=1)
+
+
+def share(avg_ms, total_ms):
+    """Returns avg_ms as a percentage of total_ms"""
+    return 100 * avg_ms / total_ms if total_ms else 0.0
+
+
+def summary(report):
+    """Returns a short text about the partitions and CPU fallback of report"""
+    if not report.ops:
+        return "Operator profiling failed!"
+    cpu_ops = fallback(report)
+    delegated = [p for p in partitions(report.ops) if p.device != "CPU"]
+    text = (
+        f"{report.backend}: {len(delegated)} delegated partition(s), "
+        f"{len(cpu_ops)} operator(s) falling back to CPU"
+    )
+    if not cpu_ops:
+        return text + "\n"
+    cpu_ms = sum(op.avg_ms or 0.0 for op in cpu_ops)
+    if report.profiled:
+        text += f" ({share(cpu_ms, report.total_ms):.1f}% of the time)"
+    types = sorted({op.op_type for op in cpu_ops})
+    return text + "\n    CPU fallback: " + ", ".join(types) + "\n"
+
+
+def print_report(report):
+    """Prints the operator types, partitions and CPU fallback of report"""
+    total = report.total_ms
+    print(f"{os.path.basename(report.model)} {report.backend} x{report.threads}")
+    if report.profiled:
+        print(f"Total: {total:.3f} ms")
+    print(f"\n{'op type':<32} {'device':<6} {'count':>5} {'avg ms':>9} {'%':>6}")
+    for op_type, device, count, avg_ms in by_type(report.ops):
+        print(
+            f"{op_type:<32} {device:<6} {count:>5} {avg_ms:9.3f} "
+            f"{share(avg_ms, total):6.1f}"
+        )
+    print(f"\n{'partition':<9} {'device':<6} {'ops':>5} {'avg ms':>9} {'%':>6}")
+    for partition in partitions(report.ops):
+        print(
+            f"{partition.index:<9} {partition.device:<6} {len(partition.ops):>5} "
+            f"{partition.avg_ms:9.3f} {share(partition.avg_ms, total):6.1f}"
+        )
+    cpu_ops = fallback(report)
+    if cpu_ops:
+        print("\nCPU fallback:")
+        for op in cpu_ops:
+            print(
+                f"  #{op.index:<4} {op.op_type:<28} {op.avg_ms or 0.0:9.3f} {op.name}"
+            )
+    print()
+    print(summary(report), end="")
+
+
+def main():
+    """Command line interface of the operator profiler"""
+    parser = argparse.ArgumentParser(description="ML benchmark operator profiling")
+    parser.add_argument("model", help="TFLite model")
+    parser.add_argument("--backend", choices=benchmark_engine.BACKENDS, default="NPU")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--csv", help="Export the operators to a CSV file")
+    parser.add_argument("--json", help="Export the report to a JSON file")
+    args = parser.parse_args()
+
+    report = profile(benchmark_engine.Config(args.model, args.backend, args.threads))
+    if not report.ops:
+        parser.exit(1, "Operator profiling failed\n")
+    print_report(report)
+    if args.csv:
+        export_csv(report, args.csv)
+    if args.json:
+        export_json(report, args.json)
+
+
+if __name__ == "__main__":
+    main()
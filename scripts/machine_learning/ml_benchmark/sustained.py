@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: Apache-2.0
+
+Sustained benchmark of ML Benchmark.
+
+A short benchmark measures a board that is still cool. Fanless boards
+throttle after minutes of continuous inference, so this benchmark runs a
+model without pause for several minutes and, every few seconds, samples the
+inference rate along with the thermal zones, the CPU frequencies, the
+active cooling devices and the NPU clock.
+
+The report gives the burst rate (first interval) and the sustained rate
+(median of the last quarter of the run), and the time throttling started:
+when a cooling device is activated, the CPU frequency is limited under its
+maximum, the NPU clock drops, or the inference rate falls well under the
+burst rate.
+
+All sysfs files are read relative to a root folder, so a fake tree can be
+used to try the report on any machine.
+
+Usage:
+    python3 sustained.py MODEL [--backend NPU] [--threads 1] [--duration 300]
+                               [--interval 5] [--sysfs-root /] [--csv FILE]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import statistics
+import time
+from typing import NamedTuple
+import benchmark_engine
+
+THERMAL_ZONES = "sys/class/thermal/thermal_zone*"
+COOLING_DEVICES = "sys/class/thermal/cooling_device*"
+CPU_POLICIES = "sys/devices/system/cpu/cpufreq/policy*"
+NPU_CLOCKS = ("ml_core", "ml", "npu")
+"""Clocks of the NPU in debugfs, by SoC"""
+
+RATE_DROP = 0.1
+"""Drop of the inference rate under the burst rate counted as throttling"""
+
+
+class SysfsReader:
+    """Reads the thermal and clock state of the board
+
+    Arguments:
+    root -- folder containing sys/, "/" on the board
+    """
+
+    def __init__(self, root="/"):
+        self.root = root
+
+    def read(self, path):
+        """Returns the stripped content of path, None if it cannot be read"""
+        try:
+            with open(os.path.join(self.root, path), encoding="utf-8") as file:
+                return file.read().strip()
+        except OSError:
+            return None
+
+    def read_int(self, path):
+        """Returns the integer content of path, None if it cannot be read"""
+        value = self.read(path)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def folders(self, pattern):
+        """Returns the folders matching pattern, relative to root"""
+        return sorted(
+            os.path.relpath(path, self.root)
+            for path in glob.glob(os.path.join(self.root, pattern))
+        )
+
+    def temperatures(self):
+        """Returns the temperature of each thermal zone in degrees Celsius"""
+        temperatures = {}
+        for zone in self.folders(THERMAL_ZONES):
+            temp = self.read_int(os.path.join(zone, "temp"))
+            if temp is not None:
+                name = self.read(os.path.join(zone, "type")) or os.path.basename(zone)
+                temperatures[name] = temp / 1000
+        return temperatures
+
+    def cooling(self):
+        """Returns the state of each active cooling device"""
+        states = {}
+        for device in self.folders(COOLING_DEVICES):
+            state = self.read_int(os.path.join(device, "cur_state"))
+            if state:
+                name = self.read(os.path.join(device, "type")) or device
+                states[f"{name}.{os.path.basename(device)}"] = state
+        return states
+
+    def cpu_frequencies(self):
+        """Returns (current, limit, maximum) MHz of each cpufreq policy
+
+        The limit is lowered under the maximum when the CPU is throttled.
+        """
+        frequencies = {}
+        for policy in self.folders(CPU_POLICIES):
+            current = self.read_int(os.path.join(policy, "scaling_cur_freq"))
+            if current is None:
+                continue
+            maximum = self.read_int(os.path.join(policy, "cpuinfo_max_freq"))
+            limit = self.read_int(os.path.join(policy, "scaling_max_freq"))
+            maximum = maximum or current
+            frequencies[os.path.basename(policy)] = (
+                current / 1000,
+                (limit or maximum) / 1000,
+                maximum / 1000,
+            )
+        return frequencies
+
+    def npu_clock(self):
+        """Returns the NPU clock in MHz, None if it is not exposed"""
+        for name in NPU_CLOCKS:
+            rate = self.read_int(f"sys/kernel/debug/clk/{name}/clk_rate")
+            if rate is not None:
+                return rate / 1000000
+        return None
+
+
+class Sample(NamedTuple):
+    """State of the board over one interval
+
+    time -- seconds since the start of the run, at the end of the interval
+    ips -- inferences per second over the interval
+    p50_ms -- median inference latency over the interval
+    temperatures -- degrees Celsius of each thermal zone
+    cpu_frequencies -- (current, limit, maximum) MHz of each cpufreq policy
+    cooling -- state of each active cooling device
+    npu_mhz -- NPU clock, None if not exposed
+    """
+
+    time: float
+    ips: float
+    p50_ms: float
+    temperatures: dict
+    cpu_frequencies: dict
+    cooling: dict
+    npu_mhz: float
+
+
+def sample_board(reader, elapsed, latencies, seconds):
+    """Returns the Sample of an interval of seconds with latencies in ms"""
+    return Sample(
+        elapsed,
+        len(latencies) / seconds if seconds else 0.0,
+        statistics.median(latencies) if latencies else 0.0,
+        reader.temperatures(),
+        reader.cpu_frequencies(),
+        reader.cooling(),
+        reader.npu_clock(),
+    )
+
+
+def throttling_reason(sample, burst):
+    """Returns why sample looks throttled compared to burst, or None
+
+    Limits and cooling already in place during the burst (e.g. a frequency
+    cap set by the user) are part of the baseline, not throttling.
+    """
+    cooling = sorted(
+        name
+        for name, state in sample.cooling.items()
+        if state > burst.cooling.get(name, 0)
+    )
+    if cooling:
+        return "cooling " + ", ".join(cooling)
+    for policy, (_, limit, maximum) in sorted(sample.cpu_frequencies.items()):
+        burst_limit = burst.cpu_frequencies.get(policy, (0, maximum, maximum))[1]
+        if limit < burst_limit:
+            return f"{policy} limited to {limit:.0f}/{burst_limit:.0f} MHz"
+    if burst.npu_mhz and sample.npu_mhz and sample.npu_mhz < burst.npu_mhz:
+        return f"NPU at {sample.npu_mhz:.0f}/{burst.npu_mhz:.0f} MHz"
+    if sample.ips < burst.ips * (1 - RATE_DROP):
+        return f"rate at {sample.ips:.1f}/{burst.ips:.1f} IPS"
+    return None
+
+
+class Report(NamedTuple):
+    """Burst and sustained rates of a run
+
+    onset -- seconds before throttling started, None if it never did
+    reason -- first sign of throttling
+    """
+
+    burst_ips: float
+    sustained_ips: float
+    onset: float
+    reason: str
+    max_temperature: float
+
+
+def report(samples):
+    """Returns the Report of the samples of a run"""
+    if not samples:
+        return Report(0.0, 0.0, None, None, None)
+    burst = samples[0]
+    tail = samples[-max(1, len(samples) // 4) :]
+    onset = reason = None
+    for sample in samples[1:]:
+        reason = throttling_reason(sample, burst)
+        if reason is not None:
+            onset = sample.time
+            break
+    temperatures = [t for sample in samples for t in sample.temperatures.values()]
+    return Report(
+        burst.ips,
+        statistics.median(sample.ips for sample in tail),
+        onset,
+        reason,
+        max(temperatures) if temperatures else None,
+    )
+
+
+class SustainedBenchmark:
+    """Runs a configuration continuously and samples the board
+
+    Arguments:
+    config -- benchmark_engine.Config to run
+    duration -- seconds to run
+    interval -- seconds between samples
+    reader -- SysfsReader of the board
+    """
+
+    def __init__(self, config, duration=300.0, interval=5.0, reader=None):
+        self.config = config
+        self.duration = duration
+        self.interval = interval
+        self.reader = reader or SysfsReader()
+
+    def run(self, progress=None):
+        """Returns the Sample of each interval, None if the model failed
+
+        Arguments:
+        progress -- called with each Sample
+        """
+        engine = benchmark_engine.BenchmarkEngine(
+            benchmark_engine.InterpreterRunner(), history=None
+        )
+        model = engine.prepare(self.config)
+        if model is None:
+            return None
+        try:
+            interpreter = benchmark_engine.tflite.Interpreter(
+                model_path=model,
+                num_threads=self.config.threads,
+                experimental_delegates=engine.runner.delegates(self.config, model),
+            )
+            interpreter.allocate_tensors()
+        except (ValueError, RuntimeError, OSError):
+            return None
+        inputs = benchmark_engine.random_inputs(interpreter)
+        for tensor, data in inputs:
+            interpreter.set_tensor(tensor, data)
+        # The first invoke compiles the graph of delegates
+        interpreter.invoke()
+
+        samples = []
+        latencies = []
+        start = window = time.monotonic()
+        while True:
+            begin = time.monotonic()
+            for tensor, data in inputs:
+                interpreter.set_tensor(tensor, data)
+            interpreter.invoke()
+            end = time.monotonic()
+            latencies.append((end - begin) * 1000)
+            if end - window < self.interval and end - start < self.duration:
+                continue
+            sample = sample_board(self.reader, end - start, latencies, end - window)
+            samples.append(sample)
+            if progress is not None:
+                progress(sample)
+            if end - start >= self.duration:
+                return samples
+            latencies = []
+            window = end
+
+
+def export_csv(samples, path):
+    """Writes samples to a CSV file, one column per sensor"""
+    zones = sorted({name for sample in samples for name in sample.temperatures})
+    policies = sorted({name for sample in samples for name in sample.cpu_frequencies})
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ["time", "ips", "p50_ms", "npu_mhz", "cooling"]
+            + [f"{zone}_c" for zone in zones]
+            + [f"{policy}_mhz" for policy in policies]
+        )
+        for sample in samples:
+            writer.writerow(
+                [sample.time, sample.ips, sample.p50_ms, sample.npu_mhz]
+                + [" ".join(sorted(sample.cooling))]
+                + [sample.temperatures.get(zone) for zone in zones]
+                + [
+                    sample.cpu_frequencies.get(policy, (None,))[0]
+                    for policy in policies
+                ]
+            )
+
+
+def print_sample(sample, burst):
+    """Prints a status line of sample and why it looks throttled after burst"""
+    temperature = max(sample.temperatures.values(), default=None)
+    reason = throttling_reason(sample, burst)
+    frequencies = " ".join(
+        f"{current:.0f}" for current, _, _ in sample.cpu_frequencies.values()
+    )
+    print(
+        f"{sample.time:7.1f}s {sample.ips:8.1f} IPS {sample.p50_ms:8.2f} ms  "
+        + ("" if temperature is None else f"{temperature:5.1f}C  ")
+        + (f"CPU {frequencies} MHz  " if frequencies else "")
+        + ("" if sample.npu_mhz is None else f"NPU {sample.npu_mhz:.0f} MHz  ")
+        + ("" if reason is None else f"throttled: {reason}"),
+        flush=True,
+    )
+
+
+def main():
+    """Command line interface of the sustained benchmark"""
+    parser = argparse.ArgumentParser(description="ML sustained benchmark")
+    parser.add_argument("model", help="TFLite model")
+    parser.add_argument("--backend", choices=benchmark_engine.BACKENDS, default="NPU")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=300, help="Seconds to run")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds per sample")
+    parser.add_argument("--sysfs-root", default="/", help="Folder containing sys/")
+    parser.add_argument("--csv", help="Export the samples to a CSV file")
+    args = parser.parse_args()
+
+    benchmark = SustainedBenchmark(
+        benchmark_engine.Config(args.model, args.backend, args.threads),
+        args.duration,
+        args.interval,
+        SysfsReader(args.sysfs_root),
+    )
+    printed = []
+
+    def progress(sample):
+        printed.append(sample)
+        print_sample(sample, printed[0])
+
+    samples = benchmark.run(progress)
+    if samples is None:
+        parser.exit(1, "Benchmark failed\n")
+    if args.csv:
+        export_csv(samples, args.csv)
+
+    summary = report(samples)
+    print(f"\nBurst:     {summary.burst_ips:.1f} IPS")
+    print(f"Sustained: {summary.sustained_ips:.1f} IPS")
+    if summary.max_temperature is not None:
+        print(f"Max temperature: {summary.max_temperature:.1f}C")
+    if summary.onset is None:
+        print("No throttling detected")
+    else:
+        print(f"Throttling after {summary.onset:.1f} s: {summary.reason}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: Apache-2.0
+
+Adaptive query mode for ML Gateway clients.
+
+Instead of sending every camera frame to the server, a frame is only sent
+when it differs enough from the last frame sent, or when the last result is
+older than a deadline. The send rate is also capped by the measured
+round-trip time, so only one query is in flight. Between results the
+compositor keeps showing the last bounding boxes, while the camera branch
+keeps rendering at the camera frame rate.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_CHANGE_THRESHOLD = 0.03
+"""Mean absolute inter-frame change (0-1) that triggers a new query"""
+
+DEFAULT_DEADLINE = 0.5
+"""Maximum age (in seconds) of the last result before a new query is sent"""
+
+SIGNATURE_STEP = 10
+"""Subsampling step used to compute the frame signature"""
+
+
+def frame_signature(frame):
+    """Returns a small grayscale thumbnail used to measure frame changes"""
+    thumbnail = frame[::SIGNATURE_STEP, ::SIGNATURE_STEP]
+    return thumbnail.mean(axis=-1, dtype=np.float32) / 255.0
+
+
+class FrameGate:
+    """Decides which frames are sent to the server
+
+    Arguments:
+    stats -- transport.TransportStats of the tensor_query_client
+    threshold -- inter-frame change that triggers a query
+    deadline -- maximum age of the last result, in seconds
+    rtt_factor -- minimum interval between queries, in units of the RTT
+    max_in_flight -- queries allowed to wait for a result at the same time
+    """
+
+    def __init__(
+        self,
+        stats,
+        threshold=DEFAULT_CHANGE_THRESHOLD,
+        deadline=DEFAULT_DEADLINE,
+        rtt_factor=1.0,
+        max_in_flight=1,
+    ):
+        self.stats = stats
+        self.threshold = threshold
+        self.deadline = deadline
+        self.rtt_factor = rtt_factor
+        self.max_in_flight = max_in_flight
+        self.lock = threading.Lock()
+        self.reference = None
+        self.last_sent = 0.0
+        self.sent = 0
+        self.skipped = 0
+
+    def min_interval(self):
+        """Returns the minimum time between two queries"""
+        rtt = self.stats.rtt_ms()
+        if rtt is None:
+            return 0.0
+        return self.rtt_factor * rtt / 1000
+
+    def should_send(self, frame, now=None):
+        """Returns True if frame has to be sent to the server"""
+        if now is None:
+            now = time.monotonic()
+        signature = frame_signature(frame)
+
+        with self.lock:
+            # Queries lost on the way never return, do not wait for them
+            self.stats.expire(2 * max(self.deadline, self.min_interval()))
+
+            send = False
+            if self.stats.in_flight() < self.max_in_flight:
+                last_result = self.stats.last_result
+                stale = last_result is None or now - last_result > self.deadline
+                changed = (
+                    self.reference is None
+                    or float(np.abs(signature - self.reference).mean())
+                    > self.threshold
+                )
+                paced = now - self.last_sent >= self.min_interval()
+                send = stale or (changed and paced)
+
+            if send:
+                self.reference = signature
+                self.last_sent = now
+                self.sent += 1
+            else:
+                self.skipped += 1
+        return send
+
+    def summary(self):
+        """Returns a readout of the sent and skipped frames"""
+        with self.lock:
+            total = self.sent + self.skipped
+            ratio = 100 * self.sent / total if total else 0.0
+        return f"Sent: {ratio:5.1f}% of frames"
+
+
+def add_gate_probe(element, gate, width, height):
+    """Drops the RGB frames reaching element that the gate does not send"""
+    # pylint: disable=import-outside-toplevel
+    import gi
+
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst
+
+    def gate_probe(pad, info):
+        buffer = info.get_buffer()
+        ret, map_info = buffer.map(Gst.MapFlags.READ)
+        if not ret:
+            return Gst.PadProbeReturn.OK
+        try:
+            frame = np.ndarray(
+                (height, width, 3), dtype=np.uint8, buffer=map_info.data
+            )
+            send = gate.should_send(frame)
+        finally:
+            buffer.unmap(map_info)
+        if send:
+            return Gst.PadProbeReturn.OK
+        return Gst.PadProbeReturn.DROP
+
+    element.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, gate_probe)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: Apache-2.0
+
+Discovery and load balancing of ML Gateway servers.
+
+Clients send one SSDP M-SEARCH and collect every server that answers within
+the MX window. Each server also answers a small UDP status request with its
+current load, inference latency and number of clients served, which
+clients use together with the measured round-trip time to rank the servers.
+Connected clients send a heartbeat to the status port every second, so
+servers count the clients they serve. Clients with the same view of
+the network spread across equivalent servers, and move to the next server in
+the ranking when the current one stalls.
+
+Run this file directly to start local stand-in servers and rank them:
+
+    python3 discovery.py --stand-in 3
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from typing import NamedTuple
+
+SSDP_ADDRESS = "239.255.255.250"
+SSDP_PORT = 1900
+SSDP_MX = 2
+SSDP_ST = "imx-ml-server"
+
+STATUS_PORT = 3100
+"""UDP port where servers answer status requests"""
+
+STATUS_REQUEST = b"IMX-ML-STATUS"
+CLIENT_HEARTBEAT = b"IMX-ML-CLIENT"
+
+CLIENT_TIMEOUT = 5.0
+"""Seconds a client is counted as served after its last heartbeat"""
+
+LOAD_WEIGHT = 50.0
+"""ms added to the score of a server per unit of load (1.0 = all CPUs busy)"""
+
+CLIENT_WEIGHT = 20.0
+"""ms added to the score of a server per client it already serves"""
+
+SPREAD = 5.0
+"""Maximum ms of per-client jitter used to spread clients across servers"""
+
+
+class ServerInfo(NamedTuple):
+    """Status of one ML Gateway server"""
+
+    ip: str
+    rtt_ms: float = None
+    load: float = None
+    latency_ms: float = None
+    running: bool = False
+    clients: int = None
+
+
+def m_search_request(mx=SSDP_MX, st=SSDP_ST):
+    """Returns the SSDP M-SEARCH request used to look for servers"""
+    return (
+        "M-SEARCH * HTTP/1.1\r\n"
+        + f"HOST: {SSDP_ADDRESS}:{SSDP_PORT}\r\n"
+        + 'MAN: "ssdp:discover"\r\n'
+        + f"MX: {mx}\r\n"
+        + f"ST: {st}\r\n"
+        + "\r\n"
+    )
+
+
+def discover(mx=SSDP_MX, targets=None):
+    """Returns the IP addresses of all servers answering within the MX window
+
+    Arguments:
+    mx -- maximum wait time (in seconds) announced to the servers
+    targets -- (address, port) list to send the M-SEARCH to, defaults to
+               the SSDP multicast group
+    """
+    if targets is None:
+        targets = [(SSDP_ADDRESS, SSDP_PORT)]
+    request = m_search_request(mx).encode("utf-8")
+
+    addresses = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for target in targets:
+            sock.sendto(request, target)
+        # Servers wait a random time up to MX before answering
+        deadline = time.monotonic() + mx + 0.5
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                response, (address, _) = sock.recvfrom(1024)
+            except socket.timeout:
+                break
+            if SSDP_ST.encode("utf-8") in response and address not in addresses:
+                addresses.append(address)
+    return addresses
+
+
+def probe(ip, port=STATUS_PORT, timeout=0.5):
+    """Returns the ServerInfo of ip, measuring the status round-trip time"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        start = time.monotonic()
+        try:
+            sock.sendto(STATUS_REQUEST, (ip, port))
+            response, _ = sock.recvfrom(1024)
+        except OSError:
+            # Server without status responder (or too slow): rank it last
+            return ServerInfo(ip)
+        rtt_ms = (time.monotonic() - start) * 1000
+    try:
+        status = json.loads(response.decode("utf-8"))
+    except ValueError:
+        return ServerInfo(ip, rtt_ms)
+    return ServerInfo(
+        ip,
+        rtt_ms,
+        status.get("load"),
+        status.get("latency_ms"),
+        status.get("running", False),
+        status.get("clients"),
+    )
+
+
+def probe_all(addresses, port=STATUS_PORT, timeout=0.5):
+    """Probes all servers in parallel"""
+    results = {}
+
+    def run(address):
+        results[address] = probe(address, port, timeout)
+
+    threads = [threading.Thread(target=run, args=(ip,)) for ip in addresses]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [results[ip] for ip in addresses]
+
+
+def score(server, client_id=""):
+    """Returns the expected cost (lower is better) of using server"""
+    if server.rtt_ms is None:
+        return float("inf")
+    cost = server.rtt_ms
+    cost += LOAD_WEIGHT * (server.load or 0.0)
+    cost += server.latency_ms or 0.0
+    cost += CLIENT_WEIGHT * (server.clients or 0)
+    # Deterministic per client jitter so clients split between equal servers
+    digest = hashlib.sha1((client_id + server.ip).encode("utf-8")).digest()
+    return cost + SPREAD * digest[0] / 255
+
+
+def rank(servers, client_id=""):
+    """Returns servers sorted from best to worst for client_id"""
+    return sorted(servers, key=lambda server: score(server, client_id))
+
+
+class ServerPool:
+    """Ranked servers with failover to the next one"""
+
+    def __init__(self, servers):
+        self.servers = list(servers)
+        self.index = 0
+
+    def __len__(self):
+        return len(self.servers)
+
+    def current(self):
+        """Returns the server in use, or None"""
+        if self.index < len(self.servers):
+            return self.servers[self.index]
+        return None
+
+    def failover(self):
+        """Moves to the next server, returns it or None if none is left"""
+        self.index += 1
+        return self.current()
+
+
+class ClientTracker:
+    """Counts the clients that sent a heartbeat recently
+
+    Arguments:
+    timeout -- seconds a client is counted after its last heartbeat
+    """
+
+    def __init__(self, timeout=CLIENT_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.last_seen = {}
+
+    def seen(self, client):
+        """Records a heartbeat of client"""
+        with self.lock:
+            self.last_seen[client] = time.monotonic()
+
+    def count(self):
+        """Returns the number of clients served"""
+        limit = time.monotonic() - self.timeout
+        with self.lock:
+            for client, last in list(self.last_seen.items()):
+                if last < limit:
+                    del self.last_seen[client]
+            return len(self.last_seen)
+
+
+def heartbeat(ip, port=STATUS_PORT):
+    """Tells server ip that this client is connected to it"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.sendto(CLIENT_HEARTBEAT, (ip, port))
+        except OSError:
+            pass
+
+
+def server_status(load_fn=None, latency_fn=None, running_fn=None, clients_fn=None):
+    """Returns the status answered by a server"""
+    load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    if load_fn is not None:
+        load = load_fn()
+    return {
+        "load": round(load, 3),
+        "latency_ms": latency_fn() if latency_fn is not None else None,
+        "running": running_fn() if running_fn is not None else True,
+        "clients": clients_fn() if clients_fn is not None else None,
+    }
+
+
+def serve_status(status_fn, host="", port=STATUS_PORT, stop_event=None, clients=None):
+    """Answers status requests with the dict returned by status_fn
+
+    Heartbeats of the clients are recorded in the ClientTracker clients.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.settimeout(0.5)
+        while stop_event is None or not stop_event.is_set():
+            try:
+                request, address = sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            if request == STATUS_REQUEST:
+                sock.sendto(json.dumps(status_fn()).encode("utf-8"), address)
+            elif request == CLIENT_HEARTBEAT and clients is not None:
+                clients.seen(address[0])
+
+
+class StandInServer:
+    """Local stand-in for an ML Gateway server
+
+    Answers M-SEARCH and status requests on a loopback address, with a fixed
+    load and latency. Setting stalled makes it stop answering, as a server
+    that hangs would.
+    """
+
+    def __init__(self, ip, ssdp_port, load=0.0, latency_ms=10.0):
+        self.ip = ip
+        self.clients = ClientTracker()
+        self.ssdp_port = ssdp_port
+        self.load = load
+        self.latency_ms = latency_ms
+        self.stalled = False
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def status(self):
+        """Status answered while not stalled"""
+        if self.stalled:
+            time.sleep(1)
+        return {
+            "load": self.load,
+            "latency_ms": self.latency_ms,
+            "running": True,
+            "clients": self.clients.count(),
+        }
+
+    def serve_ssdp(self):
+        """Answers M-SEARCH requests like ssdpy.SSDPServer"""
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind((self.ip, self.ssdp_port))
+            sock.settimeout(0.5)
+            while not self.stop_event.is_set():
+                try:
+                    request, address = sock.recvfrom(1024)
+                except socket.timeout:
+                    continue
+                if b"M-SEARCH" in request and not self.stalled:
+                    response = (
+                        "HTTP/1.1 200 OK\r\n"
+                        + f"ST: {SSDP_ST}\r\n"
+                        + "USN: imx-server\r\n\r\n"
+                    )
+                    sock.sendto(response.encode("utf-8"), address)
+
+    def start(self):
+        """Starts answering requests in background threads"""
+        self.threads = [
+            threading.Thread(target=self.serve_ssdp, daemon=True),
+            threading.Thread(
+                target=serve_status,
+                args=(
+                    self.status,
+                    self.ip,
+                    STATUS_PORT,
+                    self.stop_event,
+                    self.clients,
+                ),
+                daemon=True,
+            ),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stops the server"""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def start_stand_ins(count, ssdp_port=19000):
+    """Starts count stand-in servers on 127.0.0.2, 127.0.0.3, ...
+
+    All servers are idle except the last one, which is busy.
+    """
+    servers = []
+    for index in range(count):
+        busy = count > 1 and index == count - 1
+        server = StandInServer(
+            f"127.0.0.{index + 2}",
+            ssdp_port,
+            load=0.8 if busy else 0.0,
+            latency_ms=40.0 if busy else 10.0,
+        )
+        server.start()
+        servers.append(server)
+    return servers
+
+
+def main():
+    """Ranks local stand-in servers, then fails over from a stalled one"""
+    parser = argparse.ArgumentParser(description="ML Gateway server discovery")
+    parser.add_argument(
+        "--stand-in", type=int, default=3, help="Number of stand-in servers"
+    )
+    parser.add_argument(
+        "--clients", type=int, default=4, help="Number of simulated clients"
+    )
+    args = parser.parse_args()
+
+    ssdp_port = 19000
+    stand_ins = start_stand_ins(args.stand_in, ssdp_port)
+    targets = [(server.ip, ssdp_port) for server in stand_ins]
+    time.sleep(0.2)
+
+    addresses = discover(mx=1, targets=targets)
+    servers = probe_all(addresses)
+    for server in servers:
+        print(
+            f"{server.ip}: rtt {server.rtt_ms:.2f} ms, load {server.load}, "
+            f"latency {server.latency_ms} ms"
+        )
+    for client in range(args.clients):
+        ranking = rank(servers, f"10.0.0.{client + 10}")
+        print(f"client {client}: " + " > ".join(server.ip for server in ranking))
+
+    # The server in use stalls: the client moves to the next one
+    pool = ServerPool(rank(servers, "10.0.0.10"))
+    stalled = next(s for s in stand_ins if s.ip == pool.current().ip)
+    stalled.stalled = True
+    if probe(pool.current().ip).rtt_ms is None:
+        print(f"{pool.current().ip} stalled, failing over to {pool.failover().ip}")
+
+    for server in stand_ins:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
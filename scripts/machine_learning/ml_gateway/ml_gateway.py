@@ -9,6 +9,7 @@ on an ML Gateway system (server) that has very high-performance ML capabilities.
 """
 
 from threading import Thread
+import argparse
 import logging
 import os
 import socket
@@ -18,15 +19,29 @@ import subprocess
 import glob
 import gi
 import numpy as np
-import tflite_runtime.interpreter as tflite
+import transport
+import adaptive
+import discovery
 
 sys.path.append("/home/root/.nxp-demo-experience/scripts/")
 import utils
+import graph_cache
+import vela_cache
+import inference_backend
+import launch_profiler
+import media_source
+import span_profiler
 
 gi.require_version("Gtk", "3.0")
 gi.require_version("Gst", "1.0")
 from gi.repository import Gtk, Gst, GLib
 
+STALL_TIMEOUT = 3.0
+"""Seconds without results before the client moves to the next server"""
+
+FIRST_RESULT_TIMEOUT = 180.0
+"""Seconds the first result may take, the NPU warm-up of the server"""
+
 
 def threaded(fn):
     """
@@ -55,7 +70,7 @@ def get_my_ip():
 class ServerWindow:
     """Server Window"""
 
-    def __init__(self):
+    def __init__(self, transport_mode="raw"):
         # Detect platform inside class
         self.platform = subprocess.check_output(
             ["cat", "/sys/devices/soc0/soc_id"]
@@ -91,6 +106,7 @@ class ServerWindow:
         self.pipeline = None
         self.timeout_id = None
         self.pulsing = False
+        self.transport_mode = transport_mode
 
         # Model variables
         self.model = None
@@ -125,6 +141,16 @@ class ServerWindow:
         cast_thread = Thread(target=self.cast_ip, daemon=True)
         cast_thread.start()
 
+        # Answer load/latency probes from clients choosing a server
+        self.clients = discovery.ClientTracker()
+        status_thread = Thread(
+            target=discovery.serve_status,
+            args=(self.server_status,),
+            kwargs={"clients": self.clients},
+            daemon=True,
+        )
+        status_thread.start()
+
     def quit_app(self, widget):
         """Closes GStreamer pipeline and GTK+3 GUI"""
         if self.pipeline:
@@ -176,16 +202,23 @@ class ServerWindow:
 
         # Compile model using vela tool for i.MX93
         if self.platform == "i.MX93":
-            self.compile_vela()
+            if not self.compile_vela():
+                # Keep the vela summary, only the CPU model can be served
+                GLib.idle_add(self.backend_select.set_active, 1)
+                self.pulsing = False
+                self.run_server.set_sensitive(True)
+                self.backend_select.set_sensitive(True)
+                return
         else:
-            os.environ["VIV_VX_CACHE_BINARY_GRAPH_DIR"] = "/home/root/.cache/gopoint"
-            os.environ["VIV_VX_ENABLE_CACHE_GRAPH_BINARY"] = "1"
-
-            if not any(
-                f.endswith(".nb") for f in os.listdir("/home/root/.cache/gopoint")
-            ):
-                GLib.idle_add(self.status_bar.set_text, "Warmup time...")
-                self.to_reduce_warmup()
+            # Graphs are cached per model, others do not skip this warmup
+            cache = graph_cache.GraphCache()
+            cache.evict()
+            cache.warm(
+                self.model,
+                lambda model: self.to_reduce_warmup(),
+                lambda: GLib.idle_add(self.status_bar.set_text, "Warmup time..."),
+            )
+            cache.apply([self.model])
 
         backend = self.backend_select.get_active_text()
         if self.platform == "i.MX8MP":
@@ -206,6 +239,8 @@ class ServerWindow:
         self.run_server.set_sensitive(True)
         self.backend_select.set_sensitive(True)
         self.pulsing = False
+        if launch_profiler.autostart():
+            GLib.idle_add(self.start_server, self.run_server)
 
     def cast_ip(self):
         """Handle incoming m-search request and send a response"""
@@ -226,16 +261,25 @@ class ServerWindow:
 
         SSDPServer("imx-server", device_type="imx-ml-server").serve_forever()
 
+    def server_status(self):
+        """Returns the load and inference latency reported to clients"""
+        latency_ms = None
+        if self.pipeline is not None:
+            latency = self.pipeline.get_by_name("server_filter").get_property("latency")
+            if latency > 0:
+                latency_ms = latency / 1000
+        return discovery.server_status(
+            latency_fn=lambda: latency_ms,
+            running_fn=lambda: self.pipeline is not None,
+            clients_fn=self.clients.count,
+        )
+
     def to_reduce_warmup(self):
         """To reduce NPU warmup time on i.MX8M Plus"""
         # Load the TFLite model and allocate tensors.
-        ext_delegate = tflite.load_delegate("/usr/lib/libvx_delegate.so")
-        interpreter = tflite.Interpreter(
-            model_path=self.model,
-            num_threads=4,
-            experimental_delegates=[ext_delegate],
-        )
-        interpreter.allocate_tensors()
+        with launch_profiler.phase("delegate"):
+            interpreter = inference_backend.create("vx").load(self.model, num_threads=4)
+            interpreter.allocate_tensors()
 
         # Get input and output tensors.
         input_details = interpreter.get_input_details()
@@ -245,7 +289,8 @@ class ServerWindow:
         input_shape = input_details[0]["shape"]
         input_data = np.array(np.random.random_sample(input_shape), dtype=np.uint8)
         interpreter.set_tensor(input_details[0]["index"], input_data)
-        interpreter.invoke()
+        with launch_profiler.phase("warmup"):
+            interpreter.invoke()
 
         # The function get_tensor() returns a copy of the tensor data.
         # Use tensor() in order to get a pointer to the tensor.
@@ -262,28 +307,15 @@ class ServerWindow:
         return False
 
     def compile_vela(self):
-        """Compile vela model"""
-        self.vela_model = self.vela_name(self.model)
-        if not os.path.exists(self.vela_model):
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Compiling model with vela and saving to cache...",
-            )
-
-            subprocess.run(
-                "vela " + self.model + " --output-dir=/home/root/.cache/gopoint/",
-                shell=True,
-                check=True,
-            )
-
-    def vela_name(self, model_name):
-        """
-        Appends the vela label to model name
-        """
-        tokens = model_name.split(".tflite")
-        return (
-            "/home/root/.cache/gopoint/" + (tokens[-2] + "_vela.tflite").split("/")[-1]
+        """Compile vela model, returns False if the compilation failed"""
+        GLib.idle_add(
+            self.status_bar.set_text,
+            "Compiling model with vela and saving to cache...",
         )
+        results = vela_cache.compile_models([self.model])
+        self.vela_model = results[0].path
+        GLib.idle_add(self.status_bar.set_text, vela_cache.summary(results))
+        return self.vela_model is not None
 
     def about_button_activate(self, widget):
         """
@@ -304,6 +336,10 @@ class ServerWindow:
                 self.custom = "NumThreads:4"
         if self.platform == "i.MX93":
             if backend == "NPU":
+                if self.vela_model is None:
+                    # Vela compilation failed, the NPU has no model to run
+                    widget.set_active(1)
+                    return
                 self.custom = "Delegate:External,ExtDelegateLib:libethosu_delegate.so"
                 self.model = self.vela_model
             if backend == "CPU":
@@ -317,17 +353,17 @@ class ServerWindow:
         self.backend_select.set_sensitive(False)
         self.close_button.set_sensitive(False)
 
-        server_pipeline = (
-            f"tensor_query_serversrc host={self.ip_address} ! "
-            "video/x-raw,width=300,height=300,format=RGB"
-        )
-        server_pipeline += ",framerate=0/1 ! tensor_converter ! "
-        server_pipeline += "tensor_filter framework=tensorflow-lite "
+        server_pipeline = f"tensor_query_serversrc host={self.ip_address} ! "
+        server_pipeline += transport.server_decoder(self.transport_mode)
+        server_pipeline += "tensor_converter ! "
+        server_pipeline += "tensor_filter name=server_filter latency=1 "
+        server_pipeline += "framework=tensorflow-lite "
         server_pipeline += f"model={self.model} custom={self.custom} "
         server_pipeline += "! tensor_query_serversink"
 
         # creating the pipeline and launching it
         self.pipeline = Gst.parse_launch(server_pipeline)
+        span_profiler.watch(self.pipeline.get_by_name("server_filter"), "invoke")
 
         # message callback
         bus = self.pipeline.get_bus()
@@ -335,6 +371,7 @@ class ServerWindow:
         bus.connect("message", self.on_message)
 
         # by default pipelines are in NULL state, pipeline suppose to be set in running state
+        launch_profiler.begin("playing")
         monitor_status = self.pipeline.set_state(Gst.State.PLAYING)
         if monitor_status == Gst.StateChangeReturn.FAILURE:
             print("ERROR: Unable to set the pipeline to the playing state")
@@ -365,6 +402,12 @@ class ServerWindow:
             logging.warning("[warning] %s : %s", error.message, debug)
         elif message.type == Gst.MessageType.STREAM_START:
             logging.info("received start message")
+        elif message.type == Gst.MessageType.STATE_CHANGED:
+            if message.src == self.pipeline:
+                _, new_state, _ = message.parse_state_changed()
+                if new_state == Gst.State.PLAYING:
+                    launch_profiler.end("playing")
+                    launch_profiler.ready()
         elif message.type == Gst.MessageType.QOS:
             data_format, processed, dropped = message.parse_qos_stats()
             format_str = Gst.Format.get_name(data_format)
@@ -379,7 +422,12 @@ class ServerWindow:
 class ClientWindow:
     """Client Window"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        transport_mode="raw",
+        jpeg_quality=transport.DEFAULT_JPEG_QUALITY,
+        adaptive_options=None,
+    ):
         # Obtain GUI settings and configurations
         glade_file = (
             "/home/root/.nxp-demo-experience/"
@@ -413,6 +461,14 @@ class ClientWindow:
         self.labels = None
         self.timeout_id = None
         self.pulsing = False
+        self.transport_mode = transport_mode
+        self.jpeg_quality = jpeg_quality
+        self.transport_stats = None
+        self.readout_id = None
+        self.adaptive_options = adaptive_options
+        self.frame_gate = None
+        self.server_pool = None
+        self.failover = False
 
         # Populate source devices
         for device in glob.glob("/dev/video*"):
@@ -430,10 +486,6 @@ class ClientWindow:
         window.connect("delete-event", Gtk.main_quit)
         window.show()
 
-        # Get ip address
-        capture_ip_thread = Thread(target=self.access_ip, daemon=True)
-        capture_ip_thread.start()
-
         # Set up client
         preload_thread = Thread(target=self.preload, daemon=True)
         preload_thread.start()
@@ -482,19 +534,14 @@ class ClientWindow:
 
         GLib.idle_add(self.status_bar.set_text, "Looking for server IPs...")
 
-        maximum_search = 4
-        addresses = []
-        attempt = 0
-        while maximum_search != 0 and attempt <= 1:
-            # write a loop to attempt x times
-            client_ssdp_address = self.access_ip()
-            if client_ssdp_address is not False:
-                if client_ssdp_address[0] not in addresses:
-                    addresses.append(client_ssdp_address[0])
-                maximum_search -= 1
-            attempt = attempt + 1
+        addresses = self.access_ip()
+        if addresses:
+            GLib.idle_add(self.status_bar.set_text, "Probing server load...")
+            self.server_pool = discovery.ServerPool(
+                discovery.rank(discovery.probe_all(addresses), get_my_ip())
+            )
         if len(addresses) != 0:
-            self.server_ip = addresses[0]
+            self.server_ip = self.server_pool.current().ip
             self.found_ip_address.set_active(True)
             self.entry_text_box.set_activates_default(False)
             self.entry_text_box.set_sensitive(False)
@@ -508,6 +555,8 @@ class ClientWindow:
 
         self.unblock_buttons(True)
         self.pulsing = False
+        if launch_profiler.autostart() and addresses:
+            GLib.idle_add(self.connect_to_server, self.connect_server)
 
     def unblock_buttons(self, status):
         """Block/unblock buttons"""
@@ -526,47 +575,17 @@ class ClientWindow:
         return False
 
     def access_ip(self):
-        """Returns IP address if found in network.
+        """Returns the IP addresses of all servers found in network.
         SSDP is used to discover devices in local network
         using multicast SSDP address. SSDP uses NOTIFY
         to announce establishment information and M-Search
-        to discover devices in network.
-
-        MX : Maximum wait time(in seconds)
-        ST : Search Target
+        to discover devices in network. Every server answering
+        within the MX window is collected.
         """
-
-        ssdp_address = "239.255.255.250"
-        ssdp_port = 1900
-        ssdp_mx = 2
-        ssdp_st = "imx-ml-server"
-
-        ssdp_request = (
-            "M-SEARCH * HTTP/1.1\r\n"
-            + f"HOST: {ssdp_address}:{ssdp_port}\r\n"
-            + 'MAN: "ssdp:discover"\r\n'
-            + f"MX: {ssdp_mx}\r\n"
-            + f"ST: {ssdp_st}\r\n"
-            + "\r\n"
-        )
-
-        # send an m-search request and collect responses
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(ssdp_request.encode("utf-8"), (ssdp_address, ssdp_port))
-        sock.settimeout(1)
-
-        try:
-            _, ssdp_address = sock.recvfrom(150)
-        except socket.timeout as timeout_error:
-            erro = timeout_error.args[0]
-            # timeout exception is setup
-            if erro == "timed out":
-                print("Receiver timed out, retry later")
-                return False
-        else:
-            # got a response
-            return ssdp_address
-        return False
+        addresses = discovery.discover()
+        if not addresses:
+            print("Receiver timed out, retry later")
+        return addresses
 
     def about_button_activate(self, widget):
         """
@@ -594,46 +613,116 @@ class ClientWindow:
 
         if self.entry_text_box.get_activates_default() is True:
             self.server_ip = self.entry_text_box.get_text()
-        src = self.source_select.get_active_text()
-
-        client_pipeline = (
-            f"v4l2src device={src} ! video/x-raw,width=640,height=480,framerate=30/1 "
-        )
-        client_pipeline += "! tee name=t t. ! "
-        client_pipeline += "queue max-size-buffers=2 leaky=2 ! imxvideoconvert_g2d ! "
-        client_pipeline += "video/x-raw,width=300,height=300,format=RGBA ! "
-        client_pipeline += (
-            "videoconvert ! video/x-raw,format=RGB ! tensor_query_client "
-        )
-        client_pipeline += (
-            f"host={get_my_ip()} dest-host={self.server_ip} ! tensor_decoder"
-        )
-        client_pipeline += f" mode=bounding_boxes option1=tf-ssd option2={self.labels} "
-        client_pipeline += "option3=0:1:2:3,50 option4=640:480 option5=300:300 !"
-        client_pipeline += " mix. t. ! queue max-size-buffers=2 !"
-        client_pipeline += (
-            " imxcompositor_g2d name=mix latency=33333333 min-upstream-latency=33333333"
-        )
-        client_pipeline += " sink_0::zorder=2 sink_1::zorder=1 ! "
-        client_pipeline += "fpsdisplaysink video-sink=waylandsink sync=false"
-
-        # creating the pipeline and launching it
-        self.pipeline = Gst.parse_launch(client_pipeline)
-        monitor_status = self.pipeline.set_state(Gst.State.PLAYING)
+            self.server_pool = discovery.ServerPool(
+                [discovery.ServerInfo(self.server_ip)]
+            )
+        # Reconnect to the next server in the ranking when one stalls
+        while True:
+            self.failover = False
+            src = self.source_select.get_active_text()
 
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.on_message)
-        if monitor_status == Gst.StateChangeReturn.FAILURE:
-            print("ERROR: Unable to set the pipeline to the playing state")
-            sys.exit(1)
+            client_pipeline = media_source.gst_source(
+                src, "video/x-raw,width=640,height=480,framerate=30/1"
+            )
+            client_pipeline += " "
+            client_pipeline += "! tee name=t t. ! "
+            client_pipeline += media_source.queue(2) + " ! imxvideoconvert_g2d ! "
+            client_pipeline += "video/x-raw,width=300,height=300,format=RGBA ! "
+            client_pipeline += "videoconvert ! video/x-raw,format=RGB ! "
+            client_pipeline += "identity name=query_gate ! "
+            client_pipeline += transport.client_encoder(
+                self.transport_mode, self.jpeg_quality
+            )
+            client_pipeline += "tensor_query_client name=query_client "
+            client_pipeline += (
+                f"host={get_my_ip()} dest-host={self.server_ip} ! tensor_decoder"
+            )
+            client_pipeline += (
+                f" mode=bounding_boxes option1=tf-ssd option2={self.labels} "
+            )
+            client_pipeline += "option3=0:1:2:3,50 option4=640:480 option5=300:300 !"
+            client_pipeline += " mix. t. ! queue max-size-buffers=2 !"
+            client_pipeline += " imxcompositor_g2d name=mix latency=33333333 min-upstream-latency=33333333"
+            client_pipeline += " sink_0::zorder=2 sink_1::zorder=1 ! "
+            if span_profiler.enabled():
+                client_pipeline += (
+                    "videoconvert ! cairooverlay name=span_overlay ! videoconvert ! "
+                )
+            client_pipeline += (
+                f"fpsdisplaysink video-sink={media_source.display_element()} sync=false"
+            )
 
-        self.connect_server.set_label("Connected to server")
-        self.main_loop.run()
+            # creating the pipeline and launching it
+            self.pipeline = Gst.parse_launch(client_pipeline)
+            span_overlay = self.pipeline.get_by_name("span_overlay")
+            if span_overlay is not None:
+                span_overlay.connect(
+                    "draw", lambda overlay, context, *_: span_profiler.draw(context)
+                )
+            span_profiler.watch(self.pipeline.get_by_name("query_client"), "query")
+
+            # Measure uplink bandwidth and round-trip time of the queries
+            self.transport_stats = transport.TransportStats()
+            transport.add_query_probes(
+                self.pipeline.get_by_name("query_client"), self.transport_stats
+            )
+            media_source.watch(self.pipeline.get_by_name("query_client"))
+            if self.adaptive_options is not None:
+                # Only query the server when the scene changes or results get old
+                self.frame_gate = adaptive.FrameGate(
+                    self.transport_stats, **self.adaptive_options
+                )
+                adaptive.add_gate_probe(
+                    self.pipeline.get_by_name("query_gate"), self.frame_gate, 300, 300
+                )
+            self.readout_id = GLib.timeout_add(1000, self.update_readout)
+
+            launch_profiler.begin("playing")
+            monitor_status = self.pipeline.set_state(Gst.State.PLAYING)
+
+            bus = self.pipeline.get_bus()
+            bus.add_signal_watch()
+            bus.connect("message", self.on_message)
+            if monitor_status == Gst.StateChangeReturn.FAILURE:
+                print("ERROR: Unable to set the pipeline to the playing state")
+                sys.exit(1)
+
+            self.connect_server.set_label("Connected to server")
+            self.main_loop.run()
+
+            # disconnecting the pipeline
+            GLib.source_remove(self.readout_id)
+            self.pipeline.set_state(Gst.State.NULL)
+            bus.remove_signal_watch()
+
+            if not self.failover:
+                break
+            server = self.server_pool.failover()
+            if server is None:
+                GLib.idle_add(self.status_bar.set_text, "No server left to connect!")
+                self.unblock_buttons(True)
+                self.connect_server.set_label("Retry connecting to server!")
+                break
+            self.server_ip = server.ip
+            GLib.idle_add(
+                self.status_bar.set_text, f"Server stalled, switching to {server.ip}"
+            )
 
-        # disconnecting the pipeline
-        self.pipeline.set_state(Gst.State.NULL)
-        bus.remove_signal_watch()
+    def update_readout(self):
+        """Shows the bandwidth/latency readout of the transport"""
+        stalled = self.transport_stats.stalled(STALL_TIMEOUT, FIRST_RESULT_TIMEOUT)
+        if stalled and self.server_pool is not None and len(self.server_pool) > 1:
+            # No result from the server for too long, move to the next one
+            self.failover = True
+            self.main_loop.quit()
+            return True
+        # Counts this client in the load of its server
+        discovery.heartbeat(self.server_ip)
+        readout = f"[{self.transport_mode}] " + self.transport_stats.summary()
+        if self.frame_gate is not None:
+            readout += "\n" + self.frame_gate.summary()
+        self.status_bar.set_text(readout)
+        return True
 
     def on_message(self, bus, message):
         """Callback for message.
@@ -647,15 +736,24 @@ class ClientWindow:
         elif message.type == Gst.MessageType.ERROR:
             error, debug = message.parse_error()
             logging.warning("[error] %s : %s", error.message, debug)
-            GLib.idle_add(self.status_bar.set_text, "Internal data stream error!")
-            self.unblock_buttons(True)
-            self.connect_server.set_label("Retry connecting to server!")
+            if self.server_pool is not None and len(self.server_pool) > 1:
+                self.failover = True
+            else:
+                GLib.idle_add(self.status_bar.set_text, "Internal data stream error!")
+                self.unblock_buttons(True)
+                self.connect_server.set_label("Retry connecting to server!")
             self.main_loop.quit()
         elif message.type == Gst.MessageType.WARNING:
             error, debug = message.parse_warning()
             logging.warning("[warning] %s : %s", error.message, debug)
         elif message.type == Gst.MessageType.STREAM_START:
             logging.info("received start message")
+        elif message.type == Gst.MessageType.STATE_CHANGED:
+            if message.src == self.pipeline:
+                _, new_state, _ = message.parse_state_changed()
+                if new_state == Gst.State.PLAYING:
+                    launch_profiler.end("playing")
+                    launch_profiler.ready()
         elif message.type == Gst.MessageType.QOS:
             data_format, processed, dropped = message.parse_qos_stats()
             format_str = Gst.Format.get_name(data_format)
@@ -668,13 +766,55 @@ class ClientWindow:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--transport",
+        choices=transport.TRANSPORTS,
+        default="raw",
+        help="Encoding of the frames sent to the server (must match on both sides)",
+    )
+    parser.add_argument(
+        "--jpeg-quality",
+        type=int,
+        default=transport.DEFAULT_JPEG_QUALITY,
+        help="Quality used by the jpeg transport",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Only send frames that changed or when the last result is too old",
+    )
+    parser.add_argument(
+        "--change-threshold",
+        type=float,
+        default=adaptive.DEFAULT_CHANGE_THRESHOLD,
+        help="Inter-frame change (0-1) that triggers a query in adaptive mode",
+    )
+    parser.add_argument(
+        "--deadline-ms",
+        type=int,
+        default=int(adaptive.DEFAULT_DEADLINE * 1000),
+        help="Maximum age of the last result in adaptive mode",
+    )
+    args = parser.parse_args()
+    span_profiler.install()
+
+    ADAPTIVE_OPTIONS = None
+    if args.adaptive:
+        ADAPTIVE_OPTIONS = {
+            "threshold": args.change_threshold,
+            "deadline": args.deadline_ms / 1000,
+        }
+
     PLATFORM = subprocess.check_output(["cat", "/sys/devices/soc0/soc_id"]).decode(
         "utf-8"
     )[:-1]
 
     if PLATFORM in ("i.MX8MP", "i.MX93"):
-        server_application = ServerWindow()
+        server_application = ServerWindow(args.transport)
     else:
-        client_application = ClientWindow()
+        client_application = ClientWindow(
+            args.transport, args.jpeg_quality, ADAPTIVE_OPTIONS
+        )
 
     Gtk.main()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: Apache-2.0
+
+Transport options for the tensors sent from ML Gateway clients to the server.
+
+"raw" ships the 300x300 RGB frame as-is (270 KB per frame), "jpeg" compresses
+it with jpegenc on the client and decodes it with jpegdec on the server before
+tensor_converter. "delta" is a quantized uint8 delta-frame codec that is only
+available in the loopback benchmark (see below).
+
+Run this file directly to compare the transports over a loopback socket:
+
+    python3 transport.py --frames 300 --quality 80 --link-mbps 20
+"""
+
+import argparse
+import io
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+
+TRANSPORTS = ["raw", "jpeg"]
+"""Transports that can be used in the client/server pipelines"""
+
+BENCHMARK_TRANSPORTS = ["raw", "jpeg", "delta"]
+"""Transports measured by the loopback benchmark"""
+
+DEFAULT_JPEG_QUALITY = 80
+"""Default jpegenc quality used by the "jpeg" transport"""
+
+FRAME_WIDTH = 300
+FRAME_HEIGHT = 300
+
+
+def client_encoder(transport, quality=DEFAULT_JPEG_QUALITY):
+    """Returns the pipeline elements placed before tensor_query_client
+
+    Arguments:
+    transport -- one of TRANSPORTS
+    quality -- JPEG quality (only used by the "jpeg" transport)
+    """
+    if transport == "jpeg":
+        return f"jpegenc quality={quality} ! "
+    return ""
+
+
+def server_decoder(transport, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """Returns the caps/elements placed after tensor_query_serversrc
+
+    The output is always RGB video so tensor_converter sees the same input
+    regardless of the transport used by the clients.
+    """
+    raw_caps = f"video/x-raw,width={width},height={height},format=RGB"
+    if transport == "jpeg":
+        return (
+            f"image/jpeg,width={width},height={height},framerate=0/1 ! "
+            f"jpegdec ! videoconvert ! {raw_caps} ! "
+        )
+    return f"{raw_caps},framerate=0/1 ! "
+
+
+class TransportStats:
+    """Bandwidth and round-trip time of the tensor_query_client
+
+    on_sent() is called from a probe on the sink pad of tensor_query_client
+    and on_result() from a probe on its source pad, both from GStreamer
+    streaming threads.
+    """
+
+    def __init__(self, window=2.0, smoothing=0.2):
+        self.window = window
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.sent = deque()
+        self.pending = {}
+        self.rtt = None
+        self.first_sent = None
+        self.last_sent = None
+        self.last_result = None
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def on_sent(self, size, pts=None):
+        """Registers a query of size bytes"""
+        now = time.monotonic()
+        with self.lock:
+            if self.first_sent is None:
+                self.first_sent = now
+            self.last_sent = now
+            self.sent.append((now, size))
+            self.pending[pts] = now
+            self.frames_sent += 1
+            self.bytes_sent += size
+            # Results for dropped queries never arrive, do not keep them forever
+            while len(self.pending) > 32:
+                self.pending.pop(next(iter(self.pending)))
+
+    def on_result(self, pts=None):
+        """Registers a result coming back from the server"""
+        now = time.monotonic()
+        with self.lock:
+            start = self.pending.pop(pts, None)
+            if start is None and self.pending:
+                start = self.pending.pop(next(iter(self.pending)))
+            if start is not None:
+                rtt = now - start
+                if self.rtt is None:
+                    self.rtt = rtt
+                else:
+                    self.rtt += self.smoothing * (rtt - self.rtt)
+            self.last_result = now
+
+    def in_flight(self):
+        """Returns the number of queries still waiting for a result"""
+        with self.lock:
+            return len(self.pending)
+
+    def expire(self, max_age):
+        """Forgets queries sent more than max_age seconds ago"""
+        limit = time.monotonic() - max_age
+        with self.lock:
+            for pts, start in list(self.pending.items()):
+                if start < limit:
+                    del self.pending[pts]
+
+    def stalled(self, timeout, first_timeout=None):
+        """Returns True if queries got no result for more than timeout seconds
+
+        The first result may take first_timeout seconds (timeout by default),
+        as a server compiles its model on the first query.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.last_sent is None:
+                return False
+            reference = self.last_result
+            if reference is None:
+                reference = self.first_sent
+                timeout = first_timeout or timeout
+            return self.last_sent > reference and now - reference > timeout
+
+    def bandwidth(self):
+        """Returns the uplink bandwidth (bytes/s) and frame rate over the window"""
+        now = time.monotonic()
+        with self.lock:
+            while self.sent and now - self.sent[0][0] > self.window:
+                self.sent.popleft()
+            total = sum(size for _, size in self.sent)
+            frames = len(self.sent)
+        return total / self.window, frames / self.window
+
+    def rtt_ms(self):
+        """Returns the smoothed round-trip time in ms, or None"""
+        with self.lock:
+            return None if self.rtt is None else self.rtt * 1000
+
+    def summary(self):
+        """Returns a one line readout for the status bar"""
+        rate, fps = self.bandwidth()
+        rtt = self.rtt_ms()
+        text = f"Uplink: {rate / 1024:7.1f} KB/s ({fps:4.1f} queries/s)"
+        if rtt is not None:
+            text += f" | RTT: {rtt:6.1f} ms"
+        return text
+
+
+def add_query_probes(query_client, stats):
+    """Attaches TransportStats probes to a tensor_query_client element"""
+    # pylint: disable=import-outside-toplevel
+    import gi
+
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst
+
+    def sent_probe(pad, info):
+        buffer = info.get_buffer()
+        stats.on_sent(buffer.get_size(), buffer.pts)
+        return Gst.PadProbeReturn.OK
+
+    def result_probe(pad, info):
+        stats.on_result(info.get_buffer().pts)
+        return Gst.PadProbeReturn.OK
+
+    query_client.get_static_pad("sink").add_probe(
+        Gst.PadProbeType.BUFFER, sent_probe
+    )
+    query_client.get_static_pad("src").add_probe(
+        Gst.PadProbeType.BUFFER, result_probe
+    )
+
+
+class RawCodec:
+    """Frames sent as-is"""
+
+    name = "raw"
+
+    def encode(self, frame):
+        """Returns the payload for frame"""
+        return frame.tobytes()
+
+    def decode(self, payload, shape):
+        """Returns the frame for payload"""
+        return np.frombuffer(payload, dtype=np.uint8).reshape(shape)
+
+
+class JpegCodec:
+    """Frames compressed as JPEG, as jpegenc/jpegdec do in the pipelines"""
+
+    name = "jpeg"
+
+    def __init__(self, quality=DEFAULT_JPEG_QUALITY):
+        self.quality = quality
+        try:
+            # pylint: disable=import-outside-toplevel
+            import cv2
+
+            self.cv2 = cv2
+        except ModuleNotFoundError:
+            self.cv2 = None
+
+    def encode(self, frame):
+        """Returns the payload for frame"""
+        if self.cv2 is not None:
+            _, payload = self.cv2.imencode(
+                ".jpg", frame, [self.cv2.IMWRITE_JPEG_QUALITY, self.quality]
+            )
+            return payload.tobytes()
+        # pylint: disable=import-outside-toplevel
+        from PIL import Image
+
+        output = io.BytesIO()
+        Image.fromarray(frame).save(output, format="JPEG", quality=self.quality)
+        return output.getvalue()
+
+    def decode(self, payload, shape):
+        """Returns the frame for payload"""
+        if self.cv2 is not None:
+            data = np.frombuffer(payload, dtype=np.uint8)
+            return self.cv2.imdecode(data, self.cv2.IMREAD_COLOR).reshape(shape)
+        # pylint: disable=import-outside-toplevel
+        from PIL import Image
+
+        return np.asarray(Image.open(io.BytesIO(payload))).reshape(shape)
+
+
+class DeltaCodec:
+    """Quantized uint8 frames sent as deltas from the previous frame
+
+    Pixels are quantized to 2**bits levels, then the difference with the
+    last frame is deflated. A key frame is sent every key_interval frames so
+    a lost packet cannot corrupt the stream forever. Encoder and decoder keep
+    one reference frame each, so one codec instance serves one stream.
+    """
+
+    name = "delta"
+
+    def __init__(self, bits=5, key_interval=30, level=1):
+        self.shift = 8 - bits
+        self.key_interval = key_interval
+        self.level = level
+        self.encoder_reference = None
+        self.decoder_reference = None
+        self.count = 0
+
+    def encode(self, frame):
+        """Returns the payload for frame"""
+        quantized = frame >> self.shift
+        key = self.encoder_reference is None or self.count % self.key_interval == 0
+        self.count += 1
+        if key:
+            data = quantized
+        else:
+            data = quantized - self.encoder_reference
+        self.encoder_reference = quantized
+        return struct.pack("!B", key) + zlib.compress(data.tobytes(), self.level)
+
+    def decode(self, payload, shape):
+        """Returns the frame for payload"""
+        key = payload[0]
+        data = np.frombuffer(zlib.decompress(payload[1:]), dtype=np.uint8)
+        data = data.reshape(shape)
+        if not key:
+            data = data + self.decoder_reference
+        self.decoder_reference = data
+        return data << self.shift
+
+
+def make_codec(name, quality=DEFAULT_JPEG_QUALITY):
+    """Returns a codec instance for one of BENCHMARK_TRANSPORTS"""
+    if name == "jpeg":
+        return JpegCodec(quality)
+    if name == "delta":
+        return DeltaCodec()
+    return RawCodec()
+
+
+def synthetic_frames(count, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """Yields camera-like frames: a static textured scene with a moving object"""
+    rng = np.random.default_rng(0)
+    y_axis, x_axis = np.mgrid[0:height, 0:width]
+    background = np.stack(
+        [
+            (x_axis * 255 // width),
+            (y_axis * 255 // height),
+            ((x_axis + y_axis) * 127 // (width + height)) + 64,
+        ],
+        axis=-1,
+    ).astype(np.uint8)
+    for index in range(count):
+        frame = background.copy()
+        left = (index * 4) % (width - 60)
+        frame[100:160, left : left + 60] = (220, 40, 40)
+        noise = rng.integers(0, 4, size=frame.shape, dtype=np.uint8)
+        yield frame + noise
+
+
+def _recv_exact(conn, size):
+    """Reads exactly size bytes from conn"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("loopback connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def _loopback_server(listener, codec, shape, decode_times):
+    """Decodes every payload and answers with a small result, like the server"""
+    conn, _ = listener.accept()
+    with conn:
+        while True:
+            header = conn.recv(4, socket.MSG_WAITALL)
+            if len(header) < 4:
+                return
+            (size,) = struct.unpack("!I", header)
+            payload = _recv_exact(conn, size)
+            start = time.perf_counter()
+            codec.decode(payload, shape)
+            decode_times.append(time.perf_counter() - start)
+            conn.sendall(b"\x00" * 64)
+
+
+def loopback_benchmark(transport, frames, quality, link_mbps):
+    """Runs frames through transport over a loopback TCP socket
+
+    Returns a dict with the payload size, codec times, loopback round-trip
+    time and the frame rate a link of link_mbps could sustain.
+    """
+    shape = (FRAME_HEIGHT, FRAME_WIDTH, 3)
+    encoder = make_codec(transport, quality)
+    decoder = make_codec(transport, quality)
+    decode_times = []
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    server = threading.Thread(
+        target=_loopback_server,
+        args=(listener, decoder, shape, decode_times),
+        daemon=True,
+    )
+    server.start()
+
+    sizes = []
+    encode_times = []
+    rtts = []
+    with socket.create_connection(listener.getsockname()) as conn:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for frame in synthetic_frames(frames):
+            start = time.perf_counter()
+            payload = encoder.encode(frame)
+            encoded = time.perf_counter()
+            conn.sendall(struct.pack("!I", len(payload)) + payload)
+            _recv_exact(conn, 64)
+            rtts.append(time.perf_counter() - encoded)
+            encode_times.append(encoded - start)
+            sizes.append(len(payload))
+    server.join()
+    listener.close()
+
+    avg_size = float(np.mean(sizes))
+    return {
+        "transport": transport,
+        "avg_kb": avg_size / 1024,
+        "ratio": (FRAME_WIDTH * FRAME_HEIGHT * 3) / avg_size,
+        "encode_ms": float(np.mean(encode_times)) * 1000,
+        "decode_ms": float(np.mean(decode_times)) * 1000,
+        "rtt_ms": float(np.mean(rtts)) * 1000,
+        "link_fps": (link_mbps * 1e6 / 8) / avg_size,
+    }
+
+
+def main():
+    """Prints a raw vs. compressed transport comparison"""
+    parser = argparse.ArgumentParser(description="ML Gateway transport benchmark")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to send")
+    parser.add_argument(
+        "--quality", type=int, default=DEFAULT_JPEG_QUALITY, help="JPEG quality"
+    )
+    parser.add_argument(
+        "--link-mbps",
+        type=float,
+        default=20.0,
+        help="Link bandwidth used to estimate the sustainable frame rate",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'transport':>9} {'KB/frame':>9} {'ratio':>6} {'enc ms':>7} "
+        f"{'dec ms':>7} {'rtt ms':>7} {'fps@link':>9}"
+    )
+    for transport in BENCHMARK_TRANSPORTS:
+        result = loopback_benchmark(
+            transport, args.frames, args.quality, args.link_mbps
+        )
+        print(
+            f"{result['transport']:>9} {result['avg_kb']:9.1f} "
+            f"{result['ratio']:6.1f} {result['encode_ms']:7.2f} "
+            f"{result['decode_ms']:7.2f} {result['rtt_ms']:7.2f} "
+            f"{result['link_fps']:9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
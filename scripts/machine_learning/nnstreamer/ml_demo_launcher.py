@@ -6,21 +6,61 @@ Copyright 2021-2024 NXP
 SPDX-License-Identifier: BSD-2-Clause
 
 This script launches the NNStreamer ML Demos using a UI to pick settings.
+The pipelines run in this process, and their performance is shown in the
+window.
 """
 
 import os
 import sys
-import threading
-import glob
 import subprocess
 import gi
 import signal
+import threading
+from concurrent.futures import Future
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, GLib, Gio
+from gi.repository import Gtk, Gdk, GLib, Gio
 
 sys.path.append("/home/root/.nxp-demo-experience/scripts/")
 import utils
+import graph_cache
+import vela_cache
+import launch_profiler
+import span_profiler
+import pipeline_runner
+
+MODELS = {
+    "detect": (
+        "ssdlite_mobilenet_v2_coco_no_postprocess.tflite",
+        "ssdlite_mobilenet_v2_coco_quant_uint8_float32_no_postprocess.tflite",
+    ),
+    "id": (
+        "mobilenet_v1_1.0_224.tflite",
+        "mobilenet_v1_1.0_224_quant_uint8_float32.tflite",
+    ),
+    "pose": ("movenet_single_pose_lightning.tflite", "movenet_quant.tflite"),
+}
+"""Model of each demo for CPU/GPU and for NPU"""
+
+DEMO_ASSETS = {
+    "detect": {"labels": "coco_labels_list.txt", "box": "box_priors.txt"},
+    "id": {"labels": "labels_mobilenet_quant_v1_224.txt"},
+    "pose": {"video": "Conditioning_Drill_1-_Power_Jump.webm.480p.vp9.webm"},
+}
+"""Other files used by each demo"""
+
+MAX_STREAMS = 4
+"""Cameras the detection demo can run at once, sharing one model"""
+
+POSE_INFERENCE_FPS = 15
+"""Inference rate of the pose demo, the skeleton is extrapolated in between"""
+
+NO_GRAPH_CACHE = ("i.MX8QM", "i.MX93", "i.MX95")
+"""Platforms without OpenVX graph caching"""
+
+
+class Closing(Exception):
+    """Raised in the preparation of the assets when the launcher closes"""
 
 
 class MLLaunch(Gtk.Window):
@@ -33,7 +73,12 @@ class MLLaunch(Gtk.Window):
         super().__init__(title=demo)
         self.set_default_size(450, 200)
         self.set_resizable(False)
-        self.output_process = 0
+        self.runner = None
+        # Assets are prepared in the background, one job per backend
+        self.prepared = {}
+        self.closing = threading.Event()
+        self.connect("destroy", lambda _: self.closing.set())
+        self.start_pending = False
 
         signal.signal(signal.SIGINT, self.exit)
         signal.signal(signal.SIGTERM, self.exit)
@@ -43,19 +88,14 @@ class MLLaunch(Gtk.Window):
             ["cat", "/sys/devices/soc0/soc_id"]
         ).decode("utf-8")[:-1]
 
-        # OpenVX graph caching is not available on i.MX 8QuadMax platform.
-        if self.platform != ("i.MX8QM", "i.MX93", "i.MX95"):
-            os.environ["VIV_VX_CACHE_BINARY_GRAPH_DIR"] = "/home/root/.cache/gopoint"
-            os.environ["VIV_VX_ENABLE_CACHE_GRAPH_BINARY"] = "1"
-
         # Get widget properties
         devices = []
         if self.demo == "pose":
             if self.platform != "i.MX93":
                 devices.append("Example Video")
 
-        for device in glob.glob("/dev/video*"):
-            devices.append(device)
+        devices += utils.run_check()
+        self.cameras = [device for device in devices if device.startswith("/dev/")]
 
         backends_available = ["CPU"]
         if os.path.exists("/usr/lib/libvx_delegate.so") and self.demo != "pose":
@@ -97,6 +137,11 @@ class MLLaunch(Gtk.Window):
         self.width_label = Gtk.Label.new("Width")
         self.height_label = Gtk.Label.new("Height")
         self.fps_label = Gtk.Label.new("FPS")
+        self.streams_entry = None
+        if self.demo == "detect" and len(self.cameras) > 1:
+            self.streams_entry = Gtk.Scale.new_with_range(
+                Gtk.Orientation.HORIZONTAL, 1, min(len(self.cameras), MAX_STREAMS), 1
+            )
         self.update_time = None
 
         # Organize widgets
@@ -112,6 +157,9 @@ class MLLaunch(Gtk.Window):
         main_grid.attach(device_label, 0, 1, 2, 1)
         device_label.set_hexpand(True)
         main_grid.attach(backend_label, 0, 2, 2, 1)
+        if self.streams_entry is not None:
+            main_grid.attach(Gtk.Label.new("Streams"), 0, 3, 2, 1)
+            main_grid.attach(self.streams_entry, 2, 3, 2, 1)
         if(self.demo != "pose"):
             main_grid.attach(self.width_label, 0, 4, 2, 1)
             main_grid.attach(self.height_label, 0, 5, 2, 1)
@@ -143,8 +191,11 @@ class MLLaunch(Gtk.Window):
         self.width_entry.set_value(640)
         self.height_entry.set_value(480)
         self.fps_entry.set_value(30)
+        if self.streams_entry is not None:
+            self.streams_entry.set_value(1)
 
         self.device_combo.connect("changed", self.on_source_change)
+        self.backend_combo.connect("changed", self.on_backend_change)
         self.launch_button.connect("clicked", self.start)
         quit_button.connect("clicked", self.but_exit)
         if self.demo == "detect":
@@ -159,140 +210,200 @@ class MLLaunch(Gtk.Window):
             header.set_title("NNStreamer Demo")
         header.set_subtitle("NNStreamer Examples")
 
+        # Download and compile before the user clicks Run
+        self.on_backend_change(self.backend_combo)
+
+    def asset_names(self, backend):
+        """Returns the file names of the assets of the demo on backend"""
+        names = dict(DEMO_ASSETS.get(self.demo, {}))
+        if self.platform == "i.MX93":
+            # The example video is not offered on i.MX93
+            names.pop("video", None)
+        cpu_model, npu_model = MODELS[self.demo]
+        names["model"] = npu_model if backend == "NPU" else cpu_model
+        return names
+
+    def prepare_assets(self, backend):
+        """Downloads the assets of backend and compiles its model if needed
+
+        Returns a dict of asset role to path, or the error message.
+        """
+        names = self.asset_names(backend)
+        try:
+            paths, errors = utils.prefetch(list(names.values()), self.check_closing)
+            if errors:
+                return utils.prefetch_error(errors)
+            assets = {role: paths[name] for role, name in names.items()}
+            if self.platform == "i.MX93" and backend == "NPU":
+                self.check_closing()
+                results = vela_cache.compile_models([assets["model"]])
+                if results[0].path is None:
+                    return vela_cache.summary(results)
+                assets["model"] = results[0].path
+        except (OSError, ValueError, subprocess.SubprocessError) as error:
+            return f"Preparing assets failed: {error}"
+        except Closing:
+            return "Launcher closed"
+        return assets
+
+    def check_closing(self, *_):
+        """Stops the preparation of the assets once the launcher closes
+
+        Called with the download progress, so downloads stop at the next
+        chunk and keep their partial file for the next launch.
+        """
+        if self.closing.is_set():
+            raise Closing()
+
+    def run_preparation(self, backend, future):
+        """Sets future to the assets of backend, runs in a daemon thread"""
+        future.set_running_or_notify_cancel()
+        try:
+            assets = self.prepare_assets(backend)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        future.set_result(assets)
+
+    def prepared_assets(self, backend, future):
+        """Returns the assets of a done future, or its error message
+
+        Failed preparations are forgotten, so the next request retries.
+        """
+        error = future.exception()
+        assets = f"Preparing assets failed: {error}" if error else future.result()
+        if isinstance(assets, str) and self.prepared.get(backend) is future:
+            del self.prepared[backend]
+        return assets
+
+    def prefetch(self, backend):
+        """Returns the future of the assets of backend, starting it if needed"""
+        future = self.prepared.get(backend)
+        if future is None:
+            future = Future()
+            # Exiting does not wait for daemon threads
+            threading.Thread(
+                target=self.run_preparation, args=(backend, future), daemon=True
+            ).start()
+            self.prepared[backend] = future
+        return future
+
+    def on_backend_change(self, widget):
+        """Prepares the assets of the selected backend"""
+        backend = self.backend_combo.get_active_text()
+        if backend is None:
+            return
+        future = self.prefetch(backend)
+        if not future.done():
+            self.status_bar.set_text("Preparing assets...")
+        future.add_done_callback(
+            lambda future: GLib.idle_add(self.show_prepared, backend, future)
+        )
+
+    def show_prepared(self, backend, future):
+        """Shows whether the assets of the selected backend are ready"""
+        if self.runner is not None or self.start_pending:
+            return False
+        if backend != self.backend_combo.get_active_text():
+            return False
+        assets = self.prepared_assets(backend, future)
+        self.status_bar.set_text(assets if isinstance(assets, str) else "Ready")
+        return False
+
     def start(self, button):
         """Starts the ML Demo with selected settings"""
         self.update_time = GLib.get_monotonic_time()
-        self.launch_button.set_sensitive(False)
-        if self.demo == "detect":
-            backend = self.backend_combo.get_active_text()
-            if backend != "NPU":
-                model = utils.download_file(
-                    "ssdlite_mobilenet_v2_coco_no_postprocess.tflite"
-                )
-            else:
-                model = utils.download_file(
-                    "ssdlite_mobilenet_v2_coco_quant_uint8_float32_no_postprocess.tflite"
+        backend = self.backend_combo.get_active_text()
+        future = self.prefetch(backend)
+        if not future.done():
+            # Start as soon as the assets are ready
+            if not self.start_pending:
+                self.start_pending = True
+                self.launch_button.set_sensitive(False)
+                self.status_bar.set_text("Preparing assets...")
+                future.add_done_callback(
+                    lambda _: GLib.idle_add(self.start_prepared, button)
                 )
-                if self.platform == "i.MX93":
-                    model = self.compile_vela(model)
-            labels = utils.download_file("coco_labels_list.txt")
-            box = utils.download_file("box_priors.txt")
-            device = self.device_combo.get_active_text()
-        if self.demo == "id":
-            backend = self.backend_combo.get_active_text()
-            if backend != "NPU":
-                model = utils.download_file(
-                    "mobilenet_v1_1.0_224.tflite"
-                )
-            else:
-                model = utils.download_file(
-                    "mobilenet_v1_1.0_224_quant_uint8_float32.tflite"
-                )
-                if self.platform == "i.MX93":
-                    model = self.compile_vela(model)
-            labels = utils.download_file("labels_mobilenet_quant_v1_224.txt")
-            box = 0
-            device = self.device_combo.get_active_text()
-        if self.demo == "pose":
-            backend = self.backend_combo.get_active_text()
-            if backend != "NPU":
-                model = utils.download_file(
-                    "movenet_single_pose_lightning.tflite"
-                )
-            else:
-                model = utils.download_file(
-                    "movenet_quant.tflite"
-                )
-                if self.platform == "i.MX93":
-                    model = self.compile_vela(model)
-            labels = 0
-            box = 0
-            device = self.device_combo.get_active_text()
-            if device == "Example Video":
-                device = utils.download_file(
-                    "Conditioning_Drill_1-_Power_Jump.webm.480p.vp9.webm"
-                )
-
-        if model == -1 or labels == -1 or device == -1 or box == -1:
-            self.status_bar.set_text("Cannot find files!")
-            self.launch_button.set_sensitive(True)
-            return
+            return False
+        self.launch_button.set_sensitive(False)
 
-        if model == -2 or labels == -2 or device == -2 or box == -2:
-            self.status_bar.set_text("Download failed!")
+        assets = self.prepared_assets(backend, future)
+        if isinstance(assets, str):
+            # Try again on the next click
+            self.status_bar.set_text(assets)
             self.launch_button.set_sensitive(True)
-            return
-
-        if model == -3 or labels == -3 or device == -3 or box == -3:
-            self.status_bar.set_text("Downloaded bad file!")
+            return False
+
+        model = assets["model"]
+        labels = assets.get("labels")
+        box = assets.get("box")
+        device = self.device_combo.get_active_text()
+        if device == "Example Video":
+            device = assets["video"]
+        if backend == "NPU" and self.platform not in NO_GRAPH_CACHE:
+            # The NPU graph cached for this model, not a folder shared by all
+            graph_cache.GraphCache().apply([model])
+
+        settings = pipeline_runner.Settings(
+            self.demo,
+            self.backend_combo.get_active_text(),
+            self.platform,
+            device,
+            int(self.width_entry.get_value()),
+            int(self.height_entry.get_value()),
+            int(self.fps_entry.get_value()),
+            model,
+            labels,
+            box,
+            POSE_INFERENCE_FPS if self.demo == "pose" else 0,
+            self.other_streams(device),
+        )
+        self.stop_pipeline()
+        self.runner = pipeline_runner.PipelineRunner(
+            pipeline_runner.describe(settings), self.show_stats, self.on_stop
+        )
+        try:
+            self.runner.start()
+        except GLib.Error as error:
+            self.runner = None
+            self.status_bar.set_text("Cannot start pipeline: " + error.message)
             self.launch_button.set_sensitive(True)
             return
-
-        if self.demo == "detect":
-            command = "CAMERA_WIDTH=\"" + str(int(self.width_entry.get_value())) + "\" "
-            command += "CAMERA_HEIGHT=\"" + str(int(self.height_entry.get_value())) + "\" "
-            command += "CAMERA_FPS=\"" + str(int(self.fps_entry.get_value())) + "\" "
-            command += "BACKEND=\"" + self.backend_combo.get_active_text() + "\" "
-            command += "CAMERA_DEVICE=\"" + device + "\" "
-            command += ("/home/root/.nxp-demo-experience/scripts/machine_learning/"
-                       "nnstreamer/detection/example_detection_mobilenet_ssd_v2_tflite.sh")
-            self.output_process = subprocess.Popen(
-                command,
-                shell=True,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding="utf-8"
-            )
-        if self.demo == "id":
-            command = "CAMERA_WIDTH=\"" + str(int(self.width_entry.get_value())) + "\" "
-            command += "CAMERA_HEIGHT=\"" + str(int(self.height_entry.get_value())) + "\" "
-            command += "CAMERA_FPS=\"" + str(int(self.fps_entry.get_value())) + "\" "
-            command += "BACKEND=\"" + self.backend_combo.get_active_text() + "\" "
-            command += "CAMERA_DEVICE=\"" + device + "\" "
-            command += ("/home/root/.nxp-demo-experience/scripts/machine_learning/"
-                       "nnstreamer/classification/example_classification_mobilenet_v1_tflite.sh")
-            self.output_process = subprocess.Popen(
-                command,
-                shell=True,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding="utf-8"
-            )
-        if self.demo == "pose":
-            command = "BACKEND=\"" + self.backend_combo.get_active_text() + "\" "
-            command += "CAMERA_DEVICE=\"" + device + "\" "
-            if(device.startswith("/dev/")):
-                command += "SOURCE=CAMERA "
-            else:
-                command += "SOURCE=VIDEO "
-            command += ("/home/root/.nxp-demo-experience/scripts/machine_learning/"
-                       "nnstreamer/pose/example_pose_movenet_tflite.py")
-            self.output_process = subprocess.Popen(
-                command,
-                shell=True,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding="utf-8"
-            )
+        if self.runner.running:
+            self.status_bar.set_text("Running...")
+        self.launch_button.set_sensitive(True)
+        return False
+
+    def other_streams(self, device):
+        """Returns the cameras run along with device in multi-stream mode"""
+        if self.streams_entry is None:
+            return ()
+        others = [camera for camera in self.cameras if camera != device]
+        return tuple(others[: int(self.streams_entry.get_value()) - 1])
+
+    def start_prepared(self, button):
+        """Starts the demo once the assets it waited for are ready"""
+        self.start_pending = False
+        return self.start(button)
+
+    def show_stats(self, stats):
+        """Shows the performance of the running pipeline"""
+        self.status_bar.set_text(stats.text())
+
+    def on_stop(self, error):
+        """Shows why the pipeline stopped"""
+        if error is None:
+            self.status_bar.set_text("Pipeline Stopped")
+        else:
+            self.status_bar.set_text("Pipeline Stopped: " + error)
         self.launch_button.set_sensitive(True)
-    
-    def status_update(self, pros):
-        GLib.idle_add(
-                self.launch_button.set_sensitive, False
-            )
-        GLib.idle_add(
-                self.status_bar.set_text, "Running..."
-            )
-        pros.wait()
-        GLib.idle_add(
-                self.status_bar.set_text, "Script Stopped"
-            )
-        GLib.idle_add(
-                self.launch_button.set_sensitive, True
-            )
+
+    def stop_pipeline(self):
+        """Stops the running pipeline, if any"""
+        if self.runner is not None:
+            self.runner.on_stop = None
+            self.runner.stop()
+            self.runner = None
 
     def on_source_change(self, widget):
         """Callback to lock sliders"""
@@ -305,42 +416,15 @@ class MLLaunch(Gtk.Window):
             self.width_entry.set_sensitive(True)
             self.height_entry.set_sensitive(True)
 
-    def compile_vela(self, model):
-        """Compile vela models"""
-        vela_model = self.vela_name(model)
-        if not os.path.exists(vela_model):
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Compiling model with vela and saving to cache...",
-            )
-
-            subprocess.run(
-                "vela " + model + " --output-dir=/home/root/.cache/gopoint/",
-                shell=True,
-                check=True,
-            )
-
-        return vela_model
-
-    def vela_name(self, model_name):
-        """
-        Appends the vela label to model name
-        """
-        tokens = model_name.split(".tflite")
-        return (
-            "/home/root/.cache/gopoint/" + (tokens[-2] + "_vela.tflite").split("/")[-1]
-        )
-    
     def but_exit(self, unused):
         self.exit(None,None)
 
     def exit(self, unused, unused2):
-        if(self.output_process != 0):
-            if(self.demo == "pose"):
-                self.output_process.kill()
-            else:
-                subprocess.run("pkill gst-launch-1.0",
-                shell=True)
+        self.closing.set()
+        self.stop_pipeline()
+        # A vela compilation still running keeps the process a while
+        self.hide()
+        Gdk.Display.get_default().flush()
         exit()
 
 
@@ -353,7 +437,10 @@ if __name__ == "__main__":
     ):
         print("Demos available: detect, id, pose")
     else:
+        span_profiler.install()
         win = MLLaunch(sys.argv[1])
         win.connect("destroy", Gtk.main_quit)
         win.show_all()
+        if launch_profiler.autostart():
+            GLib.idle_add(win.start, None)
         Gtk.main()
\ No newline at end of file
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+
+SPDX-License-Identifier: BSD-2-Clause
+
+This script runs the NNStreamer example pipelines in-process.
+
+The detection, classification and pose estimation pipelines are built with
+Gst.parse_launch instead of running the example shell scripts, so the
+launcher can follow them and stop them cleanly. While a pipeline plays, the
+runner reports once per second the display rate (fpsdisplaysink), the
+inference latency and throughput (tensor_filter) and the buffers dropped
+according to the QoS messages of the bus.
+
+The detection demo can also run several cameras at once. Each stream gets its
+own tensor_filter, but all of them share one model instance through
+shared-tensor-filter-key, so the streams take turns on a single delegate
+context. The results are blended over each stream and the streams are tiled
+on one display; the runner then reports the inference rate of each stream
+and the share of time the shared model is busy.
+
+Usage:
+    python3 pipeline_runner.py "GST-LAUNCH DESCRIPTION"
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from typing import NamedTuple
+import numpy as np
+import gi
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst, GLib
+
+sys.path.append("/home/root/.nxp-demo-experience/scripts/")
+import launch_profiler
+import media_source
+import span_profiler
+import pose_filter
+
+ETHOSU_DELEGATE = "/usr/lib/libethosu_delegate.so"
+
+FLOAT_INPUT = (
+    "tensor_transform mode=arithmetic "
+    "option=typecast:float32,add:-127.5,div:127.5 ! "
+)
+"""Normalization of the float models, quantized models take uint8"""
+
+KEYPOINT_SCORE = 0.3
+"""Keypoints with a lower score are not drawn"""
+
+POSE_EDGES = (
+    (0, 1), (0, 2), (1, 3), (2, 4), (5, 6), (5, 7), (7, 9), (6, 8), (8, 10),
+    (5, 11), (6, 12), (11, 12), (11, 13), (13, 15), (12, 14), (14, 16),
+)  # fmt: skip
+"""Pairs of MoveNet keypoints linked in the skeleton"""
+
+
+class Settings(NamedTuple):
+    """Settings of an example pipeline
+
+    demo -- detect, id or pose
+    device -- camera device, or video file
+    labels -- labels file, unused by pose
+    box_priors -- box priors file, only used by detect
+    inference_fps -- maximum inference rate, 0 to infer every frame
+    sources -- devices of the other streams, only used by detect
+    """
+
+    demo: str
+    backend: str
+    platform: str
+    device: str
+    width: int
+    height: int
+    fps: int
+    model: str
+    labels: str = None
+    box_priors: str = None
+    inference_fps: int = 0
+    sources: tuple = ()
+
+
+class PipelineStats(NamedTuple):
+    """Performance of a playing pipeline
+
+    fps -- frames displayed per second, average_fps since the start
+    inference_ms -- average invoke latency of tensor_filter
+    inference_fps -- outputs per second of tensor_filter
+    dropped -- buffers dropped according to QoS messages
+    jitter_ms -- latest QoS jitter, late buffers are positive
+    streams_fps -- inferences per second of each stream
+    busy -- share of time spent in inference, summed over the streams
+    """
+
+    fps: float
+    average_fps: float
+    inference_ms: float
+    inference_fps: float
+    processed: int
+    dropped: int
+    jitter_ms: float
+    streams_fps: tuple = ()
+    busy: float = 0.0
+
+    def text(self):
+        """Returns the stats as a status line"""
+        text = (
+            f"{self.fps:.1f} FPS (avg {self.average_fps:.1f}) | "
+            f"inference {self.inference_ms:.1f} ms, {self.inference_fps:.1f} IPS | "
+            f"dropped {self.dropped}"
+        )
+        if len(self.streams_fps) > 1:
+            text += (
+                "\nstreams "
+                + " / ".join(f"{fps:.1f}" for fps in self.streams_fps)
+                + f" IPS | busy {self.busy * 100:.0f}%"
+            )
+        return text
+
+
+def filter_options(backend, platform):
+    """Returns the tensor_filter options running backend
+
+    GPU and NPU on VX delegates are selected through USE_GPU_INFERENCE,
+    which is read when the delegate is loaded.
+    """
+    if backend == "GPU":
+        os.environ["USE_GPU_INFERENCE"] = "1"
+        return "custom=Delegate:External,ExtDelegateLib:libvx_delegate.so"
+    if backend == "NPU":
+        if os.path.exists(ETHOSU_DELEGATE):
+            return "custom=Delegate:External,ExtDelegateLib:libethosu_delegate.so"
+        os.environ["USE_GPU_INFERENCE"] = "0"
+        return "custom=Delegate:External,ExtDelegateLib:libvx_delegate.so"
+    return "custom=NumThreads:" + ("2" if platform == "i.MX93" else "4")
+
+
+def converter(platform):
+    """Returns the element scaling and converting video on platform"""
+    if platform == "i.MX93":
+        return "imxvideoconvert_pxp"
+    if Gst.ElementFactory.find("imxvideoconvert_g2d") is not None:
+        return "imxvideoconvert_g2d"
+    return "videoscale ! videoconvert"
+
+
+def compositor(platform):
+    """Returns the element blending the results over the video on platform"""
+    if platform == "i.MX93":
+        return "imxcompositor_pxp"
+    if Gst.ElementFactory.find("imxcompositor_g2d") is not None:
+        return "imxcompositor_g2d"
+    return "compositor"
+
+
+def source(settings):
+    """Returns the source of the pipeline, ending in raw video"""
+    caps = f"video/x-raw,width={settings.width},height={settings.height}"
+    if (settings.device or "").startswith("/dev/"):
+        caps += f",framerate={settings.fps}/1"
+    return media_source.gst_source(settings.device, caps)
+
+
+def inference(settings, size, transform="", name="filter", shared=None):
+    """Returns the branch feeding a size x size RGB frame to tensor_filter
+
+    Arguments:
+    name -- name of the tensor_filter
+    shared -- key of the model instance shared by tensor_filters, if any
+    """
+    rate = ""
+    if settings.inference_fps:
+        rate = f"videorate drop-only=true max-rate={settings.inference_fps} ! "
+    options = filter_options(settings.backend, settings.platform)
+    if shared is not None:
+        options += f" shared-tensor-filter-key={shared}"
+    return (
+        media_source.queue(2) + " ! " + rate + f"{converter(settings.platform)} ! "
+        f"video/x-raw,width={size},height={size},format=RGBA ! "
+        "videoconvert ! video/x-raw,format=RGB ! tensor_converter ! "
+        + transform
+        + f"tensor_filter name={name} framework=tensorflow-lite model={settings.model} "
+        + options
+        + " latency=1 throughput=1 ! "
+    )
+
+
+def boxes(settings):
+    """Returns the decoder drawing the boxes found by the detection model"""
+    return (
+        "tensor_decoder mode=bounding_boxes option1=mobilenet-ssd "
+        f"option2={settings.labels} option3={settings.box_priors}:0.5 "
+        f"option4={settings.width}:{settings.height} option5=300:300 ! "
+    )
+
+
+def tiles(count, width, height):
+    """Returns the (x, y, width, height) of count tiles of a grid
+
+    The grid is as wide as one width x height stream, and the tiles keep
+    the aspect ratio of the streams.
+    """
+    columns = math.ceil(math.sqrt(count))
+    tile_width, tile_height = width // columns, height // columns
+    return [
+        (column * tile_width, row * tile_height, tile_width, tile_height)
+        for row, column in (divmod(i, columns) for i in range(count))
+    ]
+
+
+def describe_streams(settings, sink):
+    """Returns the description of the detection demo on several streams
+
+    The tensor_filter of stream N is named filter_N. Each stream is blended
+    with its boxes by the compositor in its own tile.
+    """
+    float_input = FLOAT_INPUT if settings.backend != "NPU" else ""
+    devices = (settings.device,) + tuple(settings.sources)
+    description = ""
+    pads = ""
+    layout = tiles(len(devices), settings.width, settings.height)
+    for index, (device, tile) in enumerate(zip(devices, layout)):
+        video, overlay = 2 * index, 2 * index + 1
+        description += (
+            f"{source(settings._replace(device=device))} ! tee name=t{index} "
+            f"t{index}. ! "
+            + inference(settings, 300, float_input, f"filter_{index}", "detect")
+            + boxes(settings)
+            + f"mix.sink_{overlay} "
+            f"t{index}. ! {media_source.queue(2)} ! mix.sink_{video} "
+        )
+        for pad, zorder in ((video, 1), (overlay, 2)):
+            x, y, width, height = tile
+            pads += (
+                f"sink_{pad}::xpos={x} sink_{pad}::ypos={y} "
+                f"sink_{pad}::width={width} sink_{pad}::height={height} "
+                f"sink_{pad}::zorder={zorder} "
+            )
+    return (
+        description + f"{compositor(settings.platform)} name=mix latency=33333333 "
+        "min-upstream-latency=33333333 " + pads + "! " + sink
+    )
+
+
+def describe(settings):
+    """Returns the gst-launch description of an example pipeline"""
+    float_input = FLOAT_INPUT if settings.backend != "NPU" else ""
+    sink = (
+        "fpsdisplaysink name=fps_sink text-overlay=false "
+        f"video-sink={media_source.display_element()} "
+        "sync=false signal-fps-measurements=true"
+    )
+    if settings.demo == "detect" and settings.sources:
+        return describe_streams(settings, sink)
+    if settings.demo == "detect":
+        return (
+            f"{source(settings)} ! tee name=t t. ! "
+            + inference(settings, 300, float_input)
+            + boxes(settings)
+            + "mix. "
+            "t. ! queue max-size-buffers=2 ! mix. "
+            f"{compositor(settings.platform)} name=mix latency=33333333 "
+            "min-upstream-latency=33333333 sink_0::zorder=2 sink_1::zorder=1 ! " + sink
+        )
+    if settings.demo == "id":
+        return (
+            f"{source(settings)} ! tee name=t t. ! "
+            + inference(settings, 224, float_input)
+            + f"tensor_decoder mode=image_labeling option1={settings.labels} ! "
+            "overlay.text_sink "
+            "t. ! queue max-size-buffers=2 ! videoconvert ! textoverlay name=overlay "
+            'font-desc="Sans, 24" valignment=top halignment=left ! ' + sink
+        )
+    # MoveNet takes uint8 frames, its keypoints are smoothed and drawn by
+    # PoseOverlay at the display rate
+    return (
+        f"{source(settings)} ! tee name=t t. ! "
+        + inference(settings, 192)
+        + "tensor_sink name=pose_sink "
+        "t. ! queue max-size-buffers=2 ! videoconvert ! "
+        "cairooverlay name=pose_overlay ! videoconvert ! " + sink
+    )
+
+
+class PoseOverlay:
+    """Draws the MoveNet keypoints received from tensor_sink
+
+    Keypoints go through a pose_filter.PoseFilter, and are extrapolated to
+    the timestamp of each frame drawn when inference runs at a lower rate.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = pose_filter.PoseFilter()
+        self.trace = pose_filter.trace_file()
+        self.size = None
+
+    @staticmethod
+    def seconds(timestamp):
+        """Returns a buffer timestamp in seconds"""
+        if timestamp == Gst.CLOCK_TIME_NONE:
+            return time.monotonic()
+        return timestamp / Gst.SECOND
+
+    @span_profiler.traced("pose keypoints")
+    def new_data(self, sink, buffer):
+        """Stores the keypoints of a MoveNet output, (y, x, score) x 17"""
+        memory = buffer.peek_memory(0)
+        result, info = memory.map(Gst.MapFlags.READ)
+        if not result:
+            return
+        try:
+            data = np.frombuffer(info.data, dtype=np.float32)
+            if data.size < pose_filter.JOINTS * 3:
+                return
+            keypoints = data[: pose_filter.JOINTS * 3].reshape(-1, 3).copy()
+        finally:
+            memory.unmap(info)
+        timestamp = self.seconds(buffer.pts)
+        with self.lock:
+            self.filter.update(timestamp, keypoints)
+        if self.trace:
+            pose_filter.append_trace(self.trace, timestamp, keypoints)
+
+    def caps_changed(self, overlay, caps):
+        """Stores the size of the video the keypoints are drawn on"""
+        structure = caps.get_structure(0)
+        self.size = (structure.get_value("width"), structure.get_value("height"))
+
+    @span_profiler.traced("render")
+    def draw(self, overlay, context, timestamp, duration):
+        """Draws the skeleton of the keypoints predicted for the frame"""
+        if self.size is None:
+            return
+        with self.lock:
+            keypoints = self.filter.predict(self.seconds(timestamp))
+        width, height = self.size
+        points = [(x * width, y * height, score) for y, x, score in keypoints]
+        context.set_source_rgb(0, 1, 0)
+        context.set_line_width(3)
+        for first, second in POSE_EDGES:
+            if min(points[first][2], points[second][2]) >= KEYPOINT_SCORE:
+                context.move_to(*points[first][:2])
+                context.line_to(*points[second][:2])
+        context.stroke()
+        for x, y, score in points:
+            if score >= KEYPOINT_SCORE:
+                context.arc(x, y, 5, 0, 2 * np.pi)
+                context.fill()
+        span_profiler.draw(context)
+
+
+class PipelineRunner:
+    """Plays a pipeline in this process and reports its performance
+
+    The callbacks are called from the GLib main loop.
+
+    Arguments:
+    description -- gst-launch description of the pipeline
+    on_stats -- called with the PipelineStats every second
+    on_stop -- called with an error message, or None at the end of stream
+    """
+
+    def __init__(self, description, on_stats=None, on_stop=None):
+        self.description = description
+        self.on_stats = on_stats
+        self.on_stop = on_stop
+        self.pipeline = None
+        self.filters = []
+        self.timer = None
+        self.pose = PoseOverlay()
+        self.fps = (0.0, 0.0)
+        self.qos = {}
+        self.jitter_ms = 0.0
+
+    def start(self):
+        """Starts the pipeline, raises GLib.Error if it cannot be built"""
+        Gst.init(None)
+        self.pipeline = Gst.parse_launch(self.description)
+        self.filters = self.find_filters()
+        for element in self.filters:
+            media_source.watch(element)
+            span_profiler.watch(element, element.get_name() + " invoke")
+
+        fps_sink = self.pipeline.get_by_name("fps_sink")
+        if fps_sink is not None:
+            fps_sink.connect("fps-measurements", self.on_fps)
+        pose_sink = self.pipeline.get_by_name("pose_sink")
+        if pose_sink is not None:
+            pose_sink.connect("new-data", self.pose.new_data)
+            overlay = self.pipeline.get_by_name("pose_overlay")
+            overlay.connect("draw", self.pose.draw)
+            overlay.connect("caps-changed", self.pose.caps_changed)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.on_message)
+        self.timer = GLib.timeout_add_seconds(1, self.report)
+
+        launch_profiler.begin("playing")
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self.stop("Unable to start the pipeline")
+
+    def stop(self, error=None):
+        """Stops the pipeline and releases the camera"""
+        if self.pipeline is None:
+            return
+        GLib.source_remove(self.timer)
+        self.pipeline.get_bus().remove_signal_watch()
+        self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline = None
+        self.filters = []
+        if self.on_stop is not None:
+            self.on_stop(error)
+
+    def find_filters(self):
+        """Returns the tensor_filter of each stream of the pipeline"""
+        single = self.pipeline.get_by_name("filter")
+        if single is not None:
+            return [single]
+        filters = []
+        while True:
+            element = self.pipeline.get_by_name(f"filter_{len(filters)}")
+            if element is None:
+                return filters
+            filters.append(element)
+
+    @property
+    def running(self):
+        """True while the pipeline is started"""
+        return self.pipeline is not None
+
+    def on_fps(self, sink, fps, drop_rate, average_fps):
+        """Stores the rates measured by fpsdisplaysink"""
+        self.fps = (fps, average_fps)
+
+    def stats(self):
+        """Returns the current PipelineStats"""
+        latencies = []
+        rates = []
+        for element in self.filters:
+            try:
+                latency = element.get_property("latency")
+                throughput = element.get_property("throughput")
+            except TypeError:
+                latency = throughput = 0
+            latencies.append(max(latency, 0) / 1000)
+            rates.append(max(throughput, 0) / 1000)
+        return PipelineStats(
+            *self.fps,
+            sum(latencies) / len(latencies) if latencies else 0.0,
+            sum(rates),
+            sum(processed for processed, _ in self.qos.values()),
+            sum(dropped for _, dropped in self.qos.values()),
+            self.jitter_ms,
+            tuple(rates),
+            sum(ms * rate for ms, rate in zip(latencies, rates)) / 1000,
+        )
+
+    def report(self):
+        """Sends the stats to on_stats, keeps the timer while running"""
+        if self.pipeline is None:
+            return False
+        if self.on_stats is not None:
+            self.on_stats(self.stats())
+        return True
+
+    def on_message(self, bus, message):
+        """Follows the state, errors and QoS of the pipeline"""
+        if message.type == Gst.MessageType.EOS:
+            self.stop()
+        elif message.type == Gst.MessageType.ERROR:
+            error, _ = message.parse_error()
+            self.stop(error.message)
+        elif message.type == Gst.MessageType.STATE_CHANGED:
+            if message.src == self.pipeline:
+                _, new_state, _ = message.parse_state_changed()
+                if new_state == Gst.State.PLAYING:
+                    launch_profiler.end("playing")
+                    launch_profiler.ready()
+        elif message.type == Gst.MessageType.QOS:
+            _, processed, dropped = message.parse_qos_stats()
+            jitter, _, _ = message.parse_qos_values()
+            self.qos[message.src.get_name()] = (processed, dropped)
+            self.jitter_ms = jitter / 1000000
+
+
+def main():
+    """Plays the pipeline given in the command line and prints its stats"""
+    if len(sys.argv) != 2:
+        print(__doc__.strip().rsplit("Usage:", 1)[1])
+        sys.exit(1)
+    span_profiler.install()
+    loop = GLib.MainLoop()
+
+    def stopped(error):
+        if error is not None:
+            print("Error:", error)
+        loop.quit()
+
+    runner = PipelineRunner(
+        sys.argv[1], lambda stats: print(stats.text(), flush=True), stopped
+    )
+    runner.start()
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        runner.stop()
+
+
+if __name__ == "__main__":
+    main()
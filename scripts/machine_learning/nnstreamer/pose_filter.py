@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+
+SPDX-License-Identifier: BSD-2-Clause
+
+This script smooths the keypoints of the pose estimation demo.
+
+Each joint goes through a One-Euro filter, which smooths strongly when the
+joint is still and follows it closely when it moves fast, so skeletons stop
+shaking without lagging behind. Joints under a confidence score keep their
+last position for a short time instead of jumping, and then are hidden.
+
+Inference can run at a lower rate than the display: between two inferences
+the joints are extrapolated with the velocity estimated by the filter.
+
+Keypoint traces (one JSON line per inference) are recorded from the demo
+when GOPOINT_POSE_TRACE names a file, and can be replayed here to compare
+the filtered skeleton with the raw one.
+
+Usage:
+    python3 pose_filter.py replay TRACE [--inference-fps 15] [--render-fps 30]
+"""
+
+import argparse
+import json
+import math
+import os
+import numpy as np
+
+TRACE_ENV = "GOPOINT_POSE_TRACE"
+"""Keypoint traces are recorded to the file named by this variable"""
+
+JOINTS = 17
+"""Keypoints of MoveNet, each one (y, x, score) in normalized coordinates"""
+
+SCORE_THRESHOLD = 0.3
+"""Keypoints with a lower score do not update their joint"""
+
+HOLD_TIME = 0.3
+"""Seconds a joint keeps its last position once its score drops"""
+
+MAX_EXTRAPOLATION = 0.1
+"""Seconds a joint is extrapolated past its last inference"""
+
+
+def smoothing(cutoff, elapsed):
+    """Returns the smoothing factor of a low-pass filter at cutoff Hz"""
+    tau = 1 / (2 * math.pi * cutoff)
+    return 1 / (1 + tau / elapsed)
+
+
+class OneEuroFilter:
+    """One-Euro filter of a position
+
+    Arguments:
+    min_cutoff -- cutoff in Hz when still, lower smooths more
+    beta -- increase of the cutoff with speed, higher lags less
+    d_cutoff -- cutoff in Hz of the speed estimate
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=20.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.time = None
+        self.value = None
+        self.speed = None
+
+    def __call__(self, time, value):
+        """Returns the filtered value at time"""
+        value = np.asarray(value, dtype=np.float64)
+        if self.time is None:
+            self.time, self.value, self.speed = time, value, np.zeros_like(value)
+            return value
+        elapsed = time - self.time
+        if elapsed <= 0:
+            return self.value
+        speed = (value - self.value) / elapsed
+        self.speed += smoothing(self.d_cutoff, elapsed) * (speed - self.speed)
+        cutoff = self.min_cutoff + self.beta * float(np.linalg.norm(self.speed))
+        self.value = self.value + smoothing(cutoff, elapsed) * (value - self.value)
+        self.time = time
+        return self.value
+
+    def predict(self, time, horizon=MAX_EXTRAPOLATION):
+        """Returns the value extrapolated to time, at most horizon seconds"""
+        ahead = min(max(time - self.time, 0.0), horizon)
+        return self.value + self.speed * ahead
+
+
+class PoseFilter:
+    """Smooths, gates and extrapolates the keypoints of one person
+
+    Arguments:
+    score_threshold -- keypoints with a lower score do not update their joint
+    hold_time -- seconds a joint is kept once its score drops
+    max_extrapolation -- seconds a joint is extrapolated past its update
+    """
+
+    def __init__(
+        self,
+        score_threshold=SCORE_THRESHOLD,
+        hold_time=HOLD_TIME,
+        max_extrapolation=MAX_EXTRAPOLATION,
+        **filter_options,
+    ):
+        self.score_threshold = score_threshold
+        self.hold_time = hold_time
+        self.max_extrapolation = max_extrapolation
+        self.filters = [OneEuroFilter(**filter_options) for _ in range(JOINTS)]
+        self.scores = np.zeros(JOINTS)
+        self.seen = np.full(JOINTS, -math.inf)
+
+    def update(self, time, keypoints):
+        """Adds the keypoints of an inference made at time"""
+        for joint, (y, x, score) in enumerate(keypoints[:JOINTS]):
+            if score < self.score_threshold:
+                continue
+            self.filters[joint](time, (y, x))
+            self.scores[joint] = score
+            self.seen[joint] = time
+
+    def predict(self, time):
+        """Returns the keypoints to draw at time, as MoveNet gives them
+
+        Joints not seen for longer than the hold time get a score of 0.
+        """
+        keypoints = np.zeros((JOINTS, 3))
+        for joint, joint_filter in enumerate(self.filters):
+            if joint_filter.time is None or time - self.seen[joint] > self.hold_time:
+                continue
+            keypoints[joint, :2] = joint_filter.predict(time, self.max_extrapolation)
+            keypoints[joint, 2] = self.scores[joint]
+        return keypoints
+
+
+def read_trace(path):
+    """Returns (time, keypoints) of each line of a trace file"""
+    trace = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            trace.append((item["time"], np.array(item["keypoints"], dtype=np.float64)))
+    return trace
+
+
+def append_trace(path, time, keypoints):
+    """Appends the keypoints of an inference to a trace file"""
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(
+            json.dumps({"time": time, "keypoints": np.asarray(keypoints).tolist()})
+            + "\n"
+        )
+
+
+def trace_file():
+    """Returns the trace file to record to, None when not recording"""
+    return os.environ.get(TRACE_ENV)
+
+
+def decimate(trace, rate):
+    """Returns the entries of trace kept when inference runs at rate"""
+    if not rate:
+        return list(trace)
+    kept = []
+    for time, keypoints in trace:
+        if not kept or time - kept[-1][0] >= 1 / rate - 1e-6:
+            kept.append((time, keypoints))
+    return kept
+
+
+def replay(trace, inference_fps=15.0, render_fps=30.0, pose_filter=None):
+    """Renders trace with inference decimated to inference_fps
+
+    Returns (raw, filtered) metrics. The raw skeleton shows the last
+    inference as is. Each metric is a dict with the mean error to the full
+    rate trace and the mean jitter (change of speed between frames) of the
+    visible joints, in normalized coordinates.
+    """
+    pose_filter = pose_filter or PoseFilter()
+    inferences = decimate(trace, inference_fps)
+    if not trace or not inferences:
+        return None, None
+    frames = np.arange(trace[0][0], trace[-1][0], 1 / render_fps)
+    truth_times = np.array([time for time, _ in trace])
+    rendered = {"raw": [], "filtered": []}
+    truths = []
+    index = 0
+    last = None
+    for frame in frames:
+        while index < len(inferences) and inferences[index][0] <= frame:
+            last = inferences[index][1]
+            pose_filter.update(*inferences[index])
+            index += 1
+        if last is None:
+            continue
+        truth = trace[int(np.searchsorted(truth_times, frame, side="right")) - 1][1]
+        truths.append(truth)
+        raw = last.copy()
+        raw[raw[:, 2] < pose_filter.score_threshold, 2] = 0.0
+        rendered["raw"].append(raw)
+        rendered["filtered"].append(pose_filter.predict(frame))
+
+    def metrics(frames_keypoints):
+        errors = []
+        jitters = []
+        for i, keypoints in enumerate(frames_keypoints):
+            visible = (keypoints[:, 2] > 0) & (truths[i][:, 2] >= SCORE_THRESHOLD)
+            errors += list(
+                np.linalg.norm(keypoints[visible, :2] - truths[i][visible, :2], axis=1)
+            )
+            if i >= 2:
+                accel = (
+                    keypoints[:, :2]
+                    - 2 * frames_keypoints[i - 1][:, :2]
+                    + frames_keypoints[i - 2][:, :2]
+                )
+                jitters += list(np.linalg.norm(accel[visible], axis=1))
+        return {
+            "error": float(np.mean(errors)) if errors else 0.0,
+            "jitter": float(np.mean(jitters)) if jitters else 0.0,
+        }
+
+    return metrics(rendered["raw"]), metrics(rendered["filtered"])
+
+
+def main():
+    """Command line interface of the pose filter"""
+    parser = argparse.ArgumentParser(description="Pose keypoint filter")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replayer = commands.add_parser("replay", help="Replay a keypoint trace")
+    replayer.add_argument("trace", help="Trace recorded by the pose demo")
+    replayer.add_argument("--inference-fps", type=float, default=15.0)
+    replayer.add_argument("--render-fps", type=float, default=30.0)
+    replayer.add_argument("--min-cutoff", type=float, default=1.0)
+    replayer.add_argument("--beta", type=float, default=20.0)
+    args = parser.parse_args()
+
+    raw, filtered = replay(
+        read_trace(args.trace),
+        args.inference_fps,
+        args.render_fps,
+        PoseFilter(min_cutoff=args.min_cutoff, beta=args.beta),
+    )
+    if raw is None:
+        parser.exit(1, "Empty trace\n")
+    print(f"{'':<9} {'error':>8} {'jitter':>8}")
+    for name, values in (("raw", raw), ("filtered", filtered)):
+        print(f"{name:<9} {values['error']:8.4f} {values['jitter']:8.4f}")
+
+
+if __name__ == "__main__":
+    main()
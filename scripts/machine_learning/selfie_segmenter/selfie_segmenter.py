@@ -24,7 +24,6 @@ and i.MX93 EVKs.
 
 import os
 import sys
-import subprocess
 import threading
 import time
 import re
@@ -46,8 +45,19 @@ from gi.repository import Gst, GLib
 # Import utils
 sys.path.append("/home/root/.nxp-demo-experience/scripts")
 import utils
+import graph_cache
+import vela_cache
+import launch_profiler
+import media_source
+import span_profiler
 
-MODELS_PATH = "/home/root/.cache/gopoint/"
+SELFIE_ASSETS = [
+    "selfie_segmenter_int8.tflite",
+    "background.jpg",
+    "selfie_segmenter_landscape_int8.tflite",
+    "background_landscape.jpg",
+]
+"""Files downloaded by the demo"""
 
 
 def threaded(fn):
@@ -131,6 +141,7 @@ class SelfieSegmenter:
         self.landscape_model = str()
         self.vela_general_model = str()
         self.vela_landscape_model = str()
+        self.graph_cache = None
 
         # Text color
         self.red = None
@@ -168,10 +179,6 @@ class SelfieSegmenter:
         # Check target (i.MX8M Plus vs i.MX93)
         if os.path.exists("/usr/lib/libvx_delegate.so"):
             self.platform = "i.MX8MP"
-            self.cache_enable = (
-                "VIV_VX_ENABLE_CACHE_GRAPH_BINARY='1' "
-                + "VIV_VX_CACHE_BINARY_GRAPH_DIR=/home/root/.cache/gopoint "
-            )
             self.nxp_converter = "imxvideoconvert_g2d"
             self.nxp_compositor = "imxcompositor_g2d"
         elif os.path.exists("/usr/lib/libethosu_delegate.so"):
@@ -304,6 +311,14 @@ class SelfieSegmenter:
         self.progress_bar.set_fraction(0.0)
         return False
 
+    def download_progress(self, done, total):
+        """Shows the progress of the downloads"""
+        if total:
+            GLib.idle_add(
+                self.status_bar.set_text,
+                f"Downloading models and backgrounds... {100 * done // total}%",
+            )
+
     def preload(self):
         """Download the models, compile the models and setup default configuration"""
 
@@ -312,155 +327,32 @@ class SelfieSegmenter:
         self.pulsing = True
         self.timeout_id = GLib.timeout_add(50, self.on_timeout)
 
-        GLib.idle_add(self.status_bar.set_text, "Downloading general model...")
-        self.general_model = utils.download_file("selfie_segmenter_int8.tflite")
+        # Resolve, verify and download models and backgrounds at once
+        paths, errors = utils.prefetch(SELFIE_ASSETS, self.download_progress)
 
         # Verify if download is successfull
-        if self.general_model == -1:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Cannot find files!\n"
-                "Make sure required files are available in downloads database!",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.general_model == -2:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Download failed!\n"
-                "Please make sure you have internet connection on the target and try again.",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.general_model == -3:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Downloaded corrupted file!\n"
-                "Please clean /home/root/.cache/gopoint and try to download again.",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-
-        GLib.idle_add(
-            self.status_bar.set_text, "General model successfully downloaded!"
-        )
-
-        GLib.idle_add(self.status_bar.set_text, "Downloading general background...")
-        self.general_background = utils.download_file("background.jpg")
-
-        # Verify if download is successfull
-        if self.general_background == -1:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Cannot find files!\n"
-                "Make sure required files are available in downloads database!",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.general_background == -2:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Download failed!\n"
-                "Please make sure you have internet connection on the target and try again.",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.general_background == -3:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Downloaded corrupted file!\n"
-                "Please clean /home/root/.cache/gopoint and try to download again.",
-            )
+        if errors:
+            GLib.idle_add(self.status_bar.set_text, utils.prefetch_error(errors))
             self.pulsing = False
             self.unblock_buttons(True)
             return
 
-        GLib.idle_add(
-            self.status_bar.set_text, "General background successfully downloaded!"
-        )
+        self.general_model = paths["selfie_segmenter_int8.tflite"]
+        self.general_background = paths["background.jpg"]
+        self.landscape_model = paths["selfie_segmenter_landscape_int8.tflite"]
+        self.landscape_background = paths["background_landscape.jpg"]
 
-        GLib.idle_add(self.status_bar.set_text, "Downloading landscape model...")
-        self.landscape_model = utils.download_file(
-            "selfie_segmenter_landscape_int8.tflite"
-        )
-
-        # Verify if download is successfull
-        if self.landscape_model == -1:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Cannot find files!\n"
-                "Make sure required files are available in downloads database!",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.landscape_model == -2:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Download failed!\n"
-                "Please make sure you have internet connection on the target and try again.",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.landscape_model == -3:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Downloaded corrupted file!\n"
-                "Please clean /home/root/.cache/gopoint and try to download again.",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-
-        GLib.idle_add(
-            self.status_bar.set_text, "Landscape model successfully downloaded!"
-        )
-
-        GLib.idle_add(self.status_bar.set_text, "Downloading landscape background...")
-        self.landscape_background = utils.download_file("background_landscape.jpg")
-
-        # Verify if download is successfull
-        if self.landscape_background == -1:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Cannot find files!\n"
-                "Make sure required files are available in downloads database!",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.landscape_background == -2:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Download failed!\n"
-                "Please make sure you have internet connection on the target and try again.",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-        if self.landscape_background == -3:
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Downloaded corrupted file!\n"
-                "Please clean /home/root/.cache/gopoint and try to download again.",
-            )
-            self.pulsing = False
-            self.unblock_buttons(True)
-            return
-
-        GLib.idle_add(
-            self.status_bar.set_text, "Landscape background successfully downloaded!"
-        )
+        GLib.idle_add(self.status_bar.set_text, "Models and backgrounds downloaded!")
 
         # Compile model using vela tool for i.MX93
+        ready = True
         if self.platform == "i.MX93":
-            self.compile_vela()
+            ready = self.compile_vela()
+        else:
+            # Compile the NPU graphs while the user picks the settings
+            self.graph_cache = graph_cache.GraphCache()
+            self.graph_cache.evict()
+            self.graph_cache.prewarm([self.general_model, self.landscape_model])
 
         # Create frames for segmentation
         self.condition_frame = np.full(
@@ -477,8 +369,11 @@ class SelfieSegmenter:
         self.background = Image.open(self.general_background)
         self.file_chooser.set_filename(self.general_background)
         self.pulsing = False
-        GLib.idle_add(self.status_bar.set_text, "Application is ready!")
+        if ready:
+            GLib.idle_add(self.status_bar.set_text, "Application is ready!")
         self.unblock_buttons(True)
+        if launch_profiler.autostart():
+            GLib.idle_add(self.start, self.run_button)
 
     def unblock_buttons(self, status):
         """Block/unblock buttons"""
@@ -491,43 +386,17 @@ class SelfieSegmenter:
         self.run_button.set_sensitive(status)
 
     def compile_vela(self):
-        """Compile vela models"""
-        self.vela_general_model = self.vela_name(self.general_model)
-        self.vela_landscape_model = self.vela_name(self.landscape_model)
-        if not os.path.exists(self.vela_general_model):
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Compiling general model with vela and saving to cache...",
-            )
-
-            subprocess.run(
-                "vela "
-                + self.general_model
-                + " --output-dir=/home/root/.cache/gopoint/",
-                shell=True,
-                check=True,
-            )
-
-        if not os.path.exists(self.vela_landscape_model):
-            GLib.idle_add(
-                self.status_bar.set_text,
-                "Compiling general model with vela and saving to cache...",
-            )
-
-            subprocess.run(
-                "vela "
-                + self.landscape_model
-                + " --output-dir=/home/root/.cache/gopoint/",
-                shell=True,
-                check=True,
-            )
-
-    def vela_name(self, model_name):
-        """
-        Appends the vela label to model name
-        """
-        tokens = model_name.split(".tflite")
-        return MODELS_PATH + (tokens[-2] + "_vela.tflite").split("/")[-1]
+        """Compile vela models, returns False if a compilation failed"""
+        GLib.idle_add(
+            self.status_bar.set_text,
+            "Compiling models with vela and saving to cache...",
+        )
+        # Both models are compiled in parallel
+        results = vela_cache.compile_models([self.general_model, self.landscape_model])
+        self.vela_general_model = results[0].path
+        self.vela_landscape_model = results[1].path
+        GLib.idle_add(self.status_bar.set_text, vela_cache.summary(results))
+        return all(result.path is not None for result in results)
 
     @threaded
     def start(self, widget):
@@ -578,14 +447,26 @@ class SelfieSegmenter:
             if self.platform == "i.MX93" and self.backend == "NPU":
                 self.tflite_model = self.vela_landscape_model
 
+        if not self.tflite_model:
+            # Vela compilation failed, the NPU has no model to run
+            GLib.idle_add(
+                self.status_bar.set_text, "No vela model, select the CPU backend!"
+            )
+            self.unblock_buttons(True)
+            return
+
+        # Use the NPU graph cached for the selected model
+        if self.platform == "i.MX8MP" and self.backend == "NPU":
+            self.graph_cache.apply([self.tflite_model])
+
         # Pipeline for background subtraction
         if demo_mode == "Background substitution":
             gst_launch_cmdline = (
                 # Define camera source pipeline
-                "v4l2src device="
-                + device
-                + " ! video/x-raw,width=640,height=480,framerate=30/1 ! "
-                + "aspectratiocrop aspect-ratio="
+                media_source.gst_source(
+                    device, "video/x-raw,width=640,height=480,framerate=30/1"
+                )
+                + " ! aspectratiocrop aspect-ratio="
                 + self.aspect_ratio
                 + " ! "
                 + self.nxp_converter
@@ -594,7 +475,9 @@ class SelfieSegmenter:
                 + ",height="
                 + str(self.video_height)
                 # ML processing using tensor_filter
-                + " ! tee name=t t. ! queue max-size-buffers=1 leaky=2 ! "
+                + " ! tee name=t t. ! "
+                + media_source.queue(1)
+                + " ! "
                 + self.nxp_converter
                 + " ! video/x-raw,width="
                 + str(self.model_width)
@@ -608,7 +491,9 @@ class SelfieSegmenter:
                 + backend
                 + " name=tensor_filter latency=1 ! tensor_sink name=tensor_sink "
                 # Appsink, sends the frame to be processed outside of pipeline
-                + "t. ! queue max-size-buffers=1 leaky=2 ! videoconvert ! video/x-raw,format=RGB ! "
+                + "t. ! "
+                + media_source.queue(1)
+                + " ! videoconvert ! video/x-raw,format=RGB ! "
                 + "appsink name=frame_sink emit-signals=True "
                 # Appsrc, gets the output with background substitution
                 + "appsrc name=result_src is-live=True format=GST_FORMAT_TIME ! "
@@ -617,9 +502,12 @@ class SelfieSegmenter:
                 + ",height="
                 + str(self.video_height)
                 + ",format=RGB,framerate=30/1 ! videoconvert"
-                + " ! cairooverlay name=cairo_text ! queue max-size-buffers=1 leaky=2 ! "
-                + "fpsdisplaysink name=wayland_sink text-overlay=false video-sink=waylandsink "
-                + "sync=false"
+                + " ! cairooverlay name=cairo_text ! "
+                + media_source.queue(1)
+                + " ! "
+                + "fpsdisplaysink name=wayland_sink text-overlay=false video-sink="
+                + media_source.display_element()
+                + " sync=false"
             )
 
             self.pipeline = Gst.parse_launch(gst_launch_cmdline)
@@ -655,12 +543,15 @@ class SelfieSegmenter:
                 )
             gst_launch_cmdline += (
                 "cairooverlay name=cairo_text ! fpsdisplaysink name=wayland_sink "
-                + "text-overlay=false video-sink=waylandsink "
+                + "text-overlay=false video-sink="
+                + media_source.display_element()
+                # Replays run at full speed
+                + (" sync=false " if media_source.headless() else " ")
                 # Define camera source pipeline
-                + "v4l2src device="
-                + device
-                + " ! video/x-raw,width=640,height=480,framerate="
-                + "30/1 ! aspectratiocrop aspect-ratio="
+                + media_source.gst_source(
+                    device, "video/x-raw,width=640,height=480,framerate=30/1"
+                )
+                + " ! aspectratiocrop aspect-ratio="
                 + self.aspect_ratio
                 + " ! "
                 + self.nxp_converter
@@ -669,7 +560,9 @@ class SelfieSegmenter:
                 + ",height="
                 + str(self.video_height)
                 # ML processing using tensor_filter
-                + " ! tee name=t t. ! queue max-size-buffers=1 leaky=2 ! "
+                + " ! tee name=t t. ! "
+                + media_source.queue(1)
+                + " ! "
                 + self.nxp_converter
                 + " ! video/x-raw,width="
                 + str(self.model_width)
@@ -699,13 +592,17 @@ class SelfieSegmenter:
             gst_launch_cmdline += (
                 " ! comp.sink_0 "
                 # Send input frame to compositor
-                + "t. ! queue max-size-buffers=1 leaky=2 ! "
+                + "t. ! "
+                + media_source.queue(1)
+                + " ! "
                 + "comp.sink_1 "
             )
 
             self.pipeline = Gst.parse_launch(gst_launch_cmdline)
 
         self.tensor_filter = self.pipeline.get_by_name("tensor_filter")
+        media_source.watch(self.tensor_filter)
+        span_profiler.watch(self.tensor_filter, "invoke")
         self.wayland_sink = self.pipeline.get_by_name("wayland_sink")
 
         # Draws text information to display
@@ -720,6 +617,7 @@ class SelfieSegmenter:
 
         # Start pipeline
         self.running = True
+        launch_profiler.begin("playing")
         self.pipeline.set_state(Gst.State.PLAYING)
 
         self.main_loop.run()
@@ -741,6 +639,7 @@ class SelfieSegmenter:
         if color == "White":
             self.red = self.blue = self.green = 1
 
+    @span_profiler.traced("push result")
     def on_need_data(self, src, length):
         """Function to send output to GStreamer pipeline using appsrc
 
@@ -764,6 +663,7 @@ class SelfieSegmenter:
             if retval != Gst.FlowReturn.OK:
                 print(retval)
 
+    @span_profiler.traced("frame copy")
     def new_frame(self, sink, buffer):
         """Callback to get frame from appsink
 
@@ -781,6 +681,7 @@ class SelfieSegmenter:
                 dtype=np.uint8,
             )
 
+    @span_profiler.traced("segmentation")
     def new_data(self, sink, buffer):
         """Callback to get tensor output from tensor sink
 
@@ -813,7 +714,9 @@ class SelfieSegmenter:
                 )
 
                 mask_mem.unmap(mask)
+                launch_profiler.ready()
 
+    @span_profiler.traced("render")
     def draw_cb(self, overlay, context, timestamp, duration):
         """Callback to draw text overlay"""
 
@@ -890,6 +793,7 @@ class SelfieSegmenter:
                 self.first_frame = False
 
             context.fill()
+        span_profiler.draw(context, 10, 40)
 
     def prepare_overlay_cb(self, overlay, caps):
         """Store the information from the caps that we are interested in."""
@@ -922,6 +826,11 @@ class SelfieSegmenter:
             print("Here")
         elif message.type == Gst.MessageType.STREAM_START:
             logging.info("received start message")
+        elif message.type == Gst.MessageType.STATE_CHANGED:
+            if message.src == self.pipeline:
+                _, new_state, _ = message.parse_state_changed()
+                if new_state == Gst.State.PLAYING:
+                    launch_profiler.end("playing")
         elif message.type == Gst.MessageType.QOS:
             data_format, processed, dropped = message.parse_qos_stats()
             format_str = Gst.Format.get_name(data_format)
@@ -934,5 +843,6 @@ class SelfieSegmenter:
 
 
 if __name__ == "__main__":
+    span_profiler.install()
     main = SelfieSegmenter()
     gtk.main()
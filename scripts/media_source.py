@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script lets the vision demos run on recorded input.
+
+Demos build their camera source with gst_source instead of writing
+"v4l2src device=..." themselves. When GOPOINT_SOURCE names a video file or
+an image sequence (e.g. frames/%05d.png), that clip replaces the camera:
+files keep their own timestamps and image sequences are stamped at the
+frame rate of the caps, so every run sees the same frames at the same
+timestamps. The queues and appsinks that drop old frames to keep up with a
+camera block instead on recorded input, so every run processes every frame
+of the clip. With GOPOINT_HEADLESS=1 the display sinks are replaced by a
+fakesink that does not sync on the clock, so the clip plays at full speed.
+
+Demos report the latency of each processed frame. As for launch_profiler,
+reports are only written when GOPOINT_FRAME_LOG names a file, so the calls
+cost nothing in normal use.
+
+The replay command starts a demo of the catalog headless on a clip, waits
+until the clip is processed and reports the frame rate and the latency
+percentiles, so regressions can be caught on a build server without camera.
+
+Usage:
+    python3 media_source.py replay ID CLIP [--timeout 120] [--idle 3]
+                                           [--output report.json]
+    python3 media_source.py describe DEVICE [--caps CAPS]
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+import demo_catalog
+import launch_profiler
+
+SOURCE_ENV = "GOPOINT_SOURCE"
+HEADLESS_ENV = "GOPOINT_HEADLESS"
+FRAME_LOG_ENV = "GOPOINT_FRAME_LOG"
+
+DEFAULT_CAPS = "video/x-raw,width=640,height=480,framerate=30/1"
+
+IMAGE_CAPS = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+"""Caps of the image sequences, by file extension"""
+
+FRAMERATE = re.compile(r"framerate=\(?[a-z]*\)?(\d+)/(\d+)")
+
+INDEX = re.compile(r"%0?\d*d")
+"""Index field of an image files pattern"""
+
+PENDING_TIMEOUT = 5.0
+"""Seconds after which a watched buffer is considered dropped"""
+
+
+class Source(NamedTuple):
+    """Video source of a demo
+
+    kind -- camera, video or images
+    location -- device, video file, or image files pattern like "%05d.png"
+    """
+
+    kind: str
+    location: str
+
+
+def resolve(device):
+    """Returns the Source of device, replaced by GOPOINT_SOURCE if it is set"""
+    location = os.environ.get(SOURCE_ENV) or device or ""
+    if location.startswith("/dev/"):
+        return Source("camera", location)
+    if "%" in location:
+        return Source("images", location)
+    return Source("video", location)
+
+
+def replaying():
+    """Returns True if GOPOINT_SOURCE replaces the cameras with a clip"""
+    return bool(os.environ.get(SOURCE_ENV)) and resolve(None).kind != "camera"
+
+
+def headless():
+    """Returns True if the demos should not display anything"""
+    return os.environ.get(HEADLESS_ENV) == "1"
+
+
+def framerate(caps):
+    """Returns the framerate of caps as "N/D", 30/1 if it has none"""
+    match = FRAMERATE.search(caps)
+    return f"{match.group(1)}/{match.group(2)}" if match else "30/1"
+
+
+def first_index(pattern):
+    """Returns the index of the first file of an image files pattern
+
+    ffmpeg numbers extracted frames from 1, other tools from 0.
+    """
+    match = INDEX.search(pattern)
+    if match is None:
+        return 0
+    suffix = len(pattern) - match.end()
+    indices = []
+    for path in glob.glob(glob.escape(pattern[: match.start()]) + "*"):
+        number = path[match.start() : len(path) - suffix]
+        if number.isdigit() and path.endswith(pattern[match.end() :]):
+            indices.append(int(number))
+    return min(indices, default=0)
+
+
+def gst_source(device, caps=DEFAULT_CAPS):
+    """Returns the gst-launch source of device, ending in caps
+
+    Arguments:
+    device -- camera device, video file or image files pattern
+    caps -- raw video caps the demo expects from its camera
+    """
+    source = resolve(device)
+    if source.kind == "camera":
+        return f"v4l2src device={source.location} ! {caps}"
+    if source.kind == "images":
+        image_caps = IMAGE_CAPS.get(
+            os.path.splitext(source.location)[1].lower(), "image/png"
+        )
+        return (
+            f"multifilesrc location={source.location} "
+            f"index={first_index(source.location)} "
+            f"caps={image_caps},framerate={framerate(caps)} ! decodebin ! "
+            f"videoconvert ! videoscale ! {caps}"
+        )
+    # Files keep their own frame rate and timestamps
+    caps = re.sub(r",\s*framerate=[^,]*", "", caps)
+    return (
+        f"filesrc location={source.location} ! decodebin ! videoconvert ! "
+        f"videoscale ! {caps}"
+    )
+
+
+def queue(max_buffers):
+    """Returns a queue of max_buffers frames
+
+    Live demos drop the oldest frames to keep up with the camera, replays
+    block instead.
+    """
+    leaky = "" if replaying() else " leaky=2"
+    return f"queue max-size-buffers={max_buffers}{leaky}"
+
+
+def appsink_limit(max_buffers):
+    """Returns the appsink options keeping max_buffers frames, see queue"""
+    drop = "false" if replaying() else "true"
+    return f"drop={drop} max-buffers={max_buffers}"
+
+
+def video_sink(sink="waylandsink"):
+    """Returns sink, or a fakesink running at full speed when headless"""
+    if headless():
+        return "fakesink sync=false"
+    return sink
+
+
+def display_element():
+    """Returns the video-sink of fpsdisplaysink, a fakesink when headless
+
+    fpsdisplaysink passes its own sync property to this element, so demos
+    already created with sync=false play at full speed.
+    """
+    return "fakesink" if headless() else "waylandsink"
+
+
+class FrameLog:
+    """Reports the latency of the frames processed by a demo
+
+    Arguments:
+    demo -- demo id, read from GOPOINT_DEMO_ID by default
+    path -- log file, read from GOPOINT_FRAME_LOG by default
+    """
+
+    def __init__(self, demo=None, path=None):
+        self.path = path or os.environ.get(FRAME_LOG_ENV)
+        self.demo = demo or os.environ.get(launch_profiler.DEMO_ENV, "unknown")
+        self.lock = threading.Lock()
+        self.file = None
+
+    @property
+    def enabled(self):
+        """True when a log file is set"""
+        return bool(self.path)
+
+    def frame(self, latency_ms):
+        """Reports a frame processed in latency_ms"""
+        if not self.enabled:
+            return
+        line = json.dumps(
+            {"demo": self.demo, "time": time.monotonic(), "latency_ms": latency_ms}
+        )
+        with self.lock:
+            if self.file is None:
+                # Line buffered, so the replay sees each frame as it is done
+                self.file = open(  # pylint: disable=consider-using-with
+                    self.path, "a", encoding="utf-8", buffering=1
+                )
+            self.file.write(line + "\n")
+
+    def watch(self, element):
+        """Reports the time each buffer spends in a GStreamer element
+
+        Buffers are matched by timestamp between the sink and src pads, so
+        elements changing timestamps (e.g. videorate) cannot be watched.
+        """
+        if not self.enabled or element is None:
+            return
+        # pylint: disable=import-outside-toplevel
+        from gi.repository import Gst
+
+        started = {}
+
+        def entered(pad, info):
+            now = time.monotonic()
+            with self.lock:
+                started[info.get_buffer().pts] = now
+                if len(started) > 64:
+                    # Forget the buffers the element dropped
+                    for pts, start in list(started.items()):
+                        if now - start > PENDING_TIMEOUT:
+                            del started[pts]
+            return Gst.PadProbeReturn.OK
+
+        def left(pad, info):
+            with self.lock:
+                start = started.pop(info.get_buffer().pts, None)
+            if start is not None:
+                self.frame((time.monotonic() - start) * 1000)
+            return Gst.PadProbeReturn.OK
+
+        element.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, entered)
+        element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, left)
+
+
+_LOG = None
+_LOG_LOCK = threading.Lock()
+
+
+def frame_log():
+    """Returns the frame log shared by the callers of this process"""
+    global _LOG  # pylint: disable=global-statement
+    with _LOG_LOCK:
+        if _LOG is None:
+            _LOG = FrameLog()
+        return _LOG
+
+
+def frame(latency_ms):
+    """Reports a frame processed in latency_ms to the shared frame log"""
+    frame_log().frame(latency_ms)
+
+
+@contextlib.contextmanager
+def timed_frame():
+    """Reports the time spent in the with block as one frame"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        frame((time.monotonic() - start) * 1000)
+
+
+def watch(element):
+    """Reports the buffers going through element to the shared frame log"""
+    frame_log().watch(element)
+
+
+def read_frames(path):
+    """Returns the frames of a frame log"""
+    frames = []
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    frames.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return frames
+
+
+def percentile(values, fraction):
+    """Returns the percentile of values at fraction, interpolated"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(frames):
+    """Returns the frame rate and latency percentiles of a replay"""
+    if not frames:
+        return {"frames": 0, "fps": 0.0}
+    latencies = [item["latency_ms"] for item in frames]
+    times = [item["time"] for item in frames]
+    duration = max(times) - min(times)
+    return {
+        "frames": len(frames),
+        "fps": (len(frames) - 1) / duration if duration > 0 else 0.0,
+        "mean_ms": statistics.mean(latencies),
+        "p50_ms": percentile(latencies, 0.5),
+        "p90_ms": percentile(latencies, 0.9),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+
+def replay(demo, clip, timeout, idle):
+    """Runs demo headless on clip, returns the frames it processed
+
+    The replay ends when the demo exits, when no frame was processed for
+    idle seconds once frames started coming, or after timeout seconds.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as file:
+        path = file.name
+    env = dict(
+        os.environ,
+        **{
+            SOURCE_ENV: os.path.abspath(clip),
+            HEADLESS_ENV: "1",
+            FRAME_LOG_ENV: path,
+            launch_profiler.DEMO_ENV: demo.id,
+            launch_profiler.AUTOSTART_ENV: "1",
+        },
+    )
+    started = time.monotonic()
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        demo.executable,
+        shell=True,
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    count = 0
+    changed = started
+    try:
+        while time.monotonic() - started < timeout and process.poll() is None:
+            time.sleep(0.2)
+            frames = len(read_frames(path))
+            if frames != count:
+                count, changed = frames, time.monotonic()
+            elif count and time.monotonic() - changed > idle:
+                break
+    finally:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+    frames = read_frames(path)
+    os.remove(path)
+    return frames
+
+
+def run_replay(args):
+    """Replays a clip through a demo of the catalog and prints its stats"""
+    demo = demo_catalog.load(args.catalog).get(args.id)
+    if demo is None:
+        raise SystemExit(f"Unknown demo: {args.id}")
+    if not os.path.exists(args.clip) and "%" not in args.clip:
+        raise SystemExit(f"Clip not found: {args.clip}")
+    print(f"Replaying {args.clip} through {demo.id}...", flush=True)
+    summary = summarize(replay(demo, args.clip, args.timeout, args.idle))
+    if not summary["frames"]:
+        raise SystemExit("No frame was processed")
+    print(
+        f"{summary['frames']} frames, {summary['fps']:.1f} FPS, latency "
+        f"mean {summary['mean_ms']:.2f} ms, p50 {summary['p50_ms']:.2f} ms, "
+        f"p90 {summary['p90_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms"
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {"demo": demo.id, "clip": args.clip, "time": time.time(), **summary},
+                file,
+                indent=1,
+            )
+
+
+def main():
+    """Command line interface of the media sources"""
+    parser = argparse.ArgumentParser(description="Recorded input of the demos")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replayer = commands.add_parser("replay", help="Replay a clip through a demo")
+    replayer.add_argument("id", help="Demo id in the catalog")
+    replayer.add_argument("clip", help="Video file or image files pattern")
+    replayer.add_argument("--catalog", default=demo_catalog.DEMOS_FILE)
+    replayer.add_argument(
+        "--timeout", type=float, default=120, help="Seconds to wait for the demo"
+    )
+    replayer.add_argument(
+        "--idle", type=float, default=3, help="Seconds without frame ending the replay"
+    )
+    replayer.add_argument("--output", help="Write the stats to this file")
+    describer = commands.add_parser("describe", help="Print the source of a device")
+    describer.add_argument("device", help="Camera device, video file or pattern")
+    describer.add_argument("--caps", default=DEFAULT_CAPS)
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        run_replay(args)
+    else:
+        print(gst_source(args.device, args.caps))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,10 @@ video_test and dump the frames onto the selected drive.
 This demo will only work with cameras that work with video_test.
 """
 
-import glob
 import json
 import subprocess
 import os
+import sys
 from datetime import datetime
 import threading
 import gi
@@ -22,6 +22,9 @@ import gi
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, GLib, Gio
 
+sys.path.append("/home/root/.nxp-demo-experience/scripts/")
+import v4l2_devices
+
 
 class VideoDump(Gtk.Window):
     """The GUI window for the launcher."""
@@ -120,7 +123,7 @@ class VideoDump(Gtk.Window):
         self.status_bar = Gtk.Statusbar.new()
         self.status_bar.push(0, "Select a camera to load")
 
-        for camera in glob.glob("/dev/video*"):
+        for camera in v4l2_devices.capture_devices():
             self.device_combo.append_text(camera)
 
         drive_finder = subprocess.run(
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script profiles where the demos spend the time of a frame.
+
+Demos wrap their hot paths (pre-processing, invoke, post-processing,
+rendering) in named spans. Each span records its wall time and the CPU time
+of its thread in a fixed size ring buffer, so a long running demo keeps the
+last spans only and recording does not allocate as frames go by. Nested
+spans are allowed: the self time of a span excludes its nested spans, so
+the Python code around an invoke shows apart from the invoke itself.
+
+As for launch_profiler, nothing is recorded unless the environment asks for
+it, so the calls cost nothing in normal use:
+
+    GOPOINT_SPANS=FILE        records spans and writes them to FILE as a
+                              Chrome trace when the demo exits, %p in FILE
+                              is replaced by the process id
+    GOPOINT_SPAN_OVERLAY=1    records spans and shows the overlay
+
+Work done by GStreamer elements, e.g. the invokes of a tensor_filter, is
+recorded by watch(). Demos drawing with cairo call draw() from their draw
+callback to show the spans of the last seconds on screen. Demos call
+install() from their main thread, then sending SIGUSR2 to the demo toggles
+the overlay. Chrome traces open in chrome://tracing or ui.perfetto.dev, and
+are summarized by the show command.
+
+Usage:
+    python3 span_profiler.py show TRACE [--json FILE]
+"""
+
+import argparse
+import atexit
+import contextlib
+import functools
+import itertools
+import json
+import os
+import signal
+import threading
+import time
+from typing import NamedTuple
+import launch_profiler
+
+SPANS_ENV = "GOPOINT_SPANS"
+OVERLAY_ENV = "GOPOINT_SPAN_OVERLAY"
+
+CAPACITY = 8192
+"""Spans kept in the ring buffer, older ones are overwritten"""
+
+WINDOW = 2.0
+"""Seconds of spans summarized by the overlay"""
+
+REFRESH = 0.5
+"""Seconds between two summaries of the overlay"""
+
+PENDING_NS = 5_000_000_000
+"""Time after which a watched buffer is considered dropped, in ns"""
+
+TOGGLE_SIGNAL = signal.SIGUSR2
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Event(NamedTuple):
+    """Span recorded by a demo, times in ns of CLOCK_MONOTONIC"""
+
+    name: str
+    thread: int
+    start_ns: int
+    end_ns: int
+    cpu_ns: int
+
+
+class Stats(NamedTuple):
+    """Summary of the spans with the same name
+
+    per_second -- spans per second of the summarized time
+    load -- share of the summarized time spent in the span itself
+    """
+
+    name: str
+    calls: int
+    per_second: float
+    mean_ms: float
+    self_ms: float
+    cpu_ms: float
+    load: float
+
+
+class Span:
+    """Records the time spent in a with block"""
+
+    __slots__ = ("profiler", "name", "start", "cpu")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+        self.cpu = 0
+
+    def __enter__(self):
+        self.cpu = time.thread_time_ns()
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *_):
+        end = time.monotonic_ns()
+        self.profiler.record(
+            self.name, self.start, end, time.thread_time_ns() - self.cpu
+        )
+        return False
+
+
+class SpanProfiler:
+    """Records spans in a ring buffer
+
+    Arguments:
+    path -- Chrome trace written at exit, read from GOPOINT_SPANS by default
+    visible -- True to show the overlay, read from GOPOINT_SPAN_OVERLAY
+    capacity -- spans kept in the ring buffer
+    """
+
+    def __init__(self, path=None, visible=None, capacity=CAPACITY):
+        self.path = path or os.environ.get(SPANS_ENV)
+        if visible is None:
+            visible = os.environ.get(OVERLAY_ENV) == "1"
+        self.visible = visible
+        self.enabled = bool(self.path) or visible
+        self.capacity = capacity
+        self.events = [None] * capacity
+        # next() on a count is atomic, so threads record without a lock
+        self.counter = itertools.count()
+        self.summary = ([], 0.0)
+
+    def span(self, name):
+        """Returns a context manager recording the time of its block"""
+        if not self.enabled:
+            return _NO_SPAN
+        return Span(self, name)
+
+    def record(self, name, start_ns, end_ns, cpu_ns=0):
+        """Adds a span to the ring buffer"""
+        slot = next(self.counter) % self.capacity
+        self.events[slot] = Event(name, threading.get_ident(), start_ns, end_ns, cpu_ns)
+
+    def recorded(self, since_ns=0):
+        """Returns the spans in the ring buffer ending after since_ns"""
+        return sorted(
+            (
+                event
+                for event in list(self.events)
+                if event is not None and event.end_ns > since_ns
+            ),
+            key=lambda event: event.start_ns,
+        )
+
+    def toggle(self):
+        """Shows or hides the overlay"""
+        self.visible = not self.visible
+
+    def lines(self):
+        """Returns the text of the overlay, summarized every REFRESH seconds"""
+        stats, updated = self.summary
+        now = time.monotonic()
+        if now - updated >= REFRESH:
+            since = time.monotonic_ns() - int(WINDOW * 1e9)
+            stats = summarize(self.recorded(since), WINDOW)
+            self.summary = (stats, now)
+        return format_stats(stats)
+
+    def draw(self, context, x=10, y=10):
+        """Draws the overlay on a cairo context, if it is visible"""
+        if not self.visible:
+            return
+        # Only called from cairo draw callbacks
+        # pylint: disable=import-outside-toplevel
+        import cairo
+
+        lines = self.lines()
+        context.save()
+        context.select_font_face(
+            "monospace", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL
+        )
+        context.set_font_size(16)
+        width = max(context.text_extents(line).x_advance for line in lines)
+        context.set_source_rgba(0, 0, 0, 0.6)
+        context.rectangle(x, y, width + 16, len(lines) * 20 + 12)
+        context.fill()
+        context.set_source_rgb(1, 1, 1)
+        for row, line in enumerate(lines):
+            context.move_to(x + 8, y + 24 + row * 20)
+            context.show_text(line)
+        context.restore()
+
+    def export(self, path=None):
+        """Writes the spans in the ring buffer to a Chrome trace file"""
+        events = self.recorded()
+        path = (path or self.path or "").replace("%p", str(os.getpid()))
+        if not events or not path:
+            return
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(chrome_trace(events), file)
+
+
+def self_times(events):
+    """Returns the time of each event minus the events nested in it, in ns"""
+    own = [event.end_ns - event.start_ns for event in events]
+    order = sorted(
+        range(len(events)),
+        key=lambda i: (events[i].thread, events[i].start_ns, -events[i].end_ns),
+    )
+    stack = []
+    for i in order:
+        event = events[i]
+        while stack and (
+            events[stack[-1]].thread != event.thread
+            or events[stack[-1]].end_ns <= event.start_ns
+        ):
+            stack.pop()
+        if stack:
+            own[stack[-1]] -= event.end_ns - event.start_ns
+        stack.append(i)
+    return own
+
+
+def summarize(events, duration=None):
+    """Returns the Stats of each span name, the most loaded first
+
+    Arguments:
+    events -- recorded spans
+    duration -- seconds summarized, the time covered by events by default
+    """
+    if not events:
+        return []
+    if duration is None:
+        duration = (
+            max(event.end_ns for event in events)
+            - min(event.start_ns for event in events)
+        ) / 1e9
+    duration = max(duration, 1e-9)
+    totals = {}
+    for event, own in zip(events, self_times(events)):
+        calls, wall, self_ns, cpu = totals.get(event.name, (0, 0, 0, 0))
+        totals[event.name] = (
+            calls + 1,
+            wall + event.end_ns - event.start_ns,
+            self_ns + own,
+            cpu + event.cpu_ns,
+        )
+    stats = [
+        Stats(
+            name,
+            calls,
+            calls / duration,
+            wall / calls / 1e6,
+            self_ns / calls / 1e6,
+            cpu / calls / 1e6,
+            self_ns / 1e9 / duration,
+        )
+        for name, (calls, wall, self_ns, cpu) in totals.items()
+    ]
+    return sorted(stats, key=lambda item: item.load, reverse=True)
+
+
+def format_stats(stats):
+    """Returns the lines of a table of Stats"""
+    lines = [
+        f"{'span':<24} {'/s':>6} {'mean ms':>8} {'self ms':>8} "
+        f"{'cpu ms':>8} {'load':>5}"
+    ]
+    for item in stats:
+        lines.append(
+            f"{item.name[:24]:<24} {item.per_second:6.1f} {item.mean_ms:8.2f} "
+            f"{item.self_ms:8.2f} {item.cpu_ms:8.2f} {item.load:5.0%}"
+        )
+    return lines
+
+
+def chrome_trace(events):
+    """Returns events in the Chrome trace event format"""
+    pid = os.getpid()
+    name = os.environ.get(launch_profiler.DEMO_ENV) or os.path.basename(
+        os.path.realpath(f"/proc/{pid}/exe")
+    )
+    trace = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}]
+    for event in events:
+        trace.append(
+            {
+                "name": event.name,
+                "ph": "X",
+                "pid": pid,
+                "tid": event.thread,
+                "ts": event.start_ns / 1000,
+                "dur": (event.end_ns - event.start_ns) / 1000,
+                "args": {"cpu_ms": event.cpu_ns / 1e6},
+            }
+        )
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def read_trace(path):
+    """Returns the spans of a Chrome trace file"""
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        data = data.get("traceEvents", [])
+    return sorted(
+        (
+            Event(
+                item["name"],
+                item.get("tid", 0),
+                int(item["ts"] * 1000),
+                int((item["ts"] + item["dur"]) * 1000),
+                int(item.get("args", {}).get("cpu_ms", 0) * 1e6),
+            )
+            for item in data
+            if item.get("ph") == "X"
+        ),
+        key=lambda event: event.start_ns,
+    )
+
+
+_PROFILER = None
+_PROFILER_LOCK = threading.Lock()
+
+
+def _terminated(signum, frame):
+    """Writes the trace before the default action of signum"""
+    profiler().export()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def profiler():
+    """Returns the span profiler shared by the callers of this process"""
+    global _PROFILER  # pylint: disable=global-statement
+    with _PROFILER_LOCK:
+        if _PROFILER is None:
+            _PROFILER = SpanProfiler()
+            if _PROFILER.enabled:
+                atexit.register(_PROFILER.export)
+        return _PROFILER
+
+
+def install():
+    """Installs the signal handlers of the profiler
+
+    SIGUSR2 toggles the overlay and SIGTERM writes the trace before the demo
+    exits. Handlers can only be installed from the main thread, while most
+    spans are recorded from streaming threads, so demos call this from
+    their __main__.
+    """
+    current = profiler()
+    if not current.enabled:
+        return
+    signal.signal(TOGGLE_SIGNAL, lambda *_: current.toggle())
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _terminated)
+
+
+def span(name):
+    """Returns a context manager recording its block as span name"""
+    return profiler().span(name)
+
+
+def traced(name):
+    """Decorator recording each call of a function as span name"""
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler().span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def watch(element, name):
+    """Records the time each buffer spends in a GStreamer element as span name
+
+    Buffers are matched by timestamp between the sink and src pads, so the
+    invokes of a tensor_filter show up although they run in native code.
+    """
+    current = profiler()
+    if not current.enabled or element is None:
+        return
+    # Only called by the demos running GStreamer pipelines
+    # pylint: disable=import-outside-toplevel
+    from gi.repository import Gst
+
+    started = {}
+    lock = threading.Lock()
+
+    def entered(pad, info):
+        now = time.monotonic_ns()
+        with lock:
+            started[info.get_buffer().pts] = now
+            if len(started) > 64:
+                # Forget the buffers the element dropped
+                for pts, start in list(started.items()):
+                    if now - start > PENDING_NS:
+                        del started[pts]
+        return Gst.PadProbeReturn.OK
+
+    def left(pad, info):
+        with lock:
+            start = started.pop(info.get_buffer().pts, None)
+        if start is not None:
+            current.record(name, start, time.monotonic_ns())
+        return Gst.PadProbeReturn.OK
+
+    element.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, entered)
+    element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, left)
+
+
+def enabled():
+    """Returns True if spans are recorded"""
+    return profiler().enabled
+
+
+def visible():
+    """Returns True if the overlay is shown"""
+    return profiler().visible
+
+
+def lines():
+    """Returns the text of the overlay, for demos not drawing with cairo"""
+    return profiler().lines()
+
+
+def draw(context, x=10, y=10):
+    """Draws the overlay on a cairo context, if it is visible"""
+    profiler().draw(context, x, y)
+
+
+def main():
+    """Command line interface of the span profiler"""
+    parser = argparse.ArgumentParser(description="Hot path spans of the demos")
+    commands = parser.add_subparsers(dest="command", required=True)
+    shower = commands.add_parser("show", help="Summarize a Chrome trace")
+    shower.add_argument("trace", help="Trace written by a demo")
+    shower.add_argument("--json", help="Write the summary to this file")
+    args = parser.parse_args()
+
+    stats = summarize(read_trace(args.trace))
+    if not stats:
+        parser.exit(1, "Empty trace\n")
+    for line in format_stats(stats):
+        print(line)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump([item._asdict() for item in stats], file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,66 +8,196 @@ This script manages downloads.
 Runs camera setup check.
 """
 
-import glob
-import subprocess
 import json
-from os import mkdir
-from os.path import exists
+import threading
+from os import mkdir, stat
+from os.path import exists, getsize
+from typing import NamedTuple
+import cache_manager
+import download_manager
+import launch_profiler
+import v4l2_devices
+import verification
 
 DOWNLOAD_FOLDER = "/home/root/.cache/gopoint"
 DOWNLOAD_DB = "/home/root/.nxp-demo-experience/downloads.json"
 
 
+class Asset(NamedTuple):
+    """Entry of the DOWNLOAD_DB"""
+
+    name: str
+    url: str
+    alt_url: str = ""
+    sha: str = ""
+    sha256: str = ""
+
+    @property
+    def path(self):
+        """Path of the asset in the DOWNLOAD_FOLDER"""
+        return DOWNLOAD_FOLDER + "/" + self.name
+
+
+_DATABASE = {"path": None, "mtime": None, "assets": {}}
+_DATABASE_LOCK = threading.Lock()
+
+
+def load_database():
+    """Returns the DOWNLOAD_DB as a dict of Asset, parsed once per change"""
+    mtime = stat(DOWNLOAD_DB).st_mtime_ns
+    with _DATABASE_LOCK:
+        if _DATABASE["path"] != DOWNLOAD_DB or _DATABASE["mtime"] != mtime:
+            with open(DOWNLOAD_DB, encoding="utf-8") as downloads_json:
+                database = json.load(downloads_json)
+            _DATABASE["assets"] = {
+                name: Asset(
+                    name,
+                    entries[0]["url"],
+                    entries[0].get("alt_url", ""),
+                    entries[0].get("sha", ""),
+                    entries[0].get("sha256", ""),
+                )
+                for name, entries in database.items()
+            }
+            _DATABASE["path"] = DOWNLOAD_DB
+            _DATABASE["mtime"] = mtime
+        return _DATABASE["assets"]
+
+
+def lookup(file_name):
+    """Returns the Asset of file_name, or None if it is not on list"""
+    return load_database().get(file_name)
+
+
+def verify_file(asset):
+    """Returns the path of a cached asset, or -3 if it does not match its hash
+
+    The file is only hashed again if it changed since it was last verified.
+    """
+    if not verification.verify(asset.path, asset.sha, asset.sha256):
+        return -3
+    return asset.path
+
+
+def reverify_cache(callback=None):
+    """Re-hashes all cached assets in the background, ignoring the sidecars
+
+    Arguments:
+    callback -- Called with the list of paths that do not match their hash
+    """
+    files = [
+        (asset.path, asset.sha, asset.sha256)
+        for asset in load_database().values()
+        if exists(asset.path)
+    ]
+    return verification.reverify(files, callback)
+
+
 def download_file(file_name):
     """Downloads a file from the DOWNLOAD_DB
 
     Arguments:
     file_name -- Name of the file on list
     """
+    return download_files([file_name])[0]
+
 
-    # Parse database
-    url = str()
-    alt_url = str()
-    sha = str()
+def download_files(file_names, progress=None):
+    """Downloads several files from the DOWNLOAD_DB concurrently
 
+    Returns, in order, the path of each file or an error code:
+    -1 if the file is not on list, -2 if the download failed and -3 if the
+    file does not match its hash.
+
+    Arguments:
+    file_names -- Names of the files on list
+    progress -- Called with (bytes done, total bytes) while verifying and
+                downloading
+    """
     # Check if assets folder exists
     if not exists(DOWNLOAD_FOLDER):
         mkdir(DOWNLOAD_FOLDER)
 
-    # Read downloads.json file
-    with open(DOWNLOAD_DB, encoding="utf-8") as downloads_json:
-        database = json.load(downloads_json)
-
-    # Look for requested file
-    if file_name in database:
-        url = database[file_name][0]["url"]
-        alt_url = database[file_name][0]["alt_url"]
-        sha = database[file_name][0]["sha"]
-    else:
-        return -1
-
-    # Check where file exists
-    if exists(DOWNLOAD_FOLDER + "/" + file_name):
-        path = DOWNLOAD_FOLDER + "/" + file_name
-    else:
-        out = subprocess.getstatusoutput(
-            "wget -O  /home/root/.cache/gopoint/" + file_name + " " + url
-        )[0]
-        if out != 0:
-            out = subprocess.getstatusoutput(
-                "wget -O  /home/root/.cache/gopoint/" + file_name + " " + alt_url
-            )[0]
-        if out != 0:
-            return -2
-        path = DOWNLOAD_FOLDER + "/" + file_name
-
-    # SHA1 Check (if available)
-    sha_check = ["sha1sum", path]
-    with subprocess.Popen(sha_check, stdout=subprocess.PIPE) as check_process:
-        if sha != "":
-            if sha != check_process.stdout.read().split()[0].decode("utf-8"):
-                return -3
-        return path
+    results = [None] * len(file_names)
+    pending = []
+    verified = 0
+    with launch_profiler.phase("verify"):
+        for index, file_name in enumerate(file_names):
+            asset = lookup(file_name)
+            if asset is None:
+                results[index] = -1
+            elif exists(asset.path):
+                results[index] = verify_file(asset)
+                verified += getsize(asset.path)
+                if progress is not None:
+                    progress(verified, verified)
+            else:
+                pending.append(index)
+                results[index] = download_manager.Download(
+                    asset.path, [asset.url, asset.alt_url], asset.sha, asset.sha256
+                )
+
+    if not pending:
+        return results
+
+    def report(done, total):
+        progress(verified + done, verified + total)
+
+    # Hash is checked while downloading
+    with launch_profiler.phase("download"):
+        fetched = download_manager.DownloadManager().fetch_all(
+            [results[index] for index in pending],
+            report if progress is not None else None,
+        )
+    for index, result in zip(pending, fetched):
+        if isinstance(result, download_manager.DownloadError):
+            result = result.code
+        results[index] = result
+    return results
+
+
+def prefetch(manifest, progress=None):
+    """Resolves, verifies and downloads all the assets of a demo
+
+    Returns a dict of file name to path for the available assets, and a dict
+    of file name to error code (see download_files) for the others.
+
+    Arguments:
+    manifest -- Names of all the files used by the demo
+    progress -- Called with (bytes done, total bytes) over all the files
+    """
+    paths = {}
+    errors = {}
+    for file_name, result in zip(manifest, download_files(manifest, progress)):
+        if isinstance(result, int):
+            errors[file_name] = result
+        else:
+            paths[file_name] = result
+
+    # Keep the assets of the running demo, evict old ones over the budget
+    manager = cache_manager.CacheManager(DOWNLOAD_FOLDER)
+    manager.pin(paths.values())
+    manager.prune()
+    return paths, errors
+
+
+def prefetch_error(errors):
+    """Returns the message shown to the user for the errors of prefetch"""
+    codes = set(errors.values())
+    if -1 in codes:
+        return (
+            "Cannot find files!\n"
+            "Make sure required files are available in downloads database!"
+        )
+    if -2 in codes:
+        return (
+            "Download failed!\n"
+            "Please make sure you have internet connection on the target and try again."
+        )
+    return (
+        "Downloaded corrupted file!\n"
+        "Please clean /home/root/.cache/gopoint and try to download again."
+    )
 
 
 def run_check():
@@ -75,14 +205,4 @@ def run_check():
     Returns list of device path if camera detected,
     else returns empty list
     """
-    devices = []
-    for device in glob.glob("/dev/video*"):
-        devices.append(device)
-
-    camera = []
-    for device in devices:
-        dev = "v4l2-ctl -d " + device + ' -D | grep "Video Capture" | wc -l'
-        check_output = subprocess.getoutput(dev)
-        if int(check_output) > 0:
-            camera.append(device)
-    return camera
+    return v4l2_devices.capture_devices()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script finds the cameras of the board.
+
+Each /dev/video* node is queried in-process with the VIDIOC_QUERYCAP and
+VIDIOC_ENUM_FMT ioctls, instead of running v4l2-ctl for every node. ISP, VPU
+and memory-to-memory devices are not reported as cameras.
+
+The result is cached for the current boot. As udev does, the cache is
+invalidated when video nodes are added, removed or recreated.
+
+Usage:
+    python3 v4l2_devices.py [--refresh]
+"""
+
+import argparse
+import fcntl
+import glob
+import json
+import os
+import re
+import struct
+import threading
+from typing import NamedTuple
+
+CACHE_FILE = "/home/root/.cache/gopoint/.cameras.json"
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+
+VIDIOC_QUERYCAP = 0x80685600
+"""_IOR('V', 0, struct v4l2_capability)"""
+
+VIDIOC_ENUM_FMT = 0xC0405602
+"""_IOWR('V', 2, struct v4l2_fmtdesc)"""
+
+CAPABILITY = struct.Struct("16s32s32sIII12x")
+FMTDESC = struct.Struct("III32sII12x")
+
+CAP_VIDEO_CAPTURE = 0x00000001
+CAP_VIDEO_CAPTURE_MPLANE = 0x00001000
+CAP_VIDEO_M2M_MPLANE = 0x00004000
+CAP_VIDEO_M2M = 0x00008000
+CAP_DEVICE_CAPS = 0x80000000
+
+BUF_TYPE_VIDEO_CAPTURE = 1
+BUF_TYPE_VIDEO_CAPTURE_MPLANE = 9
+
+
+class Camera(NamedTuple):
+    """Video capture device
+
+    device -- device node, e.g. /dev/video3
+    driver -- name of the kernel driver
+    card -- name of the device
+    bus_info -- location of the device
+    capabilities -- V4L2 device capabilities
+    formats -- FourCC codes of the supported pixel formats
+    """
+
+    device: str
+    driver: str
+    card: str
+    bus_info: str
+    capabilities: int
+    formats: list
+
+
+def fourcc(code):
+    """Returns the FourCC string of a pixel format code"""
+    return struct.pack("<I", code).decode("ascii", "replace").strip()
+
+
+def text(field):
+    """Returns a NUL terminated ioctl string field as str"""
+    return field.split(b"\0", 1)[0].decode("utf-8", "replace")
+
+
+def enum_formats(fd, buf_type):
+    """Returns the FourCC codes of the formats of buf_type"""
+    formats = []
+    for index in range(64):
+        buffer = bytearray(FMTDESC.pack(index, buf_type, 0, b"", 0, 0))
+        try:
+            fcntl.ioctl(fd, VIDIOC_ENUM_FMT, buffer)
+        except OSError:
+            break
+        formats.append(fourcc(FMTDESC.unpack(buffer)[4]))
+    return formats
+
+
+def query_device(device):
+    """Returns the Camera of device, or None if it is not a video capture device"""
+    try:
+        fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        buffer = bytearray(CAPABILITY.size)
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, buffer)
+        driver, card, bus_info, _, capabilities, device_caps = CAPABILITY.unpack(buffer)
+        if capabilities & CAP_DEVICE_CAPS:
+            capabilities = device_caps
+        if capabilities & (CAP_VIDEO_M2M | CAP_VIDEO_M2M_MPLANE):
+            return None
+        if capabilities & CAP_VIDEO_CAPTURE:
+            formats = enum_formats(fd, BUF_TYPE_VIDEO_CAPTURE)
+        elif capabilities & CAP_VIDEO_CAPTURE_MPLANE:
+            formats = enum_formats(fd, BUF_TYPE_VIDEO_CAPTURE_MPLANE)
+        else:
+            return None
+        return Camera(
+            device, text(driver), text(card), text(bus_info), capabilities, formats
+        )
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def video_nodes():
+    """Returns the /dev/video* nodes in numeric order"""
+    return sorted(
+        glob.glob("/dev/video*"),
+        key=lambda node: [
+            int(part) if part.isdigit() else part for part in re.split(r"(\d+)", node)
+        ],
+    )
+
+
+def fingerprint(nodes):
+    """Returns what must not change for the cached cameras to stay valid
+
+    udev recreates the node of a device when it is plugged again, changing
+    its inode and ctime even if it keeps its name.
+    """
+    try:
+        with open(BOOT_ID, encoding="utf-8") as file:
+            boot_id = file.read().strip()
+    except OSError:
+        boot_id = ""
+    state = []
+    for node in nodes:
+        try:
+            stat = os.stat(node)
+        except OSError:
+            continue
+        state.append([node, stat.st_rdev, stat.st_ino, stat.st_ctime_ns])
+    return {"boot_id": boot_id, "nodes": state}
+
+
+_CAMERAS = {"fingerprint": None, "cameras": []}
+_CAMERAS_LOCK = threading.Lock()
+
+
+def read_cache(key):
+    """Returns the cameras cached for fingerprint key, or None"""
+    try:
+        with open(CACHE_FILE, encoding="utf-8") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if cache.get("fingerprint") != key:
+        return None
+    return [Camera(*camera) for camera in cache["cameras"]]
+
+
+def write_cache(key, cameras):
+    """Saves cameras for fingerprint key"""
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        temporary = f"{CACHE_FILE}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"fingerprint": key, "cameras": cameras}, file)
+        os.replace(temporary, CACHE_FILE)
+    except OSError:
+        pass
+
+
+def cameras(refresh=False):
+    """Returns the Camera of each video capture device
+
+    Arguments:
+    refresh -- query the devices even if the cache is up to date
+    """
+    nodes = video_nodes()
+    key = fingerprint(nodes)
+    with _CAMERAS_LOCK:
+        if not refresh and _CAMERAS["fingerprint"] == key:
+            return list(_CAMERAS["cameras"])
+        found = None if refresh else read_cache(key)
+        if found is None:
+            found = [camera for camera in map(query_device, nodes) if camera]
+            write_cache(key, found)
+        _CAMERAS["fingerprint"] = key
+        _CAMERAS["cameras"] = found
+        return list(found)
+
+
+def capture_devices(refresh=False):
+    """Returns the device nodes of the video capture devices"""
+    return [camera.device for camera in cameras(refresh)]
+
+
+def main():
+    """Lists the cameras of the board"""
+    parser = argparse.ArgumentParser(description="V4L2 camera enumeration")
+    parser.add_argument(
+        "--refresh", action="store_true", help="Ignore the cached result"
+    )
+    args = parser.parse_args()
+
+    for camera in cameras(args.refresh):
+        print(
+            f"{camera.device}: {camera.card} ({camera.driver}, {camera.bus_info}) "
+            f"{' '.join(camera.formats)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
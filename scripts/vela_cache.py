@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script compiles models for the Ethos-U NPU with vela and caches them.
+
+Compiled models are keyed by the SHA256 of the input model, the vela version
+and the vela options, so a changed model is never served a stale compilation.
+Several models are compiled in parallel vela processes, and requests for a
+model already being compiled (by this or another process) wait for that
+compilation instead of starting a new one.
+
+The compiled model is also linked with its usual name (model_vela.tflite) in
+the download folder, for the scripts that look it up by name.
+
+Usage:
+    python3 vela_cache.py MODEL [MODEL ...] [--option=--optimise=Performance]
+"""
+
+import argparse
+import fcntl
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+import cache_manager
+import launch_profiler
+
+MODELS_PATH = "/home/root/.cache/gopoint"
+VELA_FOLDER = MODELS_PATH + "/vela"
+
+_VERSION = None
+_VERSION_LOCK = threading.Lock()
+
+
+class VelaResult(NamedTuple):
+    """Compiled model
+
+    model -- input .tflite model
+    path -- compiled model, None if the compilation failed
+    seconds -- compile time, 0 when served from cache
+    cached -- True if the model was already compiled
+    """
+
+    model: str
+    path: str
+    seconds: float
+    cached: bool
+
+
+def vela_version():
+    """Returns the version of the installed vela compiler"""
+    global _VERSION  # pylint: disable=global-statement
+    with _VERSION_LOCK:
+        if _VERSION is None:
+            try:
+                _VERSION = subprocess.run(
+                    ["vela", "--version"], capture_output=True, check=True, text=True
+                ).stdout.strip()
+            except (OSError, subprocess.CalledProcessError):
+                _VERSION = "unknown"
+        return _VERSION
+
+
+def file_sha256(path):
+    """Returns the SHA256 of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def vela_name(model_name, folder=MODELS_PATH):
+    """Returns the usual name of the compiled model in folder"""
+    stem = os.path.basename(model_name).rsplit(".tflite", 1)[0]
+    return os.path.join(folder, stem + "_vela.tflite")
+
+
+def cache_key(model, options=()):
+    """Returns the cache key of model compiled with options"""
+    digest = hashlib.sha256()
+    digest.update(file_sha256(model).encode("utf-8"))
+    digest.update(vela_version().encode("utf-8"))
+    digest.update(" ".join(options).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def link_legacy_name(path, model, folder=MODELS_PATH):
+    """Points folder/model_vela.tflite to the compiled model"""
+    legacy = vela_name(model, folder)
+    if os.path.realpath(legacy) == os.path.realpath(path):
+        return
+    temporary = legacy + ".link"
+    if os.path.lexists(temporary):
+        os.remove(temporary)
+    os.symlink(path, temporary)
+    os.replace(temporary, legacy)
+
+
+def compile_model(model, options=(), folder=VELA_FOLDER, key=None):
+    """Compiles model with vela unless it is cached, returns a VelaResult
+
+    A lock file per cache key makes other processes compiling the same model
+    wait and reuse the result. key is the cache_key of model, when known.
+    """
+    key = key or cache_key(model, options)
+    output_dir = os.path.join(folder, key)
+    path = vela_name(model, output_dir)
+    os.makedirs(folder, exist_ok=True)
+
+    with open(os.path.join(folder, key + ".lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(path):
+            return VelaResult(model, path, 0.0, True)
+
+        start = time.monotonic()
+        work_dir = tempfile.mkdtemp(dir=folder)
+        try:
+            result = subprocess.run(
+                ["vela", model, "--output-dir=" + work_dir, *options],
+                capture_output=True,
+                check=False,
+            )
+            compiled = vela_name(model, work_dir)
+            if result.returncode != 0 or not os.path.exists(compiled):
+                return VelaResult(model, None, time.monotonic() - start, False)
+            # Publish the whole output folder at once
+            os.chmod(work_dir, 0o755)
+            shutil.rmtree(output_dir, ignore_errors=True)
+            os.replace(work_dir, output_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return VelaResult(model, path, time.monotonic() - start, False)
+
+
+class VelaCompiler:
+    """Compiles models in parallel vela processes
+
+    Arguments:
+    workers -- maximum number of vela processes running at the same time
+    folder -- cache folder of the compiled models
+    legacy_folder -- folder where model_vela.tflite links are created
+    """
+
+    def __init__(self, workers=None, folder=VELA_FOLDER, legacy_folder=MODELS_PATH):
+        self.folder = folder
+        self.legacy_folder = legacy_folder
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def submit(self, model, options=()):
+        """Returns a future of the VelaResult of model
+
+        Requests for a model already being compiled share its future.
+        """
+        key = cache_key(model, options)
+        with self.lock:
+            future = self.futures.get(key)
+            if future is None:
+                future = self.executor.submit(self.run, model, tuple(options), key)
+                self.futures[key] = future
+                future.add_done_callback(lambda _: self.forget(key))
+            return future
+
+    def forget(self, key):
+        """Lets later requests of key check the cache again"""
+        with self.lock:
+            self.futures.pop(key, None)
+
+    def run(self, model, options, key=None):
+        """Compiles model and links its usual name"""
+        result = compile_model(model, options, self.folder, key)
+        if result.path is not None:
+            if self.legacy_folder is not None:
+                link_legacy_name(result.path, model, self.legacy_folder)
+            # Keep the compiled model while this demo runs
+            cache_manager.CacheManager(os.path.dirname(self.folder)).pin([result.path])
+        return result
+
+    def compile(self, models, options=()):
+        """Compiles models in parallel, returns their VelaResult in order"""
+        futures = [self.submit(model, options) for model in models]
+        return [future.result() for future in futures]
+
+
+_COMPILER = None
+_COMPILER_LOCK = threading.Lock()
+
+
+def compiler():
+    """Returns the compiler shared by the callers of this process"""
+    global _COMPILER  # pylint: disable=global-statement
+    with _COMPILER_LOCK:
+        if _COMPILER is None:
+            _COMPILER = VelaCompiler()
+        return _COMPILER
+
+
+def compile_models(models, options=()):
+    """Compiles models with the shared compiler, returns their VelaResult"""
+    with launch_profiler.phase("vela"):
+        return compiler().compile(models, options)
+
+
+def summary(results):
+    """Returns a status line with the compile time of results"""
+    failed = [result for result in results if result.path is None]
+    if failed:
+        names = ", ".join(os.path.basename(result.model) for result in failed)
+        return "Vela compilation failed: " + names
+    compiled = {result.path: result for result in results if not result.cached}
+    if not compiled:
+        return "Vela models found in cache"
+    seconds = sum(result.seconds for result in compiled.values())
+    return f"Compiled {len(compiled)} model(s) with vela in {seconds:.1f} s"
+
+
+def main():
+    """Compiles the models given in the command line"""
+    parser = argparse.ArgumentParser(description="Vela compile cache")
+    parser.add_argument("models", nargs="+", help="TFLite models")
+    parser.add_argument(
+        "--option", action="append", default=[], help="Option passed to vela"
+    )
+    args = parser.parse_args()
+
+    for result in compile_models(args.models, args.option):
+        state = "cached" if result.cached else f"{result.seconds:.1f} s"
+        print(f"{result.model}: {result.path} ({state})")
+
+
+if __name__ == "__main__":
+    main()
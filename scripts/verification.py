@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 NXP
+SPDX-License-Identifier: BSD-2-Clause
+
+This script verifies cached assets without re-hashing them on every launch.
+
+After a file is hashed, a sidecar (.<name>.verified) records its size, mtime,
+inode, SHA1 and SHA256. Later checks reuse the recorded hashes as long as the
+file was not replaced or modified, and only hash it again otherwise. A full
+re-verification ignoring the sidecars can run in the background.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+ALGORITHMS = ("sha1", "sha256")
+CHUNK_SIZE = 1 << 20
+
+
+class Hasher:
+    """Computes all ALGORITHMS in a single pass"""
+
+    def __init__(self):
+        self.digests = {name: hashlib.new(name) for name in ALGORITHMS}
+
+    def update(self, data):
+        """Feeds data to all the digests"""
+        for digest in self.digests.values():
+            digest.update(data)
+
+    def hexdigests(self):
+        """Returns a dict of algorithm to hex digest"""
+        return {name: digest.hexdigest() for name, digest in self.digests.items()}
+
+
+def hash_file(path, hasher=None):
+    """Streams the content of path into hasher (a new Hasher by default)"""
+    if hasher is None:
+        hasher = Hasher()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def sidecar_path(path):
+    """Returns the sidecar of path"""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, "." + name + ".verified")
+
+
+def file_identity(path):
+    """Returns the fields telling whether a file changed since it was hashed"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def record(path, hexdigests):
+    """Writes the sidecar of path with its hashes"""
+    sidecar = sidecar_path(path)
+    with open(sidecar + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(dict(file_identity(path), **hexdigests), file)
+    os.replace(sidecar + ".tmp", sidecar)
+
+
+def recorded_hashes(path):
+    """Returns the hashes of the sidecar of path, or None if it is outdated"""
+    try:
+        with open(sidecar_path(path), encoding="utf-8") as file:
+            sidecar = json.load(file)
+        identity = file_identity(path)
+    except (OSError, ValueError):
+        return None
+    if any(sidecar.get(field) != value for field, value in identity.items()):
+        return None
+    return {name: sidecar.get(name) for name in ALGORITHMS}
+
+
+def file_hashes(path, full=False):
+    """Returns the SHA1/SHA256 of path, hashing it only if it changed
+
+    Arguments:
+    path -- file to hash
+    full -- hash the file even if its sidecar is up to date
+    """
+    hashes = None if full else recorded_hashes(path)
+    if hashes is None or None in hashes.values():
+        hashes = hash_file(path).hexdigests()
+        record(path, hashes)
+    return hashes
+
+
+def verify(path, sha1="", sha256="", full=False):
+    """Returns True if path matches the expected hashes (empty ones are skipped)"""
+    hashes = file_hashes(path, full)
+    return (not sha1 or hashes["sha1"] == sha1) and (
+        not sha256 or hashes["sha256"] == sha256
+    )
+
+
+def remove_sidecar(path):
+    """Removes the sidecar of path, if any"""
+    try:
+        os.remove(sidecar_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def reverify(files, callback=None):
+    """Re-hashes files in a background thread, ignoring their sidecars
+
+    Arguments:
+    files -- list of (path, sha1, sha256) to check
+    callback -- called with the list of paths that do not match
+    """
+
+    def run():
+        mismatches = []
+        for path, sha1, sha256 in files:
+            if os.path.exists(path) and not verify(path, sha1, sha256, full=True):
+                mismatches.append(path)
+        if callback is not None:
+            callback(mismatches)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread